@@ -0,0 +1,103 @@
+"""
+age_index.py
+
+功能：
+- Step 3 被试月龄查询：Excel 只读取一次，建立 ID -> 月龄 的哈希索引
+- 索引缓存到磁盘，以工作簿的大小 + 修改时间为键，工作簿未变化时重复运行不再调用 read_excel
+- pandas 只在需要读取 Excel 时导入
+- 年龄段字符串只解析一次，排序成区间边界后用二分查找定位月龄所在的年龄段
+"""
+
+import os
+import json
+import math
+import bisect
+import tempfile
+
+ID_COLUMN = "ID"
+AGE_COLUMN = "month age when scan"
+CACHE_FILE = ".age_index_cache.json"
+
+
+def _workbook_key(file_path):
+    st = os.stat(file_path)
+    return {"path": os.path.abspath(file_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _read_age_table(file_path):
+    """读取 Excel，返回 {ID: 月龄}；ID 重复时与原实现一样取第一行。"""
+    import pandas as pd  # 只在缓存未命中时需要，Step 3 重复运行不再导入 pandas
+    df = pd.read_excel(file_path, dtype={ID_COLUMN: str}, usecols=[ID_COLUMN, AGE_COLUMN])
+    df = df.dropna(subset=[ID_COLUMN]).drop_duplicates(subset=ID_COLUMN, keep="first")
+    ages = pd.to_numeric(df[AGE_COLUMN], errors="coerce")
+    return {sid: (None if math.isnan(age) else float(age)) for sid, age in zip(df[ID_COLUMN], ages)}
+
+
+def load_age_index(file_path, cache_dir=None):
+    """
+    返回 (ID -> 月龄 dict, 是否命中缓存)。月龄缺失或无法解析的被试对应 None。
+
+    cache_dir 为 None 时不使用磁盘缓存。
+    """
+    key = _workbook_key(file_path)
+    cache_path = os.path.join(cache_dir, CACHE_FILE) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                return cached["ages"], True
+        except (OSError, ValueError, KeyError):
+            pass
+
+    ages = _read_age_table(file_path)
+    if cache_path:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "ages": ages}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return ages, False
+
+
+class AgeRanges:
+    """
+    预解析的年龄段列表，区间为左闭右开 [start, end)。
+
+    参数：
+    age_range_list : list of str
+        形如 "48-72" 的年龄段；无法解析的年龄段会打印错误并忽略。
+    """
+
+    def __init__(self, age_range_list):
+        intervals = []
+        for age_range in age_range_list:
+            try:
+                start, end = map(int, age_range.strip().split("-"))
+                intervals.append((start, end, age_range))
+            except Exception as e:
+                print(f"[错误] 解析年龄段失败 {age_range}: {e}")
+        # 按年龄段列表顺序保留，用于区间重叠时的线性查找（与原实现相同：取列表中第一个匹配的年龄段）
+        self.intervals = intervals
+        ordered = sorted(intervals)
+        self.starts = [start for start, _, _ in ordered]
+        self.ends = [end for _, end, _ in ordered]
+        self.names = [name for _, _, name in ordered]
+        self.overlapping = any(self.starts[i + 1] < self.ends[i] for i in range(len(ordered) - 1))
+
+    def find(self, month_val):
+        """返回月龄所在的年龄段名称，不在任何年龄段内时返回 None。"""
+        if month_val is None:
+            return None
+        if self.overlapping:
+            for start, end, name in self.intervals:
+                if start <= month_val < end:
+                    return name
+            return None
+        i = bisect.bisect_right(self.starts, month_val) - 1
+        if i >= 0 and month_val < self.ends[i]:
+            return self.names[i]
+        return None
@@ -2,30 +2,49 @@
 step4.py
 
 功能：
-- 读取 EEG .set 文件，计算 PSD 并生成 topomap
+- 读取 EEG .set 文件，计算 PSD 并生成 topomap（渲染阶段与数值阶段分离，可单独运行或跳过）
 - 计算每个被试的 PSD 均值、与群体的皮尔森相似性
 - 计算每个被试在每个频段区域的 high/low/average 标签
-- 输出合并表格（包含 pearson 相似度与分类标签）
+- 输出合并表格（包含 pearson 相似度与分类标签），以及列式结果表 / 可内存映射的数组特征库
 """
 
 import os
 import sys
 import json
-import mne
+import pickle
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import MinMaxScaler
-from scipy.stats import pearsonr
 import warnings
 import time
 import contextlib
 import io
+import threading
+from collections import defaultdict
+from aggregation import ChannelBandLayout, CLASS_LABELS, region_band_pearson, classify_region_bands
+from cohort_buffer import CohortBuffer
+from cohort_state import CohortState, STATE_FILE, file_signature
+from feature_store import write_feature_store
+from progress import ProgressTracker, emit_stage_times
+from checkpoint import report
+from process_pool import init_worker, resolve_workers
 
 # 忽略 boundary 相关警告
 warnings.filterwarnings("ignore", category=RuntimeWarning, message=".*boundary.*")
 warnings.filterwarnings("ignore", category=RuntimeWarning, message=".*expanding outside the data range.*")
-mne.set_log_level("WARNING") 
+
+# ========== 延迟导入 ==========
+# mne / matplotlib 只在读取原始数据与渲染时导入：PSD 缓存命中或 render=False 时不需要，
+# 导入本模块（如流水线只用到 subject_id_of 与汇总函数）也不必付出这部分启动时间。
+def _mne():
+    import mne
+    mne.set_log_level("WARNING")
+    return mne
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")  # 无界面后端：脚本仅保存图片，可在子进程 / 服务器中运行
+    import matplotlib.pyplot as plt
+    return plt
 
 # ========== 准备频段和区域定义 ==========
 bands = {
@@ -45,167 +64,683 @@ channel_group_hemisphere = {
     'occipital': ['O1', 'Oz', 'O2', 'Pz']
 }
 
+# Welch PSD 参数（同时作为 PSD 缓存键的一部分）
+welch_params = {'method': 'welch', 'fmin': 0, 'fmax': 40}
+
+# ========== 阶段计时 ==========
+# 各阶段累计耗时（秒）。多进程时单被试阶段（load / psd / topo）为各 worker 用时之和。
+stage_times = defaultdict(float)
+_stage_lock = threading.Lock()  # 年龄段汇总在后台线程中运行时，与调度线程同时累计
+
+def add_stage_time(stage, seconds):
+    with _stage_lock:
+        stage_times[stage] += seconds
+
+@contextlib.contextmanager
+def timed(stage):
+    """累计 with 块的耗时到 stage_times[stage]。"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.perf_counter() - t0)
+
+def format_stage_times():
+    return "，".join(f"{stage} {seconds:.2f}s" for stage, seconds in stage_times.items())
+
+# ========== 单被试处理 ==========
+def _psd_key_params(streaming):
+    return dict(welch_params, backend='streaming') if streaming else welch_params
+
+def report_psd_checkpoints(data_dir, file_list, psd_cache, streaming=False, label=""):
+    """
+    Step 4 的断点即被试 PSD 缓存条目：中断后重新运行时，已算完的被试直接命中缓存，不再读取 raw。
+    在主进程中为每个被试计算一次缓存键，统计已有缓存条目的被试数并输出 checkpoint 事件
+    （只 stat 条目文件，不读取缓存内容）。
+
+    返回：
+    与 file_list 对应的缓存键列表（传给 process_subject 的 cache_key，worker 不再重复计算；
+    content 模式下每个文件只哈希一次）；psd_cache 为 None 或文件无法读取时对应位置为 None。
+    """
+    if psd_cache is None:
+        return [None] * len(file_list)
+    key_params = _psd_key_params(streaming)
+    keys = []
+    for file_name in file_list:
+        try:
+            keys.append(psd_cache.make_key(os.path.join(data_dir or "", file_name), key_params))
+        except OSError:
+            keys.append(None)  # 文件已不存在：由处理阶段报错
+    done = sum(1 for key in keys if key is not None and psd_cache.contains(key))
+    report("step4", done, len(file_list), label)
+    return keys
+
+def load_subject_psd(set_path, psd_cache=None, streaming=False, stream_chunk_seconds=30.0, cache_key=None):
+    """
+    读取被试 PSD；若提供 psd_cache 且命中，则直接从缓存读取而不再加载 raw。
+    cache_key 为已计算好的缓存键（见 report_psd_checkpoints），为 None 时在此计算。
+
+    streaming=True 时不使用 preload=True，而是按 stream_chunk_seconds 分块内存映射读取 .fdt，
+    逐块累加 Welch 段功率（见 streaming_psd.py），峰值内存与记录时长无关。
+
+    返回：
+    (psds, freqs, info, cache_hit)
+    """
+    key = cache_key
+    if psd_cache is not None:
+        if key is None:
+            key = psd_cache.make_key(set_path, _psd_key_params(streaming))
+        entry = psd_cache.load(key)
+        if entry is not None:
+            return entry["psds"], entry["freqs"], entry["info"], True
+
+    if streaming:
+        from streaming_psd import stream_welch_psd
+        with timed("psd"):
+            psds, freqs, info = stream_welch_psd(set_path, fmin=welch_params['fmin'], fmax=welch_params['fmax'],
+                                                 chunk_seconds=stream_chunk_seconds)
+    else:
+        # 静默加载 raw 数据，防止 MNE 输出干扰 GUI
+        with timed("load"), contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            raw = _mne().io.read_raw_eeglab(set_path, preload=True, verbose=False)
+
+        with timed("psd"):
+            spectrum = raw.compute_psd(**welch_params)
+            psds, freqs = spectrum.get_data(return_freqs=True)
+        info = raw.info
+
+    if psd_cache is not None:
+        psd_cache.store(key, psds, freqs, info.ch_names, info)
+    return psds, freqs, info, False
+
+def subject_id_of(file_name):
+    """由文件名（或路径）得到被试 ID：文件名中第一个 '_' 之前的部分。"""
+    return os.path.basename(file_name).split('_')[0]
+
+def process_subject(data_dir, file_name, psd_cache=None, streaming=False, stream_chunk_seconds=30.0,
+                    cache_key=None):
+    """
+    处理单个被试（仅数值计算）：读取 .set，计算 Welch PSD 以及 topomap 绘图数值。
+
+    返回：
+    (subject_id, psds, freqs, topo_values, info, cache_hit)
+    其中 topo_values 为 (n_channels, n_bands) 的归一化频段功率，供渲染阶段绘制个体拓扑图。
+    """
+    subject_id = subject_id_of(file_name)
+
+    psds, freqs, info, cache_hit = load_subject_psd(os.path.join(data_dir, file_name), psd_cache,
+                                                    streaming=streaming, stream_chunk_seconds=stream_chunk_seconds,
+                                                    cache_key=cache_key)
+
+    # topomap 数值：每个频点跨通道 MinMax 归一化后，取频段内均值
+    with timed("topo"):
+        psds_normalized = minmax_columns(psds)
+        topo_values = np.zeros((psds.shape[0], len(bands)))
+        for i, (band_name, (fmin, fmax)) in enumerate(bands.items()):
+            idx_band = np.logical_and(freqs >= fmin, freqs <= fmax)
+            topo_values[:, i] = np.mean(psds_normalized[:, idx_band], axis=1)
+
+    return subject_id, psds, freqs, topo_values, info, cache_hit
+
+def _process_subject_timed(data_dir, file_name, psd_cache=None, streaming=False, stream_chunk_seconds=30.0,
+                           cache_key=None):
+    """
+    在 worker 进程中执行 process_subject，同时返回耗时与本次调用的各阶段用时，
+    使主进程的进度统计与 stage_times 包含 worker 内部的 load / psd / topo。
+
+    返回：
+    (process_subject 返回值, 秒, {阶段: 秒})
+    """
+    before = dict(stage_times)
+    t0 = time.perf_counter()
+    result = process_subject(data_dir, file_name, psd_cache, streaming, stream_chunk_seconds, cache_key)
+    seconds = time.perf_counter() - t0
+    return result, seconds, {k: v - before.get(k, 0.0) for k, v in stage_times.items()}
+
+def minmax_columns(X):
+    """
+    逐列（频点）缩放到 [0, 1]，与 sklearn MinMaxScaler().fit_transform(X) 逐位一致，
+    但不需要导入 sklearn。范围小于 10 * eps 的列按范围 1 处理。
+    """
+    X = np.array(X, dtype=np.float32 if np.asarray(X).dtype == np.float32 else np.float64)
+    data_min = np.nanmin(X, axis=0)
+    data_range = np.nanmax(X, axis=0) - data_min
+    data_range[data_range < 10 * np.finfo(X.dtype).eps] = 1.0
+    scale = 1.0 / data_range
+    X *= scale
+    X += 0.0 - data_min * scale
+    return X
+
+def _iter_subject_results(data_dir, file_list, workers=1, blas_threads=1, psd_cache=None,
+                          streaming=False, stream_chunk_seconds=30.0, tracker=None, cache_keys=None):
+    """
+    按 file_list 顺序产出每个被试的处理结果；workers > 1 时使用进程池。
+    tracker（progress.ProgressTracker）不为 None 时每完成一个被试更新一次进度。
+    cache_keys 为与 file_list 对应的 PSD 缓存键（report_psd_checkpoints 的返回值），可为 None。
+    """
+    workers = resolve_workers(workers)
+    if cache_keys is None:
+        cache_keys = [None] * len(file_list)
+    if workers <= 1 or len(file_list) <= 1:
+        for file_name, cache_key in zip(file_list, cache_keys):
+            t0 = time.perf_counter()
+            result = process_subject(data_dir, file_name, psd_cache, streaming, stream_chunk_seconds, cache_key)
+            if tracker is not None:
+                tracker.update(result[0], time.perf_counter() - t0)
+            yield result
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    n_workers = min(workers, len(file_list))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(blas_threads,)) as pool:
+        # executor.map 保持提交顺序，保证 sub_sim.xlsx 中被试顺序与串行一致
+        for result, seconds, stage_delta in pool.map(_process_subject_timed,
+                                                     [data_dir] * len(file_list),
+                                                     file_list,
+                                                     [psd_cache] * len(file_list),
+                                                     [streaming] * len(file_list),
+                                                     [stream_chunk_seconds] * len(file_list),
+                                                     cache_keys):
+            for stage, delta in stage_delta.items():
+                add_stage_time(stage, delta)
+            if tracker is not None:
+                tracker.update(result[0], seconds)
+            yield result
+
 # ========== 主处理函数 ==========
-def run_age_analysis(data_dir, output_dir):
-    assert os.path.isdir(data_dir), f"Invalid data_dir: {data_dir}"
+def run_age_analysis(data_dir, output_dir, workers=1, blas_threads=1, psd_cache=None,
+                     render=True, render_workers=1, streaming=False, stream_chunk_seconds=30.0,
+                     incremental=False, excel=True, table_format="parquet", file_list=None,
+                     psd_dtype="float64", psd_mmap_dir=None):
+    """
+    参数：
+    data_dir : str or None
+        年龄段数据目录；给出 file_list 时可为 None。
+    workers : int
+        并行处理被试的进程数；1 为串行（默认），<= 0 表示使用全部 CPU 核。
+    blas_threads : int
+        每个 worker 允许的 BLAS/OpenMP 线程数。
+    psd_cache : psd_cache.PSDCache or None
+        被试 PSD 磁盘缓存；为 None 时不使用缓存。
+    render : bool
+        是否在数值结果写出后渲染个体拓扑图与 template.jpg；为 False 时仅输出数值，
+        之后可用 render_topomaps(output_dir) 单独渲染。
+    render_workers : int
+        渲染阶段的进程数，含义同 workers。
+    streaming : bool
+        使用分块内存映射的低内存 Welch PSD（不 preload 整段数据）。
+    stream_chunk_seconds : float
+        streaming 模式下每块读取的时长（秒）。
+    incremental : bool
+        增量模式：群体统计状态保存在 output_dir/cohort_state.npz，之后的运行只处理新增
+        （或文件已变化）的被试，并移除 data_dir 中已不存在的被试，再用更新后的群体常模
+        重新计算所有被试的皮尔森相似度与分类标签。
+    excel : bool
+        是否写出 sub_sim.xlsx。
+    table_format : str
+        特征库中结果表的格式：'parquet'（默认）、'feather' 或 'none'。数组特征（.npy）总是写出。
+    file_list : list of str or None
+        显式的 .set 文件列表（如 Step 3 manifest 中该年龄段的文件路径）；相对路径相对于 data_dir。
+        为 None 时列出 data_dir 中的 .set 文件。
+    psd_dtype : str
+        年龄段 PSD 张量的存储精度：'float64'（默认）或 'float32'（内存减半）。
+    psd_mmap_dir : str or None
+        不为 None 时 PSD 张量放在该目录下的临时内存映射文件中（超过内存的大年龄段），见 cohort_buffer.py。
+    """
     os.makedirs(output_dir, exist_ok=True)
 
-    file_list = [f for f in os.listdir(data_dir) if f.endswith('.set')]
+    if file_list is None:
+        file_list = list_subject_files(data_dir)
+    else:
+        file_list = list(file_list)
+        data_dir = data_dir or ""
     if len(file_list) == 0:
         print("No .set files found.")
         return
 
-    psd_all = []
-    psd_band_avg_all = []
-    group_id = []
-    skip_id = []
-
     start_time = time.time()
-    last_print_time = start_time
+    stage_times.clear()
+    label = os.path.basename(os.path.normpath(output_dir))
+
+    state = None
+    file_sigs = None
+    state_path = os.path.join(output_dir, STATE_FILE)
+    if incremental:
+        file_sigs = {subject_id_of(f): file_signature(os.path.join(data_dir, f)) for f in file_list}
+        if os.path.exists(state_path):
+            state = CohortState.load(state_path)
+
+    if state is None:
+        cache_keys = report_psd_checkpoints(data_dir, file_list, psd_cache, streaming, label)
+        tracker = ProgressTracker("step4", len(file_list), label=label)
+        subject_results = _iter_subject_results(
+            data_dir, file_list, workers=workers, blas_threads=blas_threads, psd_cache=psd_cache,
+            streaming=streaming, stream_chunk_seconds=stream_chunk_seconds, tracker=tracker,
+            cache_keys=cache_keys)
+        summarize_age_group(output_dir, subject_results, psd_cache=psd_cache,
+                            render=render, render_workers=render_workers, blas_threads=blas_threads,
+                            file_sigs=file_sigs, excel=excel, table_format=table_format,
+                            n_subjects=len(file_list), psd_dtype=psd_dtype, psd_mmap_dir=psd_mmap_dir)
+        _report_timing(tracker, start_time)
+        return
+
+    # 增量更新：文件指纹变化的被试先移除再重新加入
+    current = {subject_id_of(f): f for f in file_list}
+    removed_ids = [sid for sid, sig in zip(state.subject_ids, state.file_sigs)
+                   if sid not in current or file_sigs[sid] != sig]
+    known_ids = set(state.subject_ids) - set(removed_ids)
+    new_files = [f for sid, f in current.items() if sid not in known_ids]
+    print(f"增量更新: 新增 {len(new_files)} 个被试，移除 {len(removed_ids)} 个被试，"
+          f"沿用 {len(known_ids)} 个被试")
+
+    tracker = ProgressTracker("step4", len(new_files), label=label)
+    subject_results = _iter_subject_results(
+        data_dir, new_files, workers=workers, blas_threads=blas_threads, psd_cache=psd_cache,
+        streaming=streaming, stream_chunk_seconds=stream_chunk_seconds, tracker=tracker)
+    update_age_group(output_dir, state, subject_results, file_sigs, removed_ids, psd_cache=psd_cache,
+                     render=render, render_workers=render_workers, blas_threads=blas_threads,
+                     excel=excel, table_format=table_format,
+                     n_subjects=len(new_files), psd_dtype=psd_dtype, psd_mmap_dir=psd_mmap_dir)
+    _report_timing(tracker, start_time)
+
+def _report_timing(tracker, start_time):
+    """打印年龄段用时、各阶段用时与最慢被试，并输出 stage_end / stages 进度事件。"""
+    tracker.finish()
+    emit_stage_times(tracker.stage, stage_times, label=tracker.label)
+    print(f"年龄段用时 {time.time() - start_time:.1f}s（{format_stage_times()}）")
+    slowest = tracker.slowest()
+    if slowest:
+        print("最慢被试: " + "，".join(f"{sid} {seconds:.2f}s" for sid, seconds in slowest))
+
+def list_subject_files(data_dir, skip_id=()):
+    """列出 data_dir 中待分析的 .set 文件（跳过 skip_id 中的被试）。"""
+    assert os.path.isdir(data_dir), f"Invalid data_dir: {data_dir}"
+    file_list = [f for f in os.listdir(data_dir) if f.endswith('.set')]
+    return [f for f in file_list if subject_id_of(f) not in skip_id]
+
+def _collect_subject_results(subject_results, buffer, psd_cache=None):
+    """
+    把 process_subject 的返回值整理为连续数组：每个被试的 PSD 直接写入预分配的 buffer
+    （cohort_buffer.CohortBuffer）。subject_results 为列表时，已写入的项随即置为 None，
+    释放各被试的 PSD，峰值内存不会是整个年龄段的两倍。
+
+    返回：
+    (group_id, psd_tensor, topo_values_all, ch_names, freqs, info)；psd_tensor 为 buffer.array 视图，
+    没有被试时为 None。
+    """
+    topo_values_all = []
+    group_id = []
 
-    for idx, file_name in enumerate(file_list):
-        subject_id = file_name.split('_')[0]
-        if subject_id in skip_id:
-            continue
+    info = None
+    freqs = None
+    is_list = isinstance(subject_results, list)
+    for i, (subject_id, psds, subj_freqs, topo_values, subj_info, cache_hit) in enumerate(subject_results):
         group_id.append(subject_id)
+        if psd_cache is not None:
+            psd_cache.record(cache_hit)
 
-        # 静默加载 raw 数据，防止 MNE 输出干扰 GUI
-        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
-            raw = mne.io.read_raw_eeglab(os.path.join(data_dir, file_name), preload=True, verbose=False)
-
-        spectrum = raw.compute_psd(method='welch', fmin=0, fmax=40)
-        psds, freqs = spectrum.get_data(return_freqs=True)
-        
-        if 'channel_to_index' not in locals():
-            channel_order = raw.ch_names
-            channel_to_index = {ch: i for i, ch in enumerate(channel_order)}
-
-        # 可视化并保存 topomap
-        scaler = MinMaxScaler()
-        psds_normalized = scaler.fit_transform(psds)
-        fig, axes = plt.subplots(1, len(bands), figsize=(15, 3))
-        psds_person = []
-        for i, (band_name, (fmin, fmax)) in enumerate(bands.items()):
-            idx_band = np.logical_and(freqs >= fmin, freqs <= fmax)
-            psds_band = psds[:, idx_band]
-            psds_person.append(psds_band)
-            psds_band_norm = psds_normalized[:, idx_band]
-            mne.viz.plot_topomap(np.mean(psds_band_norm, axis=1), raw.info, cmap='Reds', axes=axes[i], show=False)
-            axes[i].set_title(f"{band_name} ({fmin}-{fmax}Hz)")
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f"{subject_id}.jpg"))
-        plt.close(fig)
-
-        psd_all.append(psds_person)
-
-        # 计算频段平均功率
-        psd_band_avg = np.zeros((psds.shape[0], len(bands)))
-        for i, (band, (fmin, fmax)) in enumerate(bands.items()):
-            idx = np.logical_and(freqs >= fmin, freqs <= fmax)
-            psd_band_avg[:, i] = np.mean(psds[:, idx], axis=1)
-        psd_band_avg_all.append(psd_band_avg)
-
-    psd_band_avg_all = np.array(psd_band_avg_all)
-    group_psd_band_avg = np.mean(psd_band_avg_all, axis=0)
-
-    def average_region_band_psd(psd_band, region_channels):
-        region_psd = {}
-        for region, ch_names in region_channels.items():
-            idx = [channel_to_index[ch] for ch in ch_names if ch in channel_to_index]
-            if not idx:
-                continue
-            region_psd[region] = np.mean(psd_band[idx, :], axis=0)
-        return region_psd
-
-    group_mean_psd = {band_name: {} for band_name in bands}
-    for b_idx, band_name in enumerate(bands):
-        for region in channel_group_hemisphere:
-            region_psds = []
-            for subj_psd in psd_all:
-                psd_band = subj_psd[b_idx]
-                region_psd = average_region_band_psd(psd_band, channel_group_hemisphere)
-                if region in region_psd:
-                    region_psds.append(region_psd[region])
-            if region_psds:
-                group_mean_psd[band_name][region] = np.mean(region_psds, axis=0)
-
-    pearson_results = []
-    for subj_idx, subj_psd in enumerate(psd_all):
-        subject_id = group_id[subj_idx]
-        sim_entry = {"subject_id": subject_id}
-        for b_idx, band_name in enumerate(bands):
-            region_psd_dict = average_region_band_psd(subj_psd[b_idx], channel_group_hemisphere)
-            for region in region_psd_dict:
-                subj_vector = region_psd_dict[region]
-                group_vector = group_mean_psd[band_name][region]
-                if len(subj_vector) != len(group_vector):
-                    continue
-                corr, _ = pearsonr(subj_vector, group_vector)
-                sim_entry[f"{region}_{band_name}_pearson"] = corr
-        pearson_results.append(sim_entry)
-
-    region_names = list(channel_group_hemisphere.keys())
-    region_band_values = np.zeros((len(group_id), len(region_names), len(bands)))
-    for r_idx, region in enumerate(region_names):
-        ch_indices = [channel_to_index[ch] for ch in channel_group_hemisphere[region] if ch in channel_to_index]
-        region_band_values[:, r_idx, :] = np.mean(psd_band_avg_all[:, ch_indices, :], axis=1)
-
-    region_band_mean = np.mean(region_band_values, axis=0)
-    region_band_std = np.std(region_band_values, axis=0)
-
-    classification = np.empty((len(group_id), len(region_names), len(bands)), dtype=object)
-    for subj in range(len(group_id)):
-        for r_idx in range(len(region_names)):
-            for b_idx in range(len(bands)):
-                val = region_band_values[subj, r_idx, b_idx]
-                mean = region_band_mean[r_idx, b_idx]
-                std = region_band_std[r_idx, b_idx]
-                if val > mean + std:
-                    classification[subj, r_idx, b_idx] = 'high'
-                elif val < mean - std:
-                    classification[subj, r_idx, b_idx] = 'low'
-                else:
-                    classification[subj, r_idx, b_idx] = 'average'
-
-    classification_results = []
-    for subj_idx, subject_id in enumerate(group_id):
-        entry = {"subject_id": subject_id}
-        for r_idx, region in enumerate(region_names):
-            for b_idx, band_name in enumerate(bands):
-                key = f"{region}_{band_name}_class"
-                entry[key] = classification[subj_idx, r_idx, b_idx]
-        classification_results.append(entry)
-
-    fig = plot_band_topomap_norm(group_psd_band_avg, raw)
-    output_path = os.path.join(output_dir, "template.jpg")
+        if info is None:
+            channel_order = subj_info.ch_names
+            freqs = subj_freqs
+        try:
+            buffer.append(psds)
+        except ValueError as e:
+            raise ValueError(f"{subject_id}: {e}")
+        info = subj_info
+        topo_values_all.append(topo_values)
+        if is_list:
+            subject_results[i] = None
+
+    if not group_id:
+        return group_id, None, None, None, None, None
+    return group_id, buffer.array, np.array(topo_values_all), channel_order, freqs, info
+
+def summarize_age_group(output_dir, subject_results, psd_cache=None, render=True, render_workers=1, blas_threads=1,
+                        file_sigs=None, excel=True, table_format="parquet", n_subjects=None,
+                        psd_dtype="float64", psd_mmap_dir=None):
+    """
+    群体统计阶段：汇总一个年龄段所有被试的 process_subject 结果，
+    计算皮尔森相似度与分类标签，写出 sub_sim.xlsx，并按需渲染拓扑图。
+
+    subject_results 为按被试顺序排列的 process_subject 返回值（可迭代）。
+    file_sigs 不为 None 时（增量模式）同时保存群体统计状态 cohort_state.npz。
+    n_subjects 为被试数（用于预分配 PSD 张量；subject_results 为列表时可省略），
+    psd_dtype / psd_mmap_dir 见 run_age_analysis。
+    """
+    if n_subjects is None:
+        n_subjects = len(subject_results) if hasattr(subject_results, "__len__") else 64
+    with CohortBuffer(n_subjects, dtype=psd_dtype, mmap_dir=psd_mmap_dir) as buffer:
+        _summarize_age_group(output_dir, subject_results, buffer, psd_cache=psd_cache, render=render,
+                             render_workers=render_workers, blas_threads=blas_threads, file_sigs=file_sigs,
+                             excel=excel, table_format=table_format)
+
+def _summarize_age_group(output_dir, subject_results, buffer, psd_cache=None, render=True, render_workers=1,
+                         blas_threads=1, file_sigs=None, excel=True, table_format="parquet"):
+    group_id, psd_tensor, topo_values_all, channel_order, freqs, info = \
+        _collect_subject_results(subject_results, buffer, psd_cache)
+
+    # 预编译脑区 / 频段布局，对整个队列的 (subjects, channels, freqs) 张量批量归约
+    layout = ChannelBandLayout(channel_order, freqs, bands, channel_group_hemisphere)
+
+    with timed("aggregation"):
+        # 频段平均功率 (subjects, channels, bands)
+        psd_band_avg_all = layout.band_average(psd_tensor)
+        group_psd_band_avg = np.mean(psd_band_avg_all, axis=0)
+
+        # 脑区平均 PSD (subjects, regions, freqs) 及其群体均值 (regions, freqs)
+        region_psd = layout.region_average(psd_tensor)
+        group_region_psd = np.mean(region_psd, axis=0)
+
+        # 脑区 × 频段平均功率 (subjects, regions, bands)
+        region_band_values = layout.region_average(psd_band_avg_all)
+
+    with timed("stats"):
+        # 皮尔森相似度 (subjects, regions, bands)
+        pearson = region_band_pearson(layout, region_psd, group_region_psd)
+
+        region_band_mean = np.mean(region_band_values, axis=0)
+        region_band_std = np.std(region_band_values, axis=0)
+
+        class_codes = classify_region_bands(region_band_values, region_band_mean, region_band_std)
+
+    if file_sigs is not None:
+        state = CohortState(channel_order, freqs, info, layout.n_regions, layout.n_bands)
+        state.add(group_id, [file_sigs[sid] for sid in group_id], region_psd, region_band_values,
+                  psd_band_avg_all, topo_values_all)
+        state.save(os.path.join(output_dir, STATE_FILE))
+
+    _write_group_outputs(output_dir, group_id, layout, pearson, class_codes, topo_values_all,
+                         group_psd_band_avg, info, psd_cache=psd_cache,
+                         render=render, render_workers=render_workers, blas_threads=blas_threads,
+                         excel=excel, table_format=table_format,
+                         arrays={"psd": psd_tensor, "band_avg": psd_band_avg_all, "region_psd": region_psd})
+
+def update_age_group(output_dir, state, subject_results, file_sigs, removed_ids, psd_cache=None,
+                     render=True, render_workers=1, blas_threads=1, excel=True, table_format="parquet",
+                     n_subjects=None, psd_dtype="float64", psd_mmap_dir=None):
+    """
+    增量群体统计：从 state 中移除 removed_ids，加入 subject_results 中的新被试，
+    再用更新后的群体常模重新计算所有被试的相似度与分类，并保存 state。
+
+    群体状态不保存完整 PSD，因此特征库中只更新 band_avg / region_psd，psd.npy 会被删除。
+    """
+    if n_subjects is None:
+        n_subjects = len(subject_results) if hasattr(subject_results, "__len__") else 64
+    layout = ChannelBandLayout(state.ch_names, state.freqs, bands, channel_group_hemisphere)
+
+    state.remove(removed_ids)
+    with CohortBuffer(n_subjects, dtype=psd_dtype, mmap_dir=psd_mmap_dir) as buffer:
+        # 新增被试的 PSD 只用于计算其脑区 / 频段统计，加入 state 后即可释放
+        group_id, psd_tensor, topo_values_all, channel_order, freqs, info = \
+            _collect_subject_results(subject_results, buffer, psd_cache)
+        if psd_tensor is not None:
+            if list(channel_order) != state.ch_names or not np.array_equal(freqs, state.freqs):
+                raise ValueError("新增被试的通道或频率轴与已保存的群体状态不一致，请删除 cohort_state.npz 后全量重算")
+            with timed("aggregation"):
+                psd_band_avg_all = layout.band_average(psd_tensor)
+                state.add(group_id, [file_sigs[sid] for sid in group_id], layout.region_average(psd_tensor),
+                          layout.region_average(psd_band_avg_all), psd_band_avg_all, topo_values_all)
+            state.info = info
+        del psd_tensor
+    if state.n == 0:
+        print("群体状态中已没有被试，跳过统计")
+        state.save(os.path.join(output_dir, STATE_FILE))
+        return
+
+    with timed("stats"):
+        pearson = region_band_pearson(layout, state.region_psd, state.group_region_psd)
+        class_codes = classify_region_bands(state.region_band_values, state.region_band_mean, state.region_band_std)
+    state.save(os.path.join(output_dir, STATE_FILE))
+
+    # 删除已移除且未重新加入的被试的旧拓扑图
+    for sid in set(removed_ids) - set(group_id):
+        stale = os.path.join(output_dir, f"{sid}.jpg")
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    _write_group_outputs(output_dir, state.subject_ids, layout, pearson, class_codes, state.topo_values,
+                         state.group_psd_band_avg, state.info, psd_cache=psd_cache,
+                         render=render, render_workers=render_workers, blas_threads=blas_threads,
+                         render_subjects=group_id, excel=excel, table_format=table_format,
+                         arrays={"band_avg": state.psd_band_avg, "region_psd": state.region_psd})
+
+def _write_group_outputs(output_dir, group_id, layout, pearson, class_codes, topo_values_all, group_psd_band_avg,
+                         info, psd_cache=None, render=True, render_workers=1, blas_threads=1, render_subjects=None,
+                         excel=True, table_format="parquet", arrays=None):
+    """写出 topomap_data.npz、特征库与 sub_sim.xlsx，打印缓存统计，并按需渲染拓扑图。"""
+    # 保存绘图所需数值，渲染阶段（可稍后单独运行）只依赖该文件
+    save_topomap_data(output_dir, group_id, topo_values_all, group_psd_band_avg, info)
+
+    df = build_result_table(group_id, layout, pearson, class_codes)
+    arrays = arrays or {}
+    with timed("features"):
+        write_feature_store(output_dir, df, group_id, layout.ch_names, layout.freqs, layout.band_names,
+                            layout.region_names, psd=arrays.get("psd"), band_avg=arrays.get("band_avg"),
+                            region_psd=arrays.get("region_psd"), table_format=table_format)
+
+    if excel:
+        with timed("excel"):
+            df.to_excel(os.path.join(output_dir, "sub_sim.xlsx"), index=False)
+        print("分析完成，结果保存至 sub_sim.xlsx")
+    else:
+        print("分析完成（未输出 sub_sim.xlsx）")
+
+    if psd_cache is not None:
+        psd_cache.evict()
+        print(psd_cache.summary())
+
+    if render:
+        with timed("render"):
+            render_topomaps(output_dir, workers=render_workers, blas_threads=blas_threads, subject_ids=render_subjects)
+
+def build_result_table(group_id, layout, pearson, class_codes):
+    """
+    合并皮尔森相似度与分类标签为 sub_sim 表格。
+
+    列顺序：subject_id，{region}_{band}_pearson（频段在外层，跳过无有效通道的脑区），
+    {region}_{band}_class（脑区在外层）。
+    """
+    columns = {"subject_id": list(group_id)}
+    for b_idx, band_name in enumerate(layout.band_names):
+        for r_idx, region in enumerate(layout.region_names):
+            if layout.region_valid[r_idx]:
+                columns[f"{region}_{band_name}_pearson"] = pearson[:, r_idx, b_idx]
+    labels = CLASS_LABELS[class_codes]
+    for r_idx, region in enumerate(layout.region_names):
+        for b_idx, band_name in enumerate(layout.band_names):
+            columns[f"{region}_{band_name}_class"] = labels[:, r_idx, b_idx]
+    return pd.DataFrame(columns)
+
+# ========== 拓扑图渲染阶段 ==========
+TOPOMAP_DATA_FILE = "topomap_data.npz"
+
+def save_topomap_data(output_dir, group_id, topo_values_all, group_psd_band_avg, info):
+    """保存渲染阶段所需的数值：个体归一化频段功率、群体频段平均功率和电极布局 info。"""
+    info_bytes = np.frombuffer(pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+    np.savez(os.path.join(output_dir, TOPOMAP_DATA_FILE),
+             subject_id=np.array(group_id),
+             topo_values=topo_values_all,
+             group_psd_band_avg=group_psd_band_avg,
+             info=info_bytes)
+
+def load_topomap_data(output_dir):
+    with np.load(os.path.join(output_dir, TOPOMAP_DATA_FILE)) as data:
+        return ([str(s) for s in data["subject_id"]],
+                data["topo_values"],
+                data["group_psd_band_avg"],
+                pickle.loads(data["info"].tobytes()))
+
+def render_subject_topomap(topo_values, info, output_path):
+    """
+    绘制单个被试五个频段的拓扑图并保存为 JPG。
+
+    同一电极布局的被试复用缓存的插值矩阵与图形（见 topomap_cache.py），每个被试只更新图像与等高线；
+    缓存不可用或绘制失败时逐个调用 mne.viz.plot_topomap。
+    """
+    from topomap_cache import get_renderer, disable_renderer, RENDER_ERRORS
+    mne, plt = _mne(), _pyplot()
+    titles = [f"{band_name} ({fmin}-{fmax}Hz)" for band_name, (fmin, fmax) in bands.items()]
+    renderer = get_renderer(info)
+    if renderer is not None:
+        try:
+            renderer.band_figure(titles, (15, 3), cmap='Reds').update(topo_values).savefig(output_path)
+            return output_path
+        except RENDER_ERRORS as e:
+            disable_renderer(info, e)
+
+    fig, axes = plt.subplots(1, len(bands), figsize=(15, 3))
+    for i, title in enumerate(titles):
+        mne.viz.plot_topomap(topo_values[:, i], info, cmap='Reds', axes=axes[i], show=False)
+        axes[i].set_title(title)
+    fig.tight_layout()
     fig.savefig(output_path)
+    plt.close(fig)
+    return output_path
+
+def render_topomaps(output_dir, workers=1, blas_threads=1, subject_ids=None, template=True):
+    """
+    根据 run_age_analysis 保存的 topomap_data.npz 渲染个体拓扑图与 template.jpg。
+
+    workers > 1 时使用独立进程池渲染，与数值阶段互不阻塞。
+    subject_ids 不为 None 时只渲染这些被试的个体拓扑图；template=False 时不渲染 template.jpg。
+    """
+    group_id, topo_values_all, group_psd_band_avg, info = load_topomap_data(output_dir)
+    if subject_ids is not None:
+        wanted = set(subject_ids)
+        keep = [i for i, sid in enumerate(group_id) if sid in wanted]
+        group_id = [group_id[i] for i in keep]
+        topo_values_all = topo_values_all[keep]
+    output_paths = [os.path.join(output_dir, f"{subject_id}.jpg") for subject_id in group_id]
+
+    workers = resolve_workers(workers)
+    if workers <= 1 or len(group_id) <= 1:
+        for topo_values, output_path in zip(topo_values_all, output_paths):
+            render_subject_topomap(topo_values, info, output_path)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        n_workers = min(workers, len(group_id))
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(blas_threads,)) as pool:
+            list(pool.map(render_subject_topomap,
+                          list(topo_values_all),
+                          [info] * len(group_id),
+                          output_paths,
+                          chunksize=max(1, len(group_id) // (n_workers * 4))))
+    print(f"已保存 {len(group_id)} 张个体拓扑图")
+    if not template:
+        return
+
+    fig = plot_band_topomap_norm(group_psd_band_avg, info)
+    fig.savefig(os.path.join(output_dir, "template.jpg"))
+    _pyplot().close(fig)
     print(f"已保存模板拓扑图至: {output_dir}")
 
-    final_results = []
-    for r1, r2 in zip(pearson_results, classification_results):
-        assert r1['subject_id'] == r2['subject_id']
-        merged = {**r1, **r2}
-        final_results.append(merged)
+def _render_topomaps_timed(output_dir, subject_ids, template):
+    """在共享进程池中渲染一部分个体拓扑图（见 RangeSummarizer），返回用时（秒）。"""
+    t0 = time.perf_counter()
+    render_topomaps(output_dir, workers=1, subject_ids=subject_ids, template=template)
+    return time.perf_counter() - t0
+
+class RangeSummarizer:
+    """
+    跨年龄段调度（流水线 / Step 4 全局调度）时，把年龄段汇总移出调度循环。
 
-    df = pd.DataFrame(final_results)
-    df.to_excel(os.path.join(output_dir, "sub_sim.xlsx"), index=False)
-    print("分析完成，结果保存至 sub_sim.xlsx")
+    群体统计、特征库与 sub_sim.xlsx 在一个后台线程中按完成顺序依次计算；拓扑图渲染拆成
+    render_workers 个任务提交到共享进程池，与其他年龄段的被试任务共用同一组 CPU 核。
+    调度循环只负责收集结果、提交后续任务，不再等待任何年龄段的汇总。
 
-def plot_band_topomap_norm(psds, raw):
+    参数：
+    pool : concurrent.futures.Executor
+        共享进程池；wait() 返回之前不能关闭。
+    render, render_workers :
+        同 run_age_analysis。
+    **summary_kwargs :
+        传给 summarize_age_group 的其他参数（psd_cache、excel、table_format、psd_dtype 等）。
+    """
+
+    def __init__(self, pool, render=True, render_workers=1, **summary_kwargs):
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = pool
+        self.render = render
+        self.render_workers = max(1, resolve_workers(render_workers))
+        self.summary_kwargs = summary_kwargs
+        self.completed, self.failed = [], []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._outstanding = 0  # 已提交、尚未得出结果（含渲染）的年龄段数
+
+    def submit(self, age_range, output_dir, subject_results):
+        """提交一个年龄段的汇总（subject_results 同 summarize_age_group），立即返回。"""
+        with self._lock:
+            self._outstanding += 1
+        self._executor.submit(self._summarize, age_range, output_dir, subject_results)
+
+    def _summarize(self, age_range, output_dir, subject_results):
+        try:
+            summarize_age_group(output_dir, subject_results, render=False, **self.summary_kwargs)
+            if not self.render:
+                self._finish(age_range)
+                return
+            group_id = load_topomap_data(output_dir)[0]
+            n_chunks = min(self.render_workers, max(1, len(group_id)))
+            chunks = [group_id[i::n_chunks] for i in range(n_chunks)]
+            futures = [self.pool.submit(_render_topomaps_timed, output_dir, chunk, i == 0)
+                       for i, chunk in enumerate(chunks)]
+        except Exception as e:
+            self._finish(age_range, e)
+            return
+        pending = [len(futures)]
+        errors = []
+
+        def on_render_done(future):
+            try:
+                add_stage_time("render", future.result())
+            except Exception as e:
+                errors.append(e)
+            with self._lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                self._finish(age_range, errors[0] if errors else None)
+
+        for future in futures:
+            future.add_done_callback(on_render_done)
+
+    def _finish(self, age_range, error=None):
+        with self._done:
+            if error is None:
+                self.completed.append(age_range)
+                print(f"成功完成: {age_range}")
+            else:
+                self.failed.append(age_range)
+                print(f"出错跳过: {age_range}，错误信息: {error}")
+            self._outstanding -= 1
+            self._done.notify_all()
+
+    def wait(self):
+        """等待所有已提交年龄段的汇总与渲染完成，返回 (成功年龄段, 失败年龄段)。"""
+        self._executor.shutdown(wait=True)
+        with self._done:
+            self._done.wait_for(lambda: self._outstanding == 0)
+        return self.completed, self.failed
+
+def plot_band_topomap_norm(psds, raw_info):
     """
     绘制频带拓扑图，并对数据进行归一化。
 
     参数：
     psds : ndarray
         形状为 (n_channels, n_bands) 的 PSD 数组。
-    raw : mne.io.Raw
-        包含电极布局和位置信息的 Raw 对象。
+    raw_info : mne.Info
+        包含电极布局和位置信息的 Info 对象（如 raw.info）。
     """
+    from topomap_cache import plot_topomap
+    mne, plt = _mne(), _pyplot()
     # 获取 montage
-    montage = raw.get_montage()
+    montage = raw_info.get_montage()
     
     # 创建一个新的 info 对象，使用相同的通道名称和类型
-    info = mne.create_info(ch_names=raw.ch_names, sfreq=raw.info['sfreq'], ch_types='eeg')
+    info = mne.create_info(ch_names=raw_info.ch_names, sfreq=raw_info['sfreq'], ch_types='eeg')
     info.set_montage(montage)
     
     # 绘制各频带的 topomap
@@ -216,8 +751,8 @@ def plot_band_topomap_norm(psds, raw):
         band_power = psds[:, list(bands.keys()).index(band)]
         # 对 band_power 数据进行归一化
         band_power_normalized = normalize(band_power)
-        # 绘制 topomap
-        im, _ = mne.viz.plot_topomap(band_power_normalized, info, axes=ax, show=False)
+        # 绘制 topomap（同一电极布局复用缓存的插值）
+        im = plot_topomap(band_power_normalized, info, ax)
         ax.set_title(band)
     
     # 添加 colorbar
@@ -237,17 +772,61 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="EEG Step 4 Analysis by Age Range")
-    parser.add_argument("--base_data_dir", required=True, help="Base directory containing age-range EEG .set files")
+    parser.add_argument("--base_data_dir", default=None, help="Base directory containing age-range EEG .set files")
     parser.add_argument("--base_output_dir", required=True, help="Output directory to save results")
     parser.add_argument("--age_range_list", nargs="+", required=True, help="List of age ranges, e.g. 0-4 4-8 8-12")
+    parser.add_argument("--manifest", default=None, help="Step 3 manifest.json listing the files of each age range (default: <base_data_dir>/manifest.json if present)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes per age range (<= 0: all CPU cores)")
+    parser.add_argument("--blas_threads", type=int, default=1, help="BLAS/OpenMP threads per worker process")
+    parser.add_argument("--psd_cache_dir", default=None, help="Directory of the on-disk per-subject PSD cache (disabled if omitted)")
+    parser.add_argument("--psd_cache_max_mb", type=float, default=2048, help="Size cap of the PSD cache in MB (LRU eviction)")
+    parser.add_argument("--checkpoint", action="store_true", help="Without --psd_cache_dir, keep per-subject PSD checkpoints (never evicted) in <base_output_dir>/.checkpoints/step4_psd")
+    parser.add_argument("--psd_cache_hash", choices=["stat", "content"], default="stat", help="Cache key: file size+mtime (stat) or content hash")
+    parser.add_argument("--streaming_psd", action="store_true", help="Low-memory Welch PSD: read .fdt in memory-mapped chunks instead of preload=True")
+    parser.add_argument("--stream_chunk_seconds", type=float, default=30.0, help="Chunk length in seconds for --streaming_psd")
+    parser.add_argument("--psd_dtype", choices=["float64", "float32"], default="float64", help="Storage precision of the per-age-range PSD tensor")
+    parser.add_argument("--psd_mmap_dir", default=None, help="Keep the per-age-range PSD tensor in a temporary memory-mapped file in this directory")
+    parser.add_argument("--incremental", action="store_true", help="Keep persisted group statistics and only process new/changed subjects")
+    parser.add_argument("--no_excel", action="store_true", help="Do not write sub_sim.xlsx (feature store is still written)")
+    parser.add_argument("--table_format", choices=["parquet", "feather", "none"], default="parquet", help="Format of the columnar results table in features/")
+    parser.add_argument("--no_render", action="store_true", help="Numbers only: skip topomap rendering (render later with --render_only)")
+    parser.add_argument("--render_only", action="store_true", help="Only render topomaps from previously saved topomap_data.npz")
+    parser.add_argument("--render_workers", type=int, default=1, help="Number of worker processes for topomap rendering")
 
     args = parser.parse_args()
+    if not args.render_only and not args.base_data_dir and not args.manifest:
+        parser.error("--base_data_dir or --manifest is required unless --render_only is given")
+
+    range_files = None
+    if not args.render_only:
+        from staging import find_manifest, load_manifest
+        manifest = find_manifest(args.base_data_dir, args.manifest)
+        if manifest:
+            range_files = load_manifest(manifest)
+
+    psd_cache = None
+    if args.psd_cache_dir:
+        from psd_cache import PSDCache
+        psd_cache = PSDCache(args.psd_cache_dir, max_bytes=int(args.psd_cache_max_mb * 1024 ** 2), hash_mode=args.psd_cache_hash)
+    elif args.checkpoint and not args.render_only:
+        from psd_cache import PSDCache
+        from checkpoint import psd_checkpoint_dir
+        psd_cache = PSDCache(psd_checkpoint_dir(args.base_output_dir), max_bytes=None, hash_mode=args.psd_cache_hash)
 
     for age_range in args.age_range_list:
-        data_dir = os.path.join(args.base_data_dir, age_range)
         output_dir = os.path.join(args.base_output_dir, age_range)
         try:
-            run_age_analysis(data_dir, output_dir)
+            if args.render_only:
+                render_topomaps(output_dir, workers=args.render_workers, blas_threads=args.blas_threads)
+            else:
+                data_dir = os.path.join(args.base_data_dir or "", age_range)
+                file_list = None if range_files is None else range_files[age_range]
+                run_age_analysis(data_dir, output_dir, workers=args.workers, blas_threads=args.blas_threads, psd_cache=psd_cache,
+                                 render=not args.no_render, render_workers=args.render_workers,
+                                 streaming=args.streaming_psd, stream_chunk_seconds=args.stream_chunk_seconds,
+                                 incremental=args.incremental, excel=not args.no_excel,
+                                 table_format=args.table_format, file_list=file_list,
+                                 psd_dtype=args.psd_dtype, psd_mmap_dir=args.psd_mmap_dir)
             print(f"成功完成: {age_range}")
         except Exception as e:
             print(f" 出错跳过: {age_range}，错误信息: {e}")
@@ -0,0 +1,145 @@
+"""
+aggregation.py
+
+功能：
+- 将频段定义（bands）和脑区定义（channel_group_hemisphere）预编译为索引 / 权重矩阵
+- 对整个队列的 (subjects, channels, freqs) PSD 张量做批量频段平均、脑区平均
+
+归约在批量数组上进行，NumPy 的累加顺序可能与逐被试循环不同，结果与原来逐个调用
+average_region_band_psd 的实现在浮点舍入误差范围内一致。
+"""
+
+import numpy as np
+
+
+class ChannelBandLayout:
+    """
+    预编译的通道分组 / 频段布局。
+
+    参数：
+    ch_names : list of str
+        PSD 数组的通道顺序。
+    freqs : ndarray
+        PSD 数组的频率轴（升序）。
+    bands : dict
+        频段名 -> (fmin, fmax)，闭区间。
+    channel_groups : dict
+        脑区名 -> 通道名列表；不存在的通道会被忽略。
+    """
+
+    def __init__(self, ch_names, freqs, bands, channel_groups):
+        self.ch_names = list(ch_names)
+        self.freqs = np.asarray(freqs)
+        self.band_names = list(bands.keys())
+        self.region_names = list(channel_groups.keys())
+
+        channel_to_index = {ch: i for i, ch in enumerate(self.ch_names)}
+
+        # 脑区 -> 通道索引；region_weights[r, c] = 1 / 脑区通道数
+        self.region_index = []
+        self.region_weights = np.zeros((len(self.region_names), len(self.ch_names)))
+        for r_idx, region in enumerate(self.region_names):
+            idx = np.array([channel_to_index[ch] for ch in channel_groups[region] if ch in channel_to_index], dtype=int)
+            self.region_index.append(idx)
+            if idx.size:
+                self.region_weights[r_idx, idx] = 1.0 / idx.size
+        self.region_valid = np.array([idx.size > 0 for idx in self.region_index])
+
+        # 频段 -> 频率切片（频率轴升序，频段内的频点连续，切片得到视图而非拷贝）
+        self.band_masks = np.zeros((len(self.band_names), self.freqs.size), dtype=bool)
+        self.band_slices = []
+        for b_idx, (fmin, fmax) in enumerate(bands.values()):
+            mask = np.logical_and(self.freqs >= fmin, self.freqs <= fmax)
+            self.band_masks[b_idx] = mask
+            hit = np.flatnonzero(mask)
+            self.band_slices.append(slice(hit[0], hit[-1] + 1) if hit.size else slice(0, 0))
+        self.band_weights = self.band_masks / np.maximum(self.band_masks.sum(axis=1, keepdims=True), 1)
+
+    @property
+    def n_regions(self):
+        return len(self.region_names)
+
+    @property
+    def n_bands(self):
+        return len(self.band_names)
+
+    def band_average(self, psd):
+        """(..., channels, freqs) -> (..., channels, bands)：频段内平均功率。"""
+        out = np.empty(psd.shape[:-1] + (self.n_bands,), dtype=psd.dtype)
+        for b_idx, sl in enumerate(self.band_slices):
+            out[..., b_idx] = np.mean(psd[..., sl], axis=-1)
+        return out
+
+    def region_average(self, values):
+        """
+        (subjects, channels, k) -> (subjects, regions, k)：脑区内通道平均；无有效通道的脑区为 NaN。
+
+        逐通道累加 values[:, c] 视图（与 np.mean(values[:, idx], axis=1) 逐位一致），
+        不会用花式索引复制出 (subjects, 脑区通道数, k) 的中间数组，values 可以是内存映射。
+        """
+        out = np.full((values.shape[0], self.n_regions) + values.shape[2:], np.nan, dtype=values.dtype)
+        for r_idx, idx in enumerate(self.region_index):
+            if idx.size:
+                acc = out[:, r_idx]
+                acc[...] = values[:, idx[0]]
+                for c in idx[1:]:
+                    acc += values[:, c]
+                acc /= idx.size
+        return out
+
+    def band_view(self, values, b_idx):
+        """沿最后一个（频率）轴取某频段的视图。"""
+        return values[..., self.band_slices[b_idx]]
+
+
+# ========== 批量相似度 / 分类 ==========
+CLASS_LABELS = np.array(['low', 'average', 'high'])
+CLASS_LOW, CLASS_AVERAGE, CLASS_HIGH = 0, 1, 2
+
+
+def batched_pearson(x, y):
+    """
+    沿最后一个轴批量计算皮尔森相关系数（与 scipy.stats.pearsonr 的 statistic 相同）。
+
+    x : (..., n)；y : 可广播到 x 的 (..., n)，例如群体均值向量 (n,)。
+    常数向量对应的相关系数为 NaN。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    xm = x - np.mean(x, axis=-1, keepdims=True)
+    ym = y - np.mean(y, axis=-1, keepdims=True)
+    # 先按最大绝对值缩放，避免 PSD 量级（~1e-12）平方后下溢
+    xm = xm / np.max(np.abs(xm), axis=-1, keepdims=True)
+    ym = ym / np.max(np.abs(ym), axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.sum(xm * ym, axis=-1) / np.sqrt(np.sum(xm * xm, axis=-1) * np.sum(ym * ym, axis=-1))
+    return np.clip(r, -1.0, 1.0)
+
+
+def region_band_pearson(layout, region_psd, group_region_psd):
+    """
+    每个被试、脑区、频段的脑区 PSD 与群体均值 PSD 的皮尔森相关。
+
+    region_psd : (subjects, regions, freqs)；group_region_psd : (regions, freqs)
+    返回 (subjects, regions, bands)。
+    """
+    out = np.empty(region_psd.shape[:2] + (layout.n_bands,))
+    for b_idx in range(layout.n_bands):
+        out[:, :, b_idx] = batched_pearson(layout.band_view(region_psd, b_idx),
+                                           layout.band_view(group_region_psd, b_idx))
+    return out
+
+
+def classify_region_bands(values, mean, std, n_std=1.0):
+    """
+    与群体均值比较得到分类编码（CLASS_LOW / CLASS_AVERAGE / CLASS_HIGH，int8）。
+
+    values > mean + n_std * std 为 high，values < mean - n_std * std 为 low，其余（含 NaN）为 average。
+    mean、std 需可广播到 values，例如 (regions, bands) 对 (subjects, regions, bands)。
+    """
+    upper = mean + n_std * std
+    lower = mean - n_std * std
+    codes = np.full(np.shape(values), CLASS_AVERAGE, dtype=np.int8)
+    codes[values > upper] = CLASS_HIGH
+    codes[values < lower] = CLASS_LOW
+    return codes
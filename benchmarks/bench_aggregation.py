@@ -0,0 +1,175 @@
+"""
+bench_aggregation.py
+
+对比 Step 4 脑区 / 频段聚合、皮尔森相似度与分类的两种实现：
+- legacy：逐 (频段, 脑区, 被试) 调用 average_region_band_psd / pearsonr，三重循环分类（原实现）
+- vectorized：ChannelBandLayout 批量归约 + batched_pearson / classify_region_bands
+
+用法：
+    python benchmarks/bench_aggregation.py --subjects 1000 2000 --repeat 3
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scipy.stats import pearsonr  # noqa: E402
+from aggregation import (ChannelBandLayout, CLASS_LABELS, region_band_pearson,  # noqa: E402
+                         classify_region_bands)
+# 与 Step 4 使用同一份频段 / 脑区定义（导入 age_parameters 不会导入 mne / matplotlib）
+from age_parameters import bands, channel_group_hemisphere  # noqa: E402
+
+CH_NAMES = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'FC5', 'FC1', 'FC2', 'FC6', 'T7', 'C3', 'Cz', 'C4', 'T8',
+            'CP5', 'CP1', 'CP2', 'CP6', 'P7', 'P3', 'Pz', 'P4', 'P8', 'O1', 'Oz', 'O2']
+
+
+def make_cohort(n_subjects, sfreq=500.0, n_fft=256, seed=0):
+    """生成与 compute_psd(method='welch', fmin=0, fmax=40) 相同频率轴的随机 PSD。"""
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sfreq)
+    freqs = freqs[freqs <= 40]
+    rng = np.random.default_rng(seed)
+    psd = rng.lognormal(mean=-25, sigma=1.0, size=(n_subjects, len(CH_NAMES), freqs.size))
+    return psd, freqs
+
+
+def legacy(psd_tensor, freqs):
+    channel_to_index = {ch: i for i, ch in enumerate(CH_NAMES)}
+    psd_all = []
+    psd_band_avg_all = []
+    for psds in psd_tensor:
+        psds_person = []
+        psd_band_avg = np.zeros((psds.shape[0], len(bands)))
+        for i, (fmin, fmax) in enumerate(bands.values()):
+            idx = np.logical_and(freqs >= fmin, freqs <= fmax)
+            psds_person.append(psds[:, idx])
+            psd_band_avg[:, i] = np.mean(psds[:, idx], axis=1)
+        psd_all.append(psds_person)
+        psd_band_avg_all.append(psd_band_avg)
+    psd_band_avg_all = np.array(psd_band_avg_all)
+
+    def average_region_band_psd(psd_band, region_channels):
+        region_psd = {}
+        for region, ch_names in region_channels.items():
+            idx = [channel_to_index[ch] for ch in ch_names if ch in channel_to_index]
+            if not idx:
+                continue
+            region_psd[region] = np.mean(psd_band[idx, :], axis=0)
+        return region_psd
+
+    group_mean_psd = {band_name: {} for band_name in bands}
+    for b_idx, band_name in enumerate(bands):
+        for region in channel_group_hemisphere:
+            region_psds = []
+            for subj_psd in psd_all:
+                region_psd = average_region_band_psd(subj_psd[b_idx], channel_group_hemisphere)
+                if region in region_psd:
+                    region_psds.append(region_psd[region])
+            if region_psds:
+                group_mean_psd[band_name][region] = np.mean(region_psds, axis=0)
+
+    region_band_values = np.zeros((len(psd_all), len(channel_group_hemisphere), len(bands)))
+    for r_idx, region in enumerate(channel_group_hemisphere):
+        ch_indices = [channel_to_index[ch] for ch in channel_group_hemisphere[region] if ch in channel_to_index]
+        region_band_values[:, r_idx, :] = np.mean(psd_band_avg_all[:, ch_indices, :], axis=1)
+    return group_mean_psd, region_band_values
+
+
+def vectorized(psd_tensor, freqs):
+    layout = ChannelBandLayout(CH_NAMES, freqs, bands, channel_group_hemisphere)
+    psd_band_avg_all = layout.band_average(psd_tensor)
+    group_region_psd = np.mean(layout.region_average(psd_tensor), axis=0)
+    group_mean_psd = {band_name: {} for band_name in bands}
+    for b_idx, band_name in enumerate(bands):
+        for r_idx, region in enumerate(layout.region_names):
+            group_mean_psd[band_name][region] = layout.band_view(group_region_psd[r_idx], b_idx)
+    region_band_values = layout.region_average(psd_band_avg_all)
+    return group_mean_psd, region_band_values
+
+
+def legacy_scoring(region_psd, group_region_psd, region_band_values, layout):
+    n_subjects = region_psd.shape[0]
+    pearson = np.empty((n_subjects, layout.n_regions, layout.n_bands))
+    for subj in range(n_subjects):
+        for b_idx in range(layout.n_bands):
+            for r_idx in range(layout.n_regions):
+                corr, _ = pearsonr(layout.band_view(region_psd[subj, r_idx], b_idx),
+                                   layout.band_view(group_region_psd[r_idx], b_idx))
+                pearson[subj, r_idx, b_idx] = corr
+
+    mean = np.mean(region_band_values, axis=0)
+    std = np.std(region_band_values, axis=0)
+    classification = np.empty(region_band_values.shape, dtype=object)
+    for subj in range(n_subjects):
+        for r_idx in range(layout.n_regions):
+            for b_idx in range(layout.n_bands):
+                val = region_band_values[subj, r_idx, b_idx]
+                if val > mean[r_idx, b_idx] + std[r_idx, b_idx]:
+                    classification[subj, r_idx, b_idx] = 'high'
+                elif val < mean[r_idx, b_idx] - std[r_idx, b_idx]:
+                    classification[subj, r_idx, b_idx] = 'low'
+                else:
+                    classification[subj, r_idx, b_idx] = 'average'
+    return pearson, classification
+
+
+def vectorized_scoring(region_psd, group_region_psd, region_band_values, layout):
+    pearson = region_band_pearson(layout, region_psd, group_region_psd)
+    codes = classify_region_bands(region_band_values, np.mean(region_band_values, axis=0),
+                                  np.std(region_band_values, axis=0))
+    return pearson, CLASS_LABELS[codes]
+
+
+def best_of(func, repeat, *args):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Step 4 band/region aggregation")
+    parser.add_argument("--subjects", type=int, nargs="+", default=[1000, 2000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'subjects':>10} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for n in args.subjects:
+        psd_tensor, freqs = make_cohort(n)
+        t_legacy, (gm_a, rbv_a) = best_of(legacy, args.repeat, psd_tensor, freqs)
+        t_vec, (gm_b, rbv_b) = best_of(vectorized, args.repeat, psd_tensor, freqs)
+
+        # 结果在浮点舍入误差范围内一致
+        assert np.allclose(rbv_a, rbv_b, rtol=1e-12, atol=0)
+        for band_name in bands:
+            for region in channel_group_hemisphere:
+                assert np.allclose(gm_a[band_name][region], gm_b[band_name][region], rtol=1e-12, atol=0)
+
+        print(f"{n:>10} {t_legacy:>12.3f} {t_vec:>15.4f} {t_legacy / t_vec:>8.1f}x")
+
+    print("\nPearson similarity + high/low/average classification")
+    print(f"{'subjects':>10} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for n in args.subjects:
+        psd_tensor, freqs = make_cohort(n)
+        layout = ChannelBandLayout(CH_NAMES, freqs, bands, channel_group_hemisphere)
+        region_psd = layout.region_average(psd_tensor)
+        group_region_psd = np.mean(region_psd, axis=0)
+        region_band_values = layout.region_average(layout.band_average(psd_tensor))
+        scoring_args = (region_psd, group_region_psd, region_band_values, layout)
+        t_legacy, (p_a, c_a) = best_of(legacy_scoring, args.repeat, *scoring_args)
+        t_vec, (p_b, c_b) = best_of(vectorized_scoring, args.repeat, *scoring_args)
+
+        assert np.allclose(p_a, p_b, rtol=1e-12, atol=1e-12)
+        assert np.array_equal(c_a.astype(str), c_b)
+
+        print(f"{n:>10} {t_legacy:>12.3f} {t_vec:>15.4f} {t_legacy / t_vec:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+bench_pipeline.py
+
+合成队列基准测试：测量 Step 1 / Step 3 / Step 4 随队列规模的耗时与峰值内存。
+
+- 生成合成数据：EEGLAB .set 队列（通道名覆盖 channel_group_hemisphere 中的 10-20 电极）、
+  对应的年龄表（ID / month age when scan）以及 Step 1 的伪源数据目录（两个站点，平铺 + 子文件夹）
+- 每个阶段在独立子进程中运行，分别记录耗时与峰值 RSS：
+    step1_cold  首次复制（完整扫描源目录 + 复制）
+    step1_warm  再次运行（索引增量刷新 + 跳过未变化文件）
+    step3       年龄匹配与放置
+    step4       run_age_analysis，细分为 load / psd / topo / aggregation / stats / features / excel / render
+- 结果保存为 JSON；给出 --baseline 时逐项与基准比较，超过 --tolerance 的变慢 / 内存增长标记为回归
+
+用法：
+    python benchmarks/bench_pipeline.py --subjects 200 --output bench_200.json
+    python benchmarks/bench_pipeline.py --subjects 200 --baseline bench_200.json --fail_on_regression
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+AGE_RANGES = ["48-72", "44-48", "35-44", "23-30", "18-23", "11-15", "8-11", "6-8", "0-4"]
+# channel_group_hemisphere 中的电极 + 其余常用 10-20 电极
+CH_NAMES = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'FC5', 'FC1', 'FC2', 'FC6', 'T7', 'C3', 'Cz', 'C4', 'T8',
+            'CP5', 'CP1', 'CP2', 'CP6', 'P7', 'P3', 'Pz', 'P4', 'P8', 'O1', 'Oz', 'O2']
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+# ========== 合成数据 ==========
+def subject_id(idx):
+    # 第 3-4 位为 "01"，满足 Step 1 的文件名筛选规则
+    return f"S{idx % 10}01{idx:05d}"
+
+
+def synth_eeg(rng, n_chan, n_times, sfreq):
+    """1/f 背景 + 个体 alpha 峰的合成 EEG（单位 V）。"""
+    white = rng.standard_normal((n_chan, n_times))
+    spectrum = np.fft.rfft(white, axis=1)
+    f = np.fft.rfftfreq(n_times, 1.0 / sfreq)
+    spectrum /= np.sqrt(np.maximum(f, 0.5))
+    pink = np.fft.irfft(spectrum, n=n_times, axis=1)
+    t = np.arange(n_times) / sfreq
+    alpha = rng.uniform(0.5, 2.0) * np.sin(2 * np.pi * rng.uniform(8, 12) * t)
+    return (pink + alpha * rng.uniform(0.2, 1.0, size=(n_chan, 1))) * 1e-5
+
+
+def generate_cohort(work_dir, n_subjects, duration, sfreq, raw_kb, seed=0):
+    """生成 processed/（.set）、ages.xlsx 与 source/（Step 1 伪源数据），返回路径字典。"""
+    import mne
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    paths = {name: os.path.join(work_dir, name) for name in ("processed", "source", "step1_out", "step3_out", "step4_out")}
+    for name in ("processed", "source"):
+        os.makedirs(paths[name], exist_ok=True)
+    paths["ages"] = os.path.join(work_dir, "ages.xlsx")
+
+    info = mne.create_info(CH_NAMES, sfreq, "eeg")
+    info.set_montage("standard_1005")
+    n_times = int(duration * sfreq)
+    for idx in range(n_subjects):
+        raw = mne.io.RawArray(synth_eeg(rng, len(CH_NAMES), n_times, sfreq), info, verbose=False)
+        raw.export(os.path.join(paths["processed"], f"{subject_id(idx)}_resting_processed.set"),
+                   fmt="eeglab", overwrite=True, verbose=False)
+
+    pd.DataFrame({"ID": [subject_id(i) for i in range(n_subjects)],
+                  "month age when scan": rng.uniform(0, 72, size=n_subjects).round(1)}).to_excel(paths["ages"], index=False)
+
+    # Step 1 伪源数据：站点 A 平铺，站点 B 每 50 个被试一个子文件夹；修改时间分布在最近 30 天
+    now = time.time()
+    payload = os.urandom(raw_kb * 1024)
+    for idx in range(n_subjects):
+        site_dir = os.path.join(paths["source"], "A") if idx % 2 == 0 else \
+            os.path.join(paths["source"], "B", f"batch{idx // 50:03d}")
+        os.makedirs(site_dir, exist_ok=True)
+        mtime = now - rng.uniform(0, 30) * 86400
+        for ext in (".vhdr", ".vmrk", ".eeg"):
+            path = os.path.join(site_dir, f"{subject_id(idx)}_resting{ext}")
+            with open(path, "wb") as f:
+                f.write(payload if ext == ".eeg" else b"synthetic")
+            os.utime(path, (mtime, mtime))
+    return paths
+
+
+# ========== 子进程中执行的阶段 ==========
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）；无法获取时返回 None。"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 ** 2
+        except (ImportError, AttributeError):
+            return None
+
+
+def _run_script(script, args_dict):
+    old_argv = sys.argv
+    sys.argv = [script, json.dumps(args_dict)]
+    try:
+        runpy.run_path(os.path.join(REPO_DIR, script), run_name="__main__")
+    finally:
+        sys.argv = old_argv
+
+
+def run_stage(stage, paths, config):
+    """在当前（子）进程中执行一个阶段，返回 substages 耗时字典。"""
+    if stage.startswith("step1"):
+        _run_script("step1_copy_data.py", {
+            "site": "ALL", "start_date": "2000-01-01", "end_date": "2100-01-01",
+            "output_path": paths["step1_out"],
+            "index_path": os.path.join(config["work_dir"], "source_index.sqlite"),
+            "source_paths": [["A", os.path.join(paths["source"], "A"), False],
+                             ["B", os.path.join(paths["source"], "B"), True]],
+        })
+        return {}
+    if stage == "step3":
+        _run_script("step3_age_data_match.py", {
+            "file_path": paths["ages"], "source_folder": paths["processed"],
+            "target_folder_month": paths["step3_out"], "age_range_list": AGE_RANGES,
+            "stage_mode": config["stage_mode"],
+        })
+        return {}
+    if stage == "step4":
+        from collections import defaultdict
+        import age_parameters
+        substages = defaultdict(float)
+        for age_range in AGE_RANGES:
+            data_dir = os.path.join(paths["step3_out"], age_range)
+            if not os.path.isdir(data_dir) or not os.listdir(data_dir):
+                continue
+            age_parameters.run_age_analysis(data_dir, os.path.join(paths["step4_out"], age_range),
+                                            workers=config["workers"], render=config["render"])
+            for name, seconds in age_parameters.stage_times.items():
+                substages[name] += seconds
+        return dict(substages)
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _stage_child(stage, config_path):
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    t0 = time.perf_counter()
+    substages = run_stage(stage, config["paths"], config)
+    seconds = time.perf_counter() - t0
+    result = {"seconds": seconds, "peak_rss_mb": peak_rss_mb(), "substages": substages}
+    sys.__stdout__.write(RESULT_PREFIX + json.dumps(result) + "\n")
+
+
+def measure_stage(stage, config_path, verbose=False):
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--_stage", stage, "--_config", config_path],
+                          capture_output=True, text=True, encoding="utf-8", errors="replace")
+    if verbose or proc.returncode != 0:
+        print(proc.stdout[-4000:], proc.stderr[-4000:])
+    if proc.returncode != 0:
+        raise RuntimeError(f"阶段 {stage} 失败（退出码 {proc.returncode}）")
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"阶段 {stage} 没有输出结果")
+
+
+# ========== 回归比较 ==========
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    """逐项与基准比较，返回回归列表 [(指标, 基准值, 当前值, 比值)]。"""
+    regressions = []
+    for stage, cur in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None:
+            continue
+        metrics = [(f"{stage}.seconds", base["seconds"], cur["seconds"], min_seconds),
+                   (f"{stage}.peak_rss_mb", base.get("peak_rss_mb"), cur.get("peak_rss_mb"), 1.0)]
+        for name, seconds in cur.get("substages", {}).items():
+            metrics.append((f"{stage}.{name}", base.get("substages", {}).get(name), seconds, min_seconds))
+        for metric, base_val, cur_val, min_abs in metrics:
+            if not base_val or cur_val is None:
+                continue
+            ratio = cur_val / base_val
+            if ratio > 1 + tolerance and cur_val - base_val > min_abs:
+                regressions.append((metric, base_val, cur_val, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-cohort benchmark of Step 1 / Step 3 / Step 4")
+    parser.add_argument("--subjects", type=int, default=100, help="Number of synthetic subjects")
+    parser.add_argument("--duration", type=float, default=60.0, help="Recording length per subject in seconds")
+    parser.add_argument("--sfreq", type=float, default=500.0, help="Sampling rate of the synthetic .set files")
+    parser.add_argument("--raw_kb", type=int, default=256, help="Size of each fake .eeg file in the Step 1 source tree (KB)")
+    parser.add_argument("--stages", nargs="+", default=["step1_cold", "step1_warm", "step3", "step4"])
+    parser.add_argument("--workers", type=int, default=1, help="Step 4 worker processes")
+    parser.add_argument("--stage_mode", default="copy", help="Step 3 stage_mode")
+    parser.add_argument("--no_render", action="store_true", help="Skip topomap rendering in Step 4")
+    parser.add_argument("--work_dir", default=None, help="Directory for the synthetic cohort (default: temporary, removed afterwards)")
+    parser.add_argument("--output", default=None, help="Write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown / memory growth")
+    parser.add_argument("--fail_on_regression", action="store_true", help="Exit with status 1 if a regression is flagged")
+    parser.add_argument("--verbose", action="store_true", help="Show stage output")
+    parser.add_argument("--_stage", help=argparse.SUPPRESS)
+    parser.add_argument("--_config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._stage:
+        _stage_child(args._stage, args._config)
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="eeg_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        t0 = time.perf_counter()
+        paths = generate_cohort(work_dir, args.subjects, args.duration, args.sfreq, args.raw_kb)
+        print(f"已生成 {args.subjects} 个被试的合成队列（{time.perf_counter() - t0:.1f}s）: {work_dir}")
+
+        config = {"paths": paths, "work_dir": work_dir, "workers": args.workers,
+                  "render": not args.no_render, "stage_mode": args.stage_mode}
+        config_path = os.path.join(work_dir, "bench_config.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+
+        import mne
+        results = {
+            "meta": {
+                "subjects": args.subjects, "duration": args.duration, "sfreq": args.sfreq,
+                "n_channels": len(CH_NAMES), "workers": args.workers, "render": not args.no_render,
+                "stage_mode": args.stage_mode, "python": platform.python_version(),
+                "numpy": np.__version__, "mne": mne.__version__, "platform": platform.platform(),
+                "cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "stages": {},
+        }
+        print(f"\n{'stage':<12} {'seconds':>9} {'peak RSS (MB)':>14}  substages")
+        for stage in args.stages:
+            res = measure_stage(stage, config_path, verbose=args.verbose)
+            results["stages"][stage] = res
+            rss = f"{res['peak_rss_mb']:.0f}" if res["peak_rss_mb"] is not None else "-"
+            subs = ", ".join(f"{k} {v:.2f}s" for k, v in res["substages"].items())
+            print(f"{stage:<12} {res['seconds']:>9.2f} {rss:>14}  {subs}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存至: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("subjects") != args.subjects:
+            print(f"[提示] 基准的被试数（{baseline.get('meta', {}).get('subjects')}）与本次不同，比较结果仅供参考")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n=== 发现 {len(regressions)} 项回归（容差 {args.tolerance:.0%}）===")
+            for metric, base_val, cur_val, ratio in regressions:
+                print(f"{metric:<28} 基准 {base_val:.3f} → 当前 {cur_val:.3f}（{ratio:.2f}x）")
+            if args.fail_on_regression:
+                sys.exit(1)
+        else:
+            print(f"\n未发现回归（容差 {args.tolerance:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
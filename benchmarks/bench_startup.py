@@ -0,0 +1,111 @@
+"""
+bench_startup.py
+
+启动开销基准：
+- 各模块的导入时间：每个模块在全新解释器中用 `python -X importtime` 导入，取累计导入时间（多次取最小值）
+- GUI 首个窗口出现的时间：以 EEG_GUI_STARTUP_BENCH=1 启动 main_GUI.py，窗口显示后 GUI 输出时间戳并退出
+  （需要图形界面与 customtkinter；无法启动时记录原因）
+
+用法：
+    python benchmarks/bench_startup.py --repeat 3 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 与 main_GUI.py 中的常量一致（不导入 main_GUI，以免本脚本自身依赖 customtkinter）
+STARTUP_BENCH_ENV = "EEG_GUI_STARTUP_BENCH"
+STARTUP_MARKER = "@@first_window"
+
+# 各步骤脚本 / GUI 直接导入的本仓库模块，以及它们可能用到的重型依赖
+MODULES = {
+    "GUI": ["customtkinter", "progress", "job_scheduler", "matlab.engine"],
+    "Step 1": ["copy_engine", "source_index"],
+    "Step 3": ["age_index", "staging"],
+    "Step 4": ["age_parameters", "step4_all_age", "psd_cache"],
+    "heavy": ["numpy", "pandas", "mne", "mne.io", "matplotlib.pyplot", "sklearn.preprocessing", "scipy.stats"],
+}
+
+
+def import_time(module, repeat=3):
+    """全新解释器中导入 module 的累计时间（秒，取最小值）；无法导入时返回 (None, 错误)。"""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=REPO_DIR, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+        # 格式：import time: self [us] | cumulative | imported package
+        cumulative = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            parts = line.split("|")
+            try:
+                cumulative[parts[2].strip()] = int(parts[1].strip()) / 1e6
+            except ValueError:
+                continue
+        seconds = cumulative.get(module, 0.0)  # 已被解释器启动时导入的模块没有记录
+        best = seconds if best is None else min(best, seconds)
+    return best, None
+
+
+def first_window_time(timeout=120):
+    """启动 main_GUI.py 到首个窗口显示的时间（秒）；失败时返回 (None, 原因)。"""
+    env = dict(os.environ, **{STARTUP_BENCH_ENV: "1"})
+    t0 = time.time()
+    try:
+        proc = subprocess.run([sys.executable, os.path.join(REPO_DIR, "main_GUI.py")], cwd=REPO_DIR, env=env,
+                              capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None, f"timeout after {timeout}s"
+    for line in proc.stdout.splitlines():
+        if line.startswith(STARTUP_MARKER):
+            return float(line.split()[1]) - t0, None
+    return None, (proc.stderr.strip().splitlines() or ["no window"])[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup / import-time benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (minimum is reported)")
+    parser.add_argument("--no_gui", action="store_true", help="Skip the time-to-first-window measurement")
+    parser.add_argument("--output", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "imports": {}, "first_window": None}
+    print(f"{'group':<8} {'module':<24} {'import (s)':>10}")
+    for group, modules in MODULES.items():
+        for module in modules:
+            seconds, error = import_time(module, repeat=args.repeat)
+            results["imports"][module] = {"group": group, "seconds": seconds, "error": error}
+            shown = f"{seconds:>10.3f}" if seconds is not None else f"{'-':>10}  ({error})"
+            print(f"{group:<8} {module:<24} {shown}")
+
+    if not args.no_gui:
+        runs = []
+        for _ in range(args.repeat):
+            seconds, error = first_window_time()
+            if seconds is None:
+                results["first_window_error"] = error
+                break
+            runs.append(seconds)
+        if runs:
+            results["first_window"] = min(runs)
+            print(f"\nGUI 首个窗口出现用时: {min(runs):.2f}s（{len(runs)} 次取最小值）")
+        else:
+            print(f"\nGUI 首个窗口: 无法测量（{results.get('first_window_error')}）")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存至: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
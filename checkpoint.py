@@ -0,0 +1,153 @@
+"""
+checkpoint.py
+
+功能：
+- 各步骤的被试级断点记录（账本）：每完成一个被试追加一行 JSON（被试键、输出文件及大小），
+  进程中途退出后重新运行时只处理未完成的被试
+- 重新运行时对已完成被试做低开销复核（只 stat 输出文件）：输出文件仍存在、大小与记录一致，
+  且修改时间不早于源文件（源文件被重新生成 / 修改后该被试重新处理）
+- 账本位于各步骤输出目录下的 .checkpoints/{step}.jsonl，只追加写入：写到一半中断的最后一行
+  会被忽略，同一键以最后一行为准
+- 输出 checkpoint 进度事件（已完成 N / 待处理 M），GUI 显示在进度区
+
+行格式：{"key": 被试键, "subject": 被试 ID, "outputs": [[路径, 字节数], ...], "time": 时间戳}
+Step 2 的 MATLAB 后端（step2_preprocess_multiple.m）按相同格式读写 step2 账本。
+Step 4 以被试 PSD 缓存条目作为断点（见 age_parameters.report_psd_checkpoints）：需显式开启（checkpoint=true），
+缓存位于 psd_checkpoint_dir(输出目录)，不按 LRU 淘汰，不再需要时手动删除。
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+from progress import emit
+
+CHECKPOINT_DIR = ".checkpoints"
+# 输出文件修改时间与源文件比较时的容差（秒）：FAT / SMB 的时间精度为 2 秒
+MTIME_TOLERANCE = 2.0
+
+
+def ledger_path(folder, step):
+    return os.path.join(folder, CHECKPOINT_DIR, f"{step}.jsonl")
+
+
+def psd_checkpoint_dir(base_output_dir):
+    """Step 4 断点（被试 PSD 缓存）目录。"""
+    return os.path.join(base_output_dir, CHECKPOINT_DIR, "step4_psd")
+
+
+class CheckpointLedger:
+    """
+    一个步骤的被试级断点账本。
+
+    参数：
+    path : str
+        账本文件路径（通常为 ledger_path(输出目录, 步骤名)）。
+    resume : bool
+        为 False 时清空已有记录（全部重新处理）。
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if resume:
+            self._load()
+        else:
+            self.clear()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # 中断时写了一半的行
+            if isinstance(entry, dict) and "key" in entry:
+                self.entries[entry["key"]] = entry
+        # 重复记录过多时压缩为每个键一行
+        if len(lines) > 2 * len(self.entries) + 100:
+            self.compact()
+
+    def verify(self, key, source_mtime=None, expected=None):
+        """
+        key 已记录完成且输出文件完好（存在、大小一致、不早于 source_mtime）时返回 True。
+        expected 不为 None 时，记录的输出文件还必须恰好是这些路径（如被试新增了文件则重新处理）。
+        """
+        entry = self.entries.get(key)
+        if entry is None or not entry.get("outputs"):
+            return False
+        if expected is not None and {os.path.abspath(p) for p in expected} != {p for p, _ in entry["outputs"]}:
+            return False
+        for path, size in entry["outputs"]:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if size is not None and st.st_size != size:
+                return False
+            if source_mtime is not None and st.st_mtime + MTIME_TOLERANCE < source_mtime:
+                return False
+        return True
+
+    def split(self, items):
+        """
+        items : iterable of (key, source_mtime, expected)，含义见 verify；source_mtime / expected 可为 None。
+
+        返回：
+        (已完成的键列表, 待处理的键列表)，保持 items 的顺序。
+        """
+        done, pending = [], []
+        for key, source_mtime, expected in items:
+            (done if self.verify(key, source_mtime, expected) else pending).append(key)
+        return done, pending
+
+    def mark_done(self, key, outputs, subject=None):
+        """记录 key 已完成（输出文件大小在此时读取），立即写入磁盘。"""
+        entry = {"key": key, "subject": subject,
+                 "outputs": [[os.path.abspath(path), os.path.getsize(path)] for path in outputs],
+                 "time": round(time.time(), 3)}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[key] = entry
+
+    def compact(self):
+        """把账本重写为每个键一行（临时文件 + 原子替换）。"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for entry in self.entries.values():
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def clear(self):
+        with self._lock:
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def report(step, done, total, label=""):
+    """打印并输出 checkpoint 事件：已完成 done 个被试，待处理 total - done 个。"""
+    remaining = total - done
+    name = f"{step} {label}".strip()
+    if done:
+        print(f"[断点续跑] {name}: 已完成 {done} 个被试，待处理 {remaining} 个")
+    emit("checkpoint", stage=step, label=label, done=done, remaining=remaining)
@@ -0,0 +1,99 @@
+"""
+cohort_buffer.py
+
+功能：
+- Step 4 一个年龄段的 PSD 张量 (subjects, channels, freqs)：按被试数预分配一块连续数组，
+  每个被试的 PSD 直接写入对应行，不再先收集成列表再 np.stack（峰值内存不再翻倍）
+- 可选 float32 存储（内存减半；下游的皮尔森相关仍以 float64 计算）
+- 可选写到磁盘的内存映射文件（np.lib.format.open_memmap），用于超过内存的大年龄段；
+  文件在 close() 时删除
+
+下游的频段 / 脑区统计均在 buffer.array（前 n 行的视图）上进行，不复制整个张量。
+"""
+
+import os
+import tempfile
+import numpy as np
+
+PSD_DTYPES = ("float64", "float32")
+
+
+class CohortBuffer:
+    """
+    参数：
+    capacity : int
+        预计的被试数；超出时按 1.5 倍扩容（内存映射模式下重新映射到更大的文件）。
+    dtype : str
+        'float64'（默认，与原先结果逐位一致）或 'float32'。
+    mmap_dir : str or None
+        不为 None 时把张量放在该目录下的临时 .npy 内存映射文件中。
+    """
+
+    def __init__(self, capacity, dtype="float64", mmap_dir=None):
+        if dtype not in PSD_DTYPES:
+            raise ValueError(f"Invalid PSD dtype: {dtype}")
+        self.capacity = max(1, int(capacity))
+        self.dtype = np.dtype(dtype)
+        self.mmap_dir = mmap_dir
+        self.n = 0
+        self._data = None
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _allocate(self, capacity, item_shape):
+        if self.mmap_dir is None:
+            return np.empty((capacity,) + item_shape, dtype=self.dtype), None
+        os.makedirs(self.mmap_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.mmap_dir, prefix=".cohort_psd_", suffix=".npy")
+        os.close(fd)
+        data = np.lib.format.open_memmap(path, mode="w+", dtype=self.dtype, shape=(capacity,) + item_shape)
+        return data, path
+
+    def append(self, psds):
+        """把一个被试的 (channels, freqs) PSD 写入下一行；形状必须与第一个被试一致。"""
+        psds = np.asarray(psds)
+        if self._data is None:
+            self._data, self._path = self._allocate(self.capacity, psds.shape)
+        elif psds.shape != self._data.shape[1:]:
+            raise ValueError(f"PSD 形状 {psds.shape} 与其他被试 {self._data.shape[1:]} 不一致（通道或采样率不同）")
+        if self.n == self.capacity:
+            self._grow(max(self.capacity + 1, int(self.capacity * 1.5)))
+        self._data[self.n] = psds
+        self.n += 1
+
+    def _grow(self, capacity):
+        data, path = self._allocate(capacity, self._data.shape[1:])
+        data[:self.n] = self._data[:self.n]
+        old_path = self._path
+        self._data, self._path, self.capacity = data, path, capacity
+        _remove(old_path)
+
+    @property
+    def array(self):
+        """已写入的 (n, channels, freqs) 视图；尚无被试时为 None。"""
+        if self._data is None:
+            return None
+        return self._data[:self.n]
+
+    def close(self):
+        """释放数组；内存映射模式下删除临时文件（仍被引用的映射在 Windows 上无法删除时保留）。"""
+        data, self._data = self._data, None
+        if isinstance(data, np.memmap):
+            data.flush()
+        del data
+        _remove(self._path)
+        self._path = None
+
+
+def _remove(path):
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
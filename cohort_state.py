@@ -0,0 +1,189 @@
+"""
+cohort_state.py
+
+功能：
+- 持久化每个年龄段的群体统计状态（Step 4 增量模式使用）
+- 群体均值用累加和维护，脑区 × 频段功率的均值 / 标准差用 Welford 累加器维护
+- 支持只加入新被试、移除被试，无需对整个年龄段重新计算
+
+每个被试还保存其脑区 PSD、脑区 × 频段功率、频段平均功率和 topomap 数值，
+以便在群体常模更新后重新计算所有被试的皮尔森相似度与分类标签。
+"""
+
+import os
+import pickle
+import tempfile
+import numpy as np
+
+from psd_cache import _companion_files
+
+STATE_FILE = "cohort_state.npz"
+STATE_VERSION = 1
+
+
+def file_signature(set_path):
+    """.set（及同名 .fdt）的 大小:修改时间 指纹，用于发现被重新预处理的被试。"""
+    parts = []
+    for path in _companion_files(set_path):
+        st = os.stat(path)
+        parts.append(f"{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(parts)
+
+
+class CohortState:
+    """
+    一个年龄段的增量群体统计。
+
+    参数：
+    ch_names : list of str
+        通道顺序（所有被试必须一致）。
+    freqs : ndarray
+        PSD 频率轴。
+    info : mne.Info
+        绘制拓扑图所需的电极布局。
+    n_regions, n_bands : int
+        脑区数、频段数。
+    """
+
+    def __init__(self, ch_names, freqs, info, n_regions, n_bands):
+        self.ch_names = list(ch_names)
+        self.freqs = np.asarray(freqs)
+        self.info = info
+        n_chan = len(self.ch_names)
+        n_freqs = self.freqs.size
+
+        # 被试级数据
+        self.subject_ids = []
+        self.file_sigs = []
+        self.region_psd = np.empty((0, n_regions, n_freqs))
+        self.region_band_values = np.empty((0, n_regions, n_bands))
+        self.psd_band_avg = np.empty((0, n_chan, n_bands))
+        self.topo_values = np.empty((0, n_chan, n_bands))
+
+        # 群体累加量
+        self.region_psd_sum = np.zeros((n_regions, n_freqs))
+        self.band_avg_sum = np.zeros((n_chan, n_bands))
+        self.rb_mean = np.zeros((n_regions, n_bands))
+        self.rb_m2 = np.zeros((n_regions, n_bands))
+
+    @property
+    def n(self):
+        return len(self.subject_ids)
+
+    # ---------- 更新 ----------
+    def add(self, subject_ids, file_sigs, region_psd, region_band_values, psd_band_avg, topo_values):
+        """批量加入被试；群体均值 / 方差按 Chan 等人的并行 Welford 公式合并。"""
+        n_new = len(subject_ids)
+        if n_new == 0:
+            return
+        duplicated = set(subject_ids) & set(self.subject_ids)
+        if duplicated:
+            raise ValueError(f"被试已存在于群体状态中: {sorted(duplicated)}")
+
+        batch_mean = np.mean(region_band_values, axis=0)
+        batch_m2 = np.sum((region_band_values - batch_mean) ** 2, axis=0)
+        n_old = self.n
+        n_total = n_old + n_new
+        delta = batch_mean - self.rb_mean
+        self.rb_mean = self.rb_mean + delta * (n_new / n_total)
+        self.rb_m2 = self.rb_m2 + batch_m2 + delta ** 2 * (n_old * n_new / n_total)
+
+        self.region_psd_sum += np.sum(region_psd, axis=0)
+        self.band_avg_sum += np.sum(psd_band_avg, axis=0)
+
+        self.subject_ids.extend(subject_ids)
+        self.file_sigs.extend(file_sigs)
+        self.region_psd = np.concatenate([self.region_psd, region_psd])
+        self.region_band_values = np.concatenate([self.region_band_values, region_band_values])
+        self.psd_band_avg = np.concatenate([self.psd_band_avg, psd_band_avg])
+        self.topo_values = np.concatenate([self.topo_values, topo_values])
+
+    def remove(self, subject_ids):
+        """移除被试（逆向 Welford 更新），不存在的被试忽略。"""
+        index = {sid: i for i, sid in enumerate(self.subject_ids)}
+        rows = sorted({index[sid] for sid in subject_ids if sid in index})
+        if not rows:
+            return
+        n_cur = self.n
+        for row in rows:
+            x = self.region_band_values[row]
+            if n_cur <= 1:
+                self.rb_mean = np.zeros_like(self.rb_mean)
+                self.rb_m2 = np.zeros_like(self.rb_m2)
+            else:
+                new_mean = (n_cur * self.rb_mean - x) / (n_cur - 1)
+                self.rb_m2 = self.rb_m2 - (x - new_mean) * (x - self.rb_mean)
+                self.rb_mean = new_mean
+            self.region_psd_sum -= self.region_psd[row]
+            self.band_avg_sum -= self.psd_band_avg[row]
+            n_cur -= 1
+
+        keep = np.ones(self.n, dtype=bool)
+        keep[rows] = False
+        self.subject_ids = [sid for sid, k in zip(self.subject_ids, keep) if k]
+        self.file_sigs = [sig for sig, k in zip(self.file_sigs, keep) if k]
+        self.region_psd = self.region_psd[keep]
+        self.region_band_values = self.region_band_values[keep]
+        self.psd_band_avg = self.psd_band_avg[keep]
+        self.topo_values = self.topo_values[keep]
+        if self.n == 0:
+            self.region_psd_sum[:] = 0
+            self.band_avg_sum[:] = 0
+
+    # ---------- 群体常模 ----------
+    @property
+    def group_region_psd(self):
+        return self.region_psd_sum / self.n
+
+    @property
+    def group_psd_band_avg(self):
+        return self.band_avg_sum / self.n
+
+    @property
+    def region_band_mean(self):
+        return self.rb_mean
+
+    @property
+    def region_band_std(self):
+        # 总体标准差（与 np.std 默认 ddof=0 相同）；抵消误差可能产生极小负数
+        return np.sqrt(np.maximum(self.rb_m2 / self.n, 0))
+
+    # ---------- 持久化 ----------
+    def save(self, path):
+        """原子写入 .npz。"""
+        info_bytes = np.frombuffer(pickle.dumps(self.info, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, version=STATE_VERSION, ch_names=np.array(self.ch_names), freqs=self.freqs, info=info_bytes,
+                         subject_ids=np.array(self.subject_ids, dtype=str),
+                         file_sigs=np.array(self.file_sigs, dtype=str),
+                         region_psd=self.region_psd, region_band_values=self.region_band_values,
+                         psd_band_avg=self.psd_band_avg, topo_values=self.topo_values,
+                         region_psd_sum=self.region_psd_sum, band_avg_sum=self.band_avg_sum,
+                         rb_mean=self.rb_mean, rb_m2=self.rb_m2)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != STATE_VERSION:
+                raise ValueError(f"不支持的群体状态版本: {int(data['version'])}")
+            region_psd = data["region_psd"]
+            state = cls([str(ch) for ch in data["ch_names"]], data["freqs"],
+                        pickle.loads(data["info"].tobytes()), region_psd.shape[1], data["rb_mean"].shape[1])
+            state.subject_ids = [str(s) for s in data["subject_ids"]]
+            state.file_sigs = [str(s) for s in data["file_sigs"]]
+            state.region_psd = region_psd
+            state.region_band_values = data["region_band_values"]
+            state.psd_band_avg = data["psd_band_avg"]
+            state.topo_values = data["topo_values"]
+            state.region_psd_sum = data["region_psd_sum"]
+            state.band_avg_sum = data["band_avg_sum"]
+            state.rb_mean = data["rb_mean"]
+            state.rb_m2 = data["rb_m2"]
+        return state
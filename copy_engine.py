@@ -0,0 +1,114 @@
+"""
+copy_engine.py
+
+功能：
+- 并发复制文件（有界线程池，适合网络共享盘这类 I/O 受限的场景）
+- 目标文件大小与修改时间均与源文件一致时跳过，重复运行不会重新复制
+- 先写入同目录临时文件再原子重命名，中断时不会留下不完整的目标文件
+- 失败自动重试，结束后输出吞吐量（files/s、MB/s）
+"""
+
+import os
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+COPY_SKIPPED = "skipped"
+COPY_COPIED = "copied"
+COPY_FAILED = "failed"
+
+# FAT/exFAT 的修改时间精度为 2 秒，SMB 共享盘上也常见取整误差
+MTIME_TOLERANCE = 2.0
+
+
+def is_up_to_date(src, dst):
+    """目标存在、大小与源文件一致，且修改时间相差不超过 MTIME_TOLERANCE 秒（兼容 FAT/SMB 的时间精度）。"""
+    try:
+        src_st = os.stat(src)
+        dst_st = os.stat(dst)
+    except OSError:
+        return False
+    return src_st.st_size == dst_st.st_size and abs(src_st.st_mtime - dst_st.st_mtime) <= MTIME_TOLERANCE
+
+
+def atomic_copy(src, dst):
+    """复制到目标目录下的临时文件（保留修改时间），再原子重命名为 dst。"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".copy_", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _copy_one(src, dst, retries, retry_delay):
+    """返回 (状态, 复制字节数, 错误信息)。"""
+    if is_up_to_date(src, dst):
+        return COPY_SKIPPED, 0, None
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            atomic_copy(src, dst)
+            return COPY_COPIED, os.path.getsize(dst), None
+        except Exception as e:
+            last_error = e
+            if attempt < retries:
+                time.sleep(retry_delay * (attempt + 1))
+    return COPY_FAILED, 0, last_error
+
+
+def copy_files(jobs, workers=8, retries=2, retry_delay=1.0, progress=None, on_result=None):
+    """
+    并发复制一组文件。
+
+    参数：
+    jobs : list of (src, dst)
+        源路径与目标路径。
+    workers : int
+        并发复制线程数。
+    retries : int
+        每个文件失败后的重试次数。
+    retry_delay : float
+        重试等待时间（秒），按重试次数线性增加。
+    progress : callable or None
+        每完成一个文件调用 progress(文件名, 秒)（如 progress.ProgressTracker.update）。
+    on_result : callable or None
+        每完成一个文件调用 on_result(src, dst, 状态)，状态为 COPY_COPIED / COPY_SKIPPED / COPY_FAILED。
+
+    返回：
+    dict，包含 copied / skipped / failed（失败的 (src, 错误) 列表）、bytes、seconds。
+    """
+    stats = {"copied": 0, "skipped": 0, "failed": [], "bytes": 0, "seconds": 0.0}
+    t0 = time.perf_counter()
+
+    def run(job):
+        t_job = time.perf_counter()
+        return _copy_one(job[0], job[1], retries, retry_delay) + (time.perf_counter() - t_job,)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for (src, dst), (status, n_bytes, error, seconds) in zip(jobs, executor.map(run, jobs)):
+            if progress is not None:
+                progress(os.path.basename(src), seconds)
+            if on_result is not None:
+                on_result(src, dst, status)
+            if status == COPY_COPIED:
+                stats["copied"] += 1
+                stats["bytes"] += n_bytes
+            elif status == COPY_SKIPPED:
+                stats["skipped"] += 1
+            else:
+                stats["failed"].append((src, error))
+    stats["seconds"] = time.perf_counter() - t0
+    return stats
+
+
+def format_throughput(stats):
+    seconds = max(stats["seconds"], 1e-9)
+    mb = stats["bytes"] / 1024 ** 2
+    return (f"复制 {stats['copied']} 个文件（{mb:.1f} MB），跳过未变化 {stats['skipped']} 个，"
+            f"失败 {len(stats['failed'])} 个，用时 {stats['seconds']:.1f}s，"
+            f"{stats['copied'] / seconds:.1f} files/s，{mb / seconds:.1f} MB/s")
@@ -0,0 +1,119 @@
+"""
+feature_store.py
+
+功能：
+- 在 sub_sim.xlsx 之外，把合并结果表写成列式文件（Parquet / Feather，需要 pyarrow；
+  未安装时改写为 sub_sim.csv）
+- 把整个年龄段的数组特征写成可内存映射的 .npy：
+    psd.npy          (subjects, channels, freqs)  被试 PSD
+    band_avg.npy     (subjects, channels, bands)  频段平均功率
+    region_psd.npy   (subjects, regions, freqs)   脑区平均 PSD
+  以及描述各轴含义的 meta.json
+- load_feature_store 以 mmap_mode='r' 读取，下游分析无需重跑 Step 4
+
+所有文件写入 output_dir/features/，先写临时文件再原子重命名。
+"""
+
+import os
+import json
+import tempfile
+import numpy as np
+
+FEATURE_DIR = "features"
+TABLE_FORMATS = ("parquet", "feather", "none")
+ARRAY_NAMES = ("psd", "band_avg", "region_psd")
+
+
+def _atomic_write(path, write_func):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write_func(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _save_npy(path, array):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+    _atomic_write(path, write)
+
+
+def write_table(df, feature_dir, table_format="parquet"):
+    """写出列式结果表；未安装 pyarrow 时改写为 CSV 并提示，返回写出的路径或 None。"""
+    if table_format == "none":
+        return None
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Invalid table_format: {table_format}")
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print(f"[提示] 未安装 pyarrow，{table_format} 结果表改为输出 sub_sim.csv（pip install pyarrow）")
+        table_format = "csv"
+
+    path = os.path.join(feature_dir, f"sub_sim.{table_format}")
+    if table_format == "csv":
+        _atomic_write(path, lambda tmp: df.to_csv(tmp, index=False, encoding="utf-8-sig"))
+    elif table_format == "parquet":
+        _atomic_write(path, lambda tmp: df.to_parquet(tmp, index=False))
+    else:
+        _atomic_write(path, lambda tmp: df.reset_index(drop=True).to_feather(tmp))
+    return path
+
+
+def write_feature_store(output_dir, df, group_id, ch_names, freqs, band_names, region_names,
+                        psd=None, band_avg=None, region_psd=None, table_format="parquet"):
+    """
+    写出一个年龄段的特征库。
+
+    参数中的数组为 None 时不写出该数组，并删除旧文件，避免与新的被试列表不一致。
+    """
+    feature_dir = os.path.join(output_dir, FEATURE_DIR)
+    os.makedirs(feature_dir, exist_ok=True)
+
+    arrays = {"psd": psd, "band_avg": band_avg, "region_psd": region_psd}
+    shapes = {}
+    for name, array in arrays.items():
+        path = os.path.join(feature_dir, f"{name}.npy")
+        if array is None:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        _save_npy(path, array)
+        shapes[name] = list(array.shape)
+
+    meta = {
+        "subject_id": list(group_id),
+        "ch_names": list(ch_names),
+        "freqs": np.asarray(freqs).tolist(),
+        "bands": list(band_names),
+        "regions": list(region_names),
+        "arrays": shapes,
+    }
+
+    def write_meta(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+    _atomic_write(os.path.join(feature_dir, "meta.json"), write_meta)
+
+    table_path = write_table(df, feature_dir, table_format)
+    print(f"特征库已保存至: {feature_dir}")
+    return table_path
+
+
+def load_feature_store(output_dir, mmap=True):
+    """
+    读取特征库：返回 meta（dict）以及存在的数组；mmap=True 时数组为只读内存映射（零拷贝）。
+    """
+    feature_dir = os.path.join(output_dir, FEATURE_DIR)
+    with open(os.path.join(feature_dir, "meta.json"), "r", encoding="utf-8") as f:
+        store = json.load(f)
+    for name in ARRAY_NAMES:
+        path = os.path.join(feature_dir, f"{name}.npy")
+        if os.path.exists(path):
+            store[name] = np.load(path, mmap_mode="r" if mmap else None)
+    return store
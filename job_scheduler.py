@@ -0,0 +1,303 @@
+"""
+job_scheduler.py
+
+功能：
+- GUI 各步骤的统一任务调度：限制同时运行的任务数，按步骤依赖排队
+  （如 Step 4 等待排在前面的 Step 3 完成；依赖任务失败或被取消时，后续任务一并取消）
+- 同一步骤的多个任务依次运行，不会同时读写相同的文件夹
+- 取消：排队中的任务直接移除；运行中的任务终止整个子进程树（含进程池 worker），
+  或调用任务注册的取消回调（如中止 MATLAB 引擎调用）
+- StatusFile：步骤状态文件的加锁读改写，先写临时文件再原子替换，不会被并发写坏
+"""
+
+import os
+import json
+import signal
+import tempfile
+import threading
+import subprocess
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# 步骤 -> 需要先成功完成的步骤（只针对已在队列中 / 正在运行的任务）
+STEP_DEPENDENCIES = {
+    "step1": (),
+    "step2": ("step1",),
+    "step3": ("step2",),
+    "step4": ("step3",),
+    "pipeline": ("step1",),
+}
+# 步骤 -> 读写相同文件夹、需要等待其结束（不要求成功）的步骤
+STEP_CONFLICTS = {
+    "step2": ("pipeline",),
+    "step3": ("pipeline",),
+    "step4": ("pipeline",),
+    "pipeline": ("step2", "step3", "step4"),
+}
+# 任务 -> 在步骤状态文件中记录的步骤（流水线一次完成 Step 2-4，没有单独的状态项）
+STATUS_STEPS = {
+    "pipeline": ("step2", "step3", "step4"),
+}
+
+
+class Job:
+    """一个排队 / 运行中的任务；runner(job) 返回是否成功。"""
+
+    def __init__(self, job_id, step, runner):
+        self.job_id = job_id
+        self.step = step
+        self.runner = runner
+        self.status = QUEUED
+        self.depends = []      # 必须成功完成的任务
+        self.after = []        # 只需结束的任务
+        self.error = None
+        self.cancel_requested = False
+        self._cancel_hook = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.step}#{self.job_id}"
+
+    def set_cancel_hook(self, hook):
+        """注册取消回调（如终止子进程）；任务已被要求取消时立即调用。"""
+        with self._lock:
+            self._cancel_hook = hook
+            cancel_now = self.cancel_requested
+        if cancel_now and hook is not None:
+            hook()
+
+    def request_cancel(self):
+        with self._lock:
+            self.cancel_requested = True
+            hook = self._cancel_hook
+        if hook is not None:
+            hook()
+
+
+class JobScheduler:
+    """
+    参数：
+    max_concurrent : int
+        同时运行的最大任务数。
+    on_change : callable or None
+        任务状态变化时调用 on_change(job)（在调度线程中调用，需自行保证线程安全）。
+    """
+
+    def __init__(self, max_concurrent=1, on_change=None):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.on_change = on_change
+        self.jobs = []
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def submit(self, step, runner):
+        """加入队列并尝试启动，返回 Job。"""
+        with self._lock:
+            job = Job(self._next_id, step, runner)
+            self._next_id += 1
+            for other in self.active():
+                if other.step in STEP_DEPENDENCIES.get(step, ()):
+                    job.depends.append(other)
+                elif other.step == step or other.step in STEP_CONFLICTS.get(step, ()):
+                    job.after.append(other)
+            self.jobs.append(job)
+            self._notify(job)
+            self._schedule()
+        return job
+
+    def active(self):
+        with self._lock:
+            return [job for job in self.jobs if job.status not in FINISHED]
+
+    def set_max_concurrent(self, max_concurrent):
+        with self._lock:
+            self.max_concurrent = max(1, int(max_concurrent))
+            self._schedule()
+
+    def cancel(self, job):
+        with self._lock:
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.error = "已取消"
+                self._notify(job)
+                self._schedule()
+                return
+            if job.status != RUNNING:
+                return
+        job.request_cancel()
+
+    def cancel_all(self):
+        """先取消排队任务（避免其在运行任务结束后启动），再终止运行中的任务。"""
+        jobs = self.active()
+        for job in jobs:
+            if job.status == QUEUED:
+                self.cancel(job)
+        for job in jobs:
+            if job.status == RUNNING:
+                self.cancel(job)
+
+    def _notify(self, job):
+        if self.on_change is not None:
+            try:
+                self.on_change(job)
+            except Exception:
+                pass
+
+    def _schedule(self):
+        with self._lock:
+            changed = True
+            while changed:  # 依赖失败引起的取消可能级联
+                changed = False
+                for job in self.jobs:
+                    if job.status != QUEUED:
+                        continue
+                    failed_dep = next((dep for dep in job.depends if dep.status in (FAILED, CANCELLED)), None)
+                    if failed_dep is not None:
+                        job.status = CANCELLED
+                        job.error = f"依赖任务 {failed_dep.step} 未成功完成"
+                        self._notify(job)
+                        changed = True
+
+            n_running = sum(job.status == RUNNING for job in self.jobs)
+            for job in self.jobs:
+                if n_running >= self.max_concurrent:
+                    break
+                if job.status != QUEUED:
+                    continue
+                if all(dep.status == DONE for dep in job.depends) and all(j.status in FINISHED for j in job.after):
+                    job.status = RUNNING
+                    n_running += 1
+                    self._notify(job)
+                    threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        ok = False
+        try:
+            ok = bool(job.runner(job))
+        except Exception as e:
+            job.error = str(e)
+        with self._lock:
+            if job.cancel_requested:
+                job.status = CANCELLED
+                job.error = job.error or "已取消"
+            else:
+                job.status = DONE if ok else FAILED
+            self._notify(job)
+            self._schedule()
+
+
+# ========== 子进程 ==========
+def _process_group_kwargs():
+    """让子进程成为新进程组的组长，取消时可以连同进程池 worker 一起终止。"""
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_tree(process):
+    """终止 process 及其全部子进程。"""
+    if process.poll() is not None:
+        return
+    try:
+        import psutil
+        try:
+            parent = psutil.Process(process.pid)
+            for child in parent.children(recursive=True):
+                child.kill()
+            parent.kill()
+        except psutil.NoSuchProcess:
+            pass
+        return
+    except ImportError:
+        pass
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def run_subprocess(job, cmd, on_line, env=None):
+    """
+    在任务中运行子进程，逐行回调 stdout（合并 stderr），取消时终止整个进程树。
+
+    返回：
+    子进程退出码。
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        encoding="utf-8",
+        errors="replace",
+        env=env,
+        **_process_group_kwargs()
+    )
+    job.set_cancel_hook(lambda: kill_process_tree(process))
+    for line in process.stdout:
+        on_line(line)
+    return process.wait()
+
+
+# ========== 步骤状态文件 ==========
+class StatusFile:
+    """
+    step_status.json 的线程安全读写；每次更新都是 读取 -> 修改 -> 写临时文件 -> os.replace。
+    文件缺失或损坏时按全部未完成处理。
+    """
+
+    def __init__(self, path, steps=("step1", "step2", "step3", "step4")):
+        self.path = path
+        self.steps = tuple(steps)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                status = json.load(f)
+            if isinstance(status, dict):
+                return status
+        except (OSError, ValueError):
+            pass
+        return {step: False for step in self.steps}
+
+    def _write(self, status):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".status_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(status, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read(self, step):
+        with self._lock:
+            return self._read().get(step, False)
+
+    def update(self, step, value):
+        """记录 step 的状态；流水线等复合任务同时更新其覆盖的各步骤（见 STATUS_STEPS）。"""
+        with self._lock:
+            status = self._read()
+            for key in STATUS_STEPS.get(step, (step,)):
+                status[key] = value
+            self._write(status)
+
+    def reset(self):
+        with self._lock:
+            self._write({step: False for step in self.steps})
+
+    def ensure(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                self._write({step: False for step in self.steps})
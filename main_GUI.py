@@ -6,25 +6,62 @@ import os
 import json
 import importlib.util
 import threading
+import queue
 import time
-import matlab.engine
-import matlab
 import sys
+from progress import PROGRESS_ENV, parse_event
+from job_scheduler import JobScheduler, StatusFile, run_subprocess, QUEUED, CANCELLED
+from step_worker import StepWorker, StepWorkerPool
+from checkpoint import CheckpointLedger, ledger_path
+
+# MATLAB Engine 导入需要数秒：启动时只检查是否安装，真正导入推迟到 Step 2（MATLAB 后端）运行或后台预热时。
+# 未安装时只能使用 Python/MNE 预处理后端
+MATLAB_AVAILABLE = importlib.util.find_spec("matlab") is not None
+_matlab_engine = None
+_matlab_lock = threading.Lock()
+
+
+def import_matlab_engine():
+    """导入并返回 matlab.engine（只导入一次，可在后台线程中预热）。"""
+    global _matlab_engine
+    with _matlab_lock:
+        if _matlab_engine is None:
+            import matlab.engine
+            _matlab_engine = matlab.engine
+    return _matlab_engine
 
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
 
 if getattr(sys, 'frozen', False):
     BASE_DIR = sys._MEIPASS
+    # 打包后 BASE_DIR 是每次启动解压、退出即删除的临时目录，日志与状态文件写到用户的应用数据目录
+    DATA_DIR = os.path.join(os.environ.get("APPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+                            "eeg_gui")
+    os.makedirs(DATA_DIR, exist_ok=True)
 else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    DATA_DIR = BASE_DIR
 # CONFIG_PY_PATH = os.path.join(BASE_DIR, "config.py")
 # CONFIG_JSON_PATH = os.path.join(BASE_DIR, "config.json")
 # STATUS_PATH = os.path.join(os.path.expanduser("~"), "step_status.json")
-STATUS_PATH = os.path.join(BASE_DIR, "step_status.json")
+STATUS_PATH = os.path.join(DATA_DIR, "step_status.json")
 STEP1_SCRIPT = os.path.join(BASE_DIR, "step1_copy_data.py")
+STEP2_PY_SCRIPT = os.path.join(BASE_DIR, "step2_preprocess_mne.py")
+PIPELINE_SCRIPT = os.path.join(BASE_DIR, "pipeline.py")
 STEP3_SCRIPT = os.path.join(BASE_DIR, "step3_age_data_match.py")
 STEP4_SCRIPT = os.path.join(BASE_DIR, "step4_all_age.py")
+STEP2_BACKENDS = ("matlab", "python")  # Step 2 预处理后端（下拉菜单的选项）
+GUI_LOG_PATH = os.path.join(DATA_DIR, "gui_log.txt")  # 完整日志（日志框只保留最近 LOG_MAX_LINES 行）
+
+LOG_TICK_MS = 100          # 日志框刷新间隔
+LOG_MAX_LINES = 5000       # 日志框保留的最大行数
+LOG_BATCH_LIMIT = 20000    # 每次刷新最多取出的消息数 / 进度事件数，其余留到下一次
+RESET_EVENT = {"event": "reset"}  # 任务开始时清空进度显示，与进度事件同一队列以保持先后顺序
+
+WARMUP_ENV = "EEG_GUI_WARMUP"                # =1 时窗口显示后自动在后台预热 MATLAB Engine
+STARTUP_BENCH_ENV = "EEG_GUI_STARTUP_BENCH"  # =1 时窗口显示后输出 STARTUP_MARKER 与时间戳并退出（启动基准）
+STARTUP_MARKER = "@@first_window"
 
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
@@ -37,6 +74,21 @@ class EEGGuiApp:
 
         self.param_vars = {}
 
+        # 日志队列：任意线程 put，主线程按固定间隔批量取出写入日志框与 GUI_LOG_PATH
+        self.log_queue = queue.Queue()
+        # 进度事件队列：同样在主线程按固定间隔取出，每次刷新同一阶段只显示最新的进度
+        self.event_queue = queue.Queue()
+        self.log_file = open(GUI_LOG_PATH, "a", encoding="utf-8")
+
+        # 任务调度：限制并发数、按步骤依赖排队、可取消；步骤状态文件原子更新
+        self.status = StatusFile(STATUS_PATH)
+        self.scheduler = JobScheduler(max_concurrent=1, on_change=self.on_job_change)
+
+        # 常驻 worker：步骤脚本在已预热的解释器中运行，MATLAB 引擎在 worker 中常驻
+        worker_env = dict(os.environ, **{PROGRESS_ENV: "1"})
+        self.worker_pool = StepWorkerPool(env=worker_env)
+        self.matlab_worker = StepWorker(preload=False, env=worker_env)
+
         self.build_tabs()
         self.build_buttons()
         self.build_output()
@@ -45,7 +97,18 @@ class EEGGuiApp:
         self.stop_log_monitor = False
         self.log_monitor_thread = None
 
+        self.app.after(LOG_TICK_MS, self._drain_log_queue)
+        if os.environ.get(STARTUP_BENCH_ENV) == "1":
+            self.app.after(0, lambda: self.app.after_idle(self._report_first_window))
+        else:
+            self.app.after(200, self.toggle_worker)
+            if os.environ.get(WARMUP_ENV) == "1":
+                self.warmup_var.set(True)
+                self.app.after(500, self.toggle_warmup)
         self.app.mainloop()
+        self.worker_pool.close()
+        self.matlab_worker.close()
+        self.log_file.close()
 
     def build_tabs(self):
         self.tabview = ctk.CTkTabview(self.app, width=980, height=380)
@@ -67,11 +130,17 @@ class EEGGuiApp:
         self._add_entry(self.step1_tab, "start_date", "开始日期 (YYYY-MM-DD):", "")
         self._add_entry(self.step1_tab, "end_date", "结束日期 (YYYY-MM-DD):", "")
         self._add_entry(self.step1_tab, "output_path", "输出路径 (step1):", "")
+        self.rebuild_index_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(self.step1_tab, text="重建源数据索引（完整重新扫描源路径；原地覆盖的文件未被发现时使用）",
+                        variable=self.rebuild_index_var, font=("Microsoft YaHei", 13)).pack(anchor="w", pady=(4, 6))
 
     def build_step2_fields(self):
         self._add_section_header(self.step2_tab, "Step 2 - MATLAB 预处理参数")
         self._add_entry(self.step2_tab, "input_folder", "MATLAB 输入路径: (step2)", "")
         self._add_entry(self.step2_tab, "output_folder", "MATLAB 输出路径: (step2)", "")
+        self._add_option(self.step2_tab, "step2_backend", "预处理后端:", STEP2_BACKENDS,
+                         "matlab" if MATLAB_AVAILABLE else "python")
+        self._add_entry(self.step2_tab, "step2_workers", "并行进程数 (python 后端，0 = 全部 CPU 核):", "0")
 
     def build_step3_fields(self):
         self._add_section_header(self.step3_tab, "Step 3 - 年龄匹配参数")
@@ -97,6 +166,14 @@ class EEGGuiApp:
         entry.pack(pady=(0, 6))
         self.param_vars[key] = entry
 
+    def _add_option(self, parent, key, label_text, values, default):
+        label = ctk.CTkLabel(parent, text=label_text, font=("Microsoft YaHei", 14))
+        label.pack(fill="x", pady=(4, 2))
+        option = ctk.CTkOptionMenu(parent, values=list(values), font=("Microsoft YaHei", 13))
+        option.set(default)
+        option.pack(pady=(0, 6))
+        self.param_vars[key] = option
+
     def build_buttons(self):
         self.btn_frame = ctk.CTkFrame(self.app)
         self.btn_frame.pack(pady=10)
@@ -113,11 +190,48 @@ class EEGGuiApp:
         ctk.CTkButton(self.btn_frame, text="Step4: 报告生成分析", 
               command=self.run_step4,
               fg_color="#3B8ED0", hover_color="#2A6BA0").grid(row=0, column=3, padx=10, pady=5)
+        ctk.CTkButton(self.btn_frame, text="Step2→4: 流水线执行", 
+              command=self.run_pipeline,
+              fg_color="#2E8B57", hover_color="#246B43").grid(row=0, column=4, padx=10, pady=5)
+
+        ctk.CTkLabel(self.btn_frame, text="最大并发任务数:", font=("Microsoft YaHei", 13)).grid(
+            row=1, column=0, padx=10, pady=5, sticky="e")
+        self.max_jobs_entry = ctk.CTkEntry(self.btn_frame, width=60, font=("Microsoft YaHei", 13))
+        self.max_jobs_entry.insert(0, "1")
+        self.max_jobs_entry.grid(row=1, column=1, padx=10, pady=5, sticky="w")
+        self.warmup_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(self.btn_frame, text="后台预热 MATLAB Engine", variable=self.warmup_var,
+                        command=self.toggle_warmup, font=("Microsoft YaHei", 13)).grid(row=1, column=2, padx=10, pady=5)
+        self.worker_var = tk.BooleanVar(value=True)
+        ctk.CTkCheckBox(self.btn_frame, text="常驻 worker（复用已预热的解释器 / MATLAB 引擎）", variable=self.worker_var,
+                        command=self.toggle_worker, font=("Microsoft YaHei", 13)).grid(
+            row=2, column=0, columnspan=3, padx=10, pady=5, sticky="w")
+        self.resume_var = tk.BooleanVar(value=True)
+        ctk.CTkCheckBox(self.btn_frame, text="断点续跑（跳过已完成的被试）", variable=self.resume_var,
+                        font=("Microsoft YaHei", 13)).grid(row=2, column=3, columnspan=2, padx=10, pady=5, sticky="w")
+        self.psd_checkpoint_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(self.btn_frame, text="Step 4 保留被试 PSD 作为断点（占用磁盘，不自动清理）",
+                        variable=self.psd_checkpoint_var, font=("Microsoft YaHei", 13)).grid(
+            row=3, column=0, columnspan=3, padx=10, pady=5, sticky="w")
+        ctk.CTkButton(self.btn_frame, text="取消任务（排队 + 运行中）", command=self.cancel_jobs,
+              fg_color="#C0392B", hover_color="#962D22").grid(row=1, column=3, columnspan=2, padx=10, pady=5)
 
         ctk.CTkButton(self.app, text="刷新步骤状态", command=self.reset_status,
                     fg_color="#6C7A89", hover_color="#55616D", width=300, height=30).pack(pady=5)
 
     def build_output(self):
+        # 进度条与阶段用时（由子进程输出的进度事件驱动，见 progress.py）
+        self.progress_bar = ctk.CTkProgressBar(self.app, width=960)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(padx=10, pady=(6, 2))
+        self.progress_label = ctk.CTkLabel(self.app, text="", font=("Microsoft YaHei", 13))
+        self.progress_label.pack(anchor="w", padx=10)
+        self.stage_label = ctk.CTkLabel(self.app, text="", font=("Microsoft YaHei", 12), text_color="#55616D")
+        self.stage_label.pack(anchor="w", padx=10)
+        self.checkpoint_label = ctk.CTkLabel(self.app, text="", font=("Microsoft YaHei", 12), text_color="#2E8B57")
+        self.checkpoint_label.pack(anchor="w", padx=10)
+        self.checkpoint_counts = {}
+
         label = ctk.CTkLabel(self.app, text="日志输出", font=("Arial", 16, "bold"))
         label.pack(pady=(10, 4))
 
@@ -125,99 +239,233 @@ class EEGGuiApp:
         self.log_box.pack(fill="both", expand=True, padx=10, pady=5)
         self.log_box.configure(state="disabled")
 
-    def reset_status(self):
-        with open("step_status.json", "w") as f:
-            json.dump({"step1": False, "step2": False, "step3": False, "step4": False}, f)
-        self.log(">>> 步骤状态已重置为未完成\n")
+    # ========== 启动与预热 ==========
+    def _report_first_window(self):
+        self.app.update_idletasks()
+        print(f"{STARTUP_MARKER} {time.time():.6f}", flush=True)
+        self.app.destroy()
+
+    def toggle_warmup(self):
+        """勾选"后台预热"时在后台线程中导入 MATLAB Engine，之后的 Step 2 不再等待导入。"""
+        if not self.warmup_var.get():
+            return
+        if not MATLAB_AVAILABLE:
+            self.log("[预热] 未安装 MATLAB Engine，无需预热\n")
+            return
+
+        def warmup():
+            t0 = time.perf_counter()
+            try:
+                import_matlab_engine()
+                self.log(f"[预热] MATLAB Engine 模块已导入（{time.perf_counter() - t0:.1f}s）\n")
+            except Exception as e:
+                self.log(f"[预热] MATLAB Engine 导入失败: {e}\n")
+
+        threading.Thread(target=warmup, daemon=True).start()
+
+    def toggle_worker(self):
+        """勾选时预先启动一个常驻 worker（后台导入 Step 4 模块）；取消勾选时关闭空闲 worker。"""
+        if self.worker_var.get():
+            threading.Thread(target=self.worker_pool.warm, daemon=True).start()
+        else:
+            threading.Thread(target=self.worker_pool.close, daemon=True).start()
+            threading.Thread(target=self.matlab_worker.close, daemon=True).start()
+
+    # ========== 任务调度 ==========
+    def submit_job(self, step, runner):
+        """
+        把 runner(job) 加入任务队列（参数已在主线程中读取）；runner 返回是否成功，
+        结束后更新步骤状态（失败或被取消时记为未完成）。
+        """
+        try:
+            self.scheduler.set_max_concurrent(int(self.max_jobs_entry.get() or 1))
+        except ValueError:
+            pass
 
-    
-    def run_step1(self):
-        threading.Thread(target=self._run_step1).start()
+        def run(job):
+            ok = False
+            try:
+                ok = runner(job)
+                return ok
+            finally:
+                self.status.update(step, bool(ok) and not job.cancel_requested)
+
+        return self.scheduler.submit(step, run)
+
+    def on_job_change(self, job):
+        if job.status == QUEUED:
+            waiting = [other.step for other in job.depends + job.after if other.status != CANCELLED]
+            if waiting:
+                self.log(f"[任务] {job.step} 已加入队列，等待 {', '.join(waiting)} 结束\n")
+        elif job.status == CANCELLED:
+            self.log(f"[任务] {job.step} 已取消（{job.error}）\n")
+
+    def cancel_jobs(self):
+        if not self.scheduler.active():
+            self.log("[任务] 没有排队或运行中的任务\n")
+            return
+        self.scheduler.cancel_all()
 
-    def _run_step1(self):
+    def run_step1(self):
         args = {
             "site": self.param_vars["site"].get(),
             "start_date": self.param_vars["start_date"].get(),
             "end_date": self.param_vars["end_date"].get(),
             "output_path": self.param_vars["output_path"].get(),
+            "resume": self.resume_var.get(),
+            # 索引需要跨次运行保留：打包后 BASE_DIR 为临时目录，与日志一样放在 DATA_DIR
+            "index_path": os.path.join(DATA_DIR, "source_index.sqlite"),
+            "rebuild_index": self.rebuild_index_var.get(),
         }
-        self.run_script(STEP1_SCRIPT, args, "step1")
+        self.submit_job("step1", lambda job: self.run_script(STEP1_SCRIPT, args, "step1", job))
 
-    def run_step2(self):
-        threading.Thread(target=self._run_step2).start()
-
-    def _run_step2(self):
+    def _step2_workers(self):
+        """读取 Step 2 并行进程数；不是整数时弹出错误提示并返回 None。"""
+        value = self.param_vars["step2_workers"].get().strip()
+        try:
+            return int(value or 0)
+        except ValueError:
+            messagebox.showerror("参数错误", f"并行进程数必须为整数（0 = 全部 CPU 核）：{value}")
+            return None
+
+    def _parse_input_folders(self):
+        """Step 2 输入路径：JSON 列表 / 字符串，或以 ";" 分隔的多个路径（Step 2 与流水线共用）。"""
+        input_val = self.param_vars["input_folder"].get().strip()
+        try:
+            input_dirs = json.loads(input_val.replace("'", '"'))
+            if isinstance(input_dirs, str):
+                input_dirs = [input_dirs]
+            elif not isinstance(input_dirs, list):
+                raise ValueError("输入路径格式无效")
+        except Exception:
+            if ";" in input_val:
+                input_dirs = [p.strip() for p in input_val.split(";") if p.strip()]
+            else:
+                input_dirs = [input_val]
+        return input_dirs
 
-        def safe_insert_to_output(line):
-            self.log(line)
+    def run_step2(self):
+        input_dirs = self._parse_input_folders()
+        output_dir = self.param_vars["output_folder"].get().strip()
 
-        def monitor_step2_log_file(log_path, interval=0.1):
-            last_pos = 0
+        for p in input_dirs:
+            if not os.path.exists(p):
+                messagebox.showerror("路径错误", f"输入路径不存在：{p}")
+                return
+        if not output_dir:
+            messagebox.showerror("参数错误", "输出路径不能为空！")
+            return
+
+        backend = self.param_vars["step2_backend"].get()
+        if backend not in STEP2_BACKENDS:
+            messagebox.showerror("参数错误", f"预处理后端必须为 {' / '.join(STEP2_BACKENDS)} 之一：{backend}")
+            return
+        if backend == "python":
+            workers = self._step2_workers()
+            if workers is None:
+                return
+            args = {
+                "input_folders": input_dirs,
+                "output_folder": output_dir,
+                "workers": workers,
+                "resume": self.resume_var.get(),
+            }
+            self.submit_job("step2", lambda job: self.run_script(STEP2_PY_SCRIPT, args, "step2", job))
+            return
+        if not MATLAB_AVAILABLE:
+            messagebox.showerror("参数错误", "未安装 MATLAB Engine，请将预处理后端设为 python")
+            return
+        resume = self.resume_var.get()
+        self.submit_job("step2", lambda job: self._run_step2_matlab(job, input_dirs, output_dir, resume))
+
+    def _run_step2_matlab(self, job, input_dirs, output_dir, resume=True):
+
+        def monitor_step2_log_file(log_path, interval=0.2):
+            # 持续打开同一个文件句柄逐行读取（类似 tail -f）；文件被截断时从头读取
             try:
-                while not self.stop_log_monitor:
-                    if os.path.exists(log_path):
-                        with open(log_path, "r", encoding="utf-8") as f:
-                            f.seek(last_pos)
-                            new_lines = f.readlines()
-                            if new_lines:
-                                for line in new_lines:
-                                    self.app.after(0, safe_insert_to_output, line)
-                                last_pos = f.tell()
+                while not os.path.exists(log_path):
+                    if self.stop_log_monitor:
+                        return
                     time.sleep(interval)
+                with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+                    partial = ""
+                    while True:
+                        line = f.readline()
+                        if line:
+                            partial += line
+                            if partial.endswith("\n"):
+                                self.log(partial)
+                                partial = ""
+                            continue
+                        if self.stop_log_monitor:
+                            break
+                        if os.path.getsize(log_path) < f.tell():
+                            f.seek(0)
+                        time.sleep(interval)
+                    if partial:
+                        self.log(partial)
             except Exception as e:
-                self.app.after(0, safe_insert_to_output, f"❌ 日志读取失败: {e}\n")
+                self.log(f"❌ 日志读取失败: {e}\n")
 
+        eng = None
         try:
             self.log(">>> 正在执行 step2（使用 MATLAB 引擎）...\n")
-
-            input_val = self.param_vars["input_folder"].get().strip()
-            try:
-                input_dirs = json.loads(input_val.replace("'", '"'))
-                if isinstance(input_dirs, str):
-                    input_dirs = [input_dirs]
-                elif not isinstance(input_dirs, list):
-                    raise ValueError("输入路径格式无效")
-            except Exception:
-                if ";" in input_val:
-                    input_dirs = [p.strip() for p in input_val.split(";") if p.strip()]
-                else:
-                    input_dirs = [input_val]
-
-            output_dir = self.param_vars["output_folder"].get().strip()
-
-            for p in input_dirs:
-                if not os.path.exists(p):
-                    messagebox.showerror("路径错误", f"输入路径不存在：{p}")
-                    return
-            if not output_dir:
-                messagebox.showerror("参数错误", "输出路径不能为空！")
-                return
-
+            self.post_event(RESET_EVENT)
+            # MATLAB 函数读写同一个断点账本（resume=False 时在这里清空），这里只统计已完成 / 待处理数
+            ledger = CheckpointLedger(ledger_path(output_dir, "step2"), resume=resume)
+            vhdr_paths = [os.path.join(d, f) for d in input_dirs for f in sorted(os.listdir(d))
+                          if f.lower().endswith(".vhdr")]
+            done, pending = ledger.split((os.path.basename(p), os.path.getmtime(p), None) for p in vhdr_paths)
+            self.post_event({"event": "checkpoint", "stage": "step2", "label": "",
+                             "done": len(done), "remaining": len(pending)})
             log_path = os.path.join(output_dir, "step2_log.txt")
             if os.path.exists(log_path):
                 open(log_path, "w", encoding="utf-8").close()  # 只清空已有日志
 
-            # 启动 MATLAB
-            eng = matlab.engine.start_matlab()
+            def start_monitor():
+                # 开启日志监听线程
+                self.stop_log_monitor = False
+                self.log_monitor_thread = threading.Thread(
+                    target=monitor_step2_log_file,
+                    args=(log_path,),
+                    daemon=True
+                )
+                self.log_monitor_thread.start()
+
+            if self.worker_var.get():
+                # 常驻 worker 中的 MATLAB 引擎：第一次使用时启动，之后复用；取消时中止调用
+                start_monitor()
+                returncode = self.matlab_worker.run_matlab_step2(input_dirs, output_dir, self.log, job)
+                if returncode != 0:
+                    raise RuntimeError(f"MATLAB worker 退出码 {returncode}")
+            else:
+                # 启动 MATLAB
+                eng = import_matlab_engine().start_matlab()
+                if job.cancel_requested:
+                    return False
+                start_monitor()
+
+                # 后台执行 MATLAB 函数，取消任务时中止调用并退出引擎
+                future = eng.step2_preprocess_multiple(input_dirs, output_dir, nargout=0, background=True)
 
-            # 开启日志监听线程
-            self.stop_log_monitor = False
-            self.log_monitor_thread = threading.Thread(
-                target=monitor_step2_log_file,
-                args=(log_path,),
-                daemon=True
-            )
-            self.log_monitor_thread.start()
+                def cancel_matlab():
+                    try:
+                        future.cancel()
+                    finally:
+                        eng.quit()
 
-            # 执行 MATLAB 函数
-            eng.step2_preprocess_multiple(input_dirs, output_dir, nargout=0)
+                job.set_cancel_hook(cancel_matlab)
+                future.result()
 
             self.log("\n✅ step2 成功完成\n")
-            self.update_status("step2", True)
+            return True
 
         except Exception as e:
-            self.log(f"❌ step2 执行出错: {e}\n")
-            self.update_status("step2", False)
+            if job.cancel_requested:
+                self.log("step2 ⏹ 已取消\n")
+            else:
+                self.log(f"❌ step2 执行出错: {e}\n")
+            return False
 
         finally:
             # 通知线程退出
@@ -232,85 +480,196 @@ class EEGGuiApp:
 
 
     def run_step3(self):
-        threading.Thread(target=self._run_step3).start()
-
-    def _run_step3(self):
         args = {
             "file_path": self.param_vars["file_path"].get(),
             "source_folder": self.param_vars["source_folder"].get(),
             "target_folder_month": self.param_vars["target_folder_month"].get(),
-            "age_range_list": [s.strip() for s in self.param_vars["age_range_list"].get().split(",") if s.strip()]
+            "age_range_list": [s.strip() for s in self.param_vars["age_range_list"].get().split(",") if s.strip()],
+            "resume": self.resume_var.get(),
         }
-        self.run_script(STEP3_SCRIPT, args, "step3")
+        self.submit_job("step3", lambda job: self.run_script(STEP3_SCRIPT, args, "step3", job))
 
     def run_step4(self):
-        threading.Thread(target=self._run_step4).start()
-
-    def _run_step4(self):
         args = {
             "base_data_dir": self.param_vars["base_data_dir"].get(),
             "base_output_dir": self.param_vars["base_output_dir"].get(),
-            "age_range_list": [s.strip() for s in self.param_vars["age_range_list"].get().split(",") if s.strip()]
+            "age_range_list": [s.strip() for s in self.param_vars["age_range_list"].get().split(",") if s.strip()],
+            "checkpoint": self.psd_checkpoint_var.get(),
+        }
+        self.submit_job("step4", lambda job: self.run_script(STEP4_SCRIPT, args, "step4", job))
+
+
+    def run_pipeline(self):
+        # Step 2（Python/MNE 后端）→ Step 3 → Step 4 流水线：参数取自三个标签页
+        workers = self._step2_workers()
+        if workers is None:
+            return
+        input_dirs = self._parse_input_folders()
+        args = {
+            "input_folders": input_dirs,
+            "output_folder": self.param_vars["output_folder"].get().strip(),
+            "workers": workers,
+            "file_path": self.param_vars["file_path"].get(),
+            "target_folder_month": self.param_vars["target_folder_month"].get(),
+            "base_output_dir": self.param_vars["base_output_dir"].get(),
+            "age_range_list": [s.strip() for s in self.param_vars["age_range_list"].get().split(",") if s.strip()],
+            "resume": self.resume_var.get(),
+            "checkpoint": self.psd_checkpoint_var.get(),
         }
-        self.run_script(STEP4_SCRIPT, args, "step4")
-
-
-    def run_script(self, script_name, args_dict, step):
-        self.app.after(0, self.log, f">>> 正在执行 {step}...\n")
-
-        def run():
-            process = subprocess.Popen(
-                [sys.executable, script_name, json.dumps(args_dict)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                encoding="utf-8",
-                errors="replace"
-            )
-            for line in process.stdout:
-                self.app.after(0, self.log, line)
-            process.wait()
-            if process.returncode == 0:
-                self.app.after(0, self.log, f"{step} ✅ 成功完成\n")
-                self.update_status(step, True)
+        self.submit_job("pipeline", lambda job: self.run_script(PIPELINE_SCRIPT, args, "pipeline", job))
+
+    def run_script(self, script_name, args_dict, step, job):
+        """在任务线程中运行步骤脚本（子进程），返回是否成功；取消任务时终止整个子进程树。"""
+        self.log(f">>> 正在执行 {step}...\n")
+        self.post_event(RESET_EVENT)
+
+        def on_line(line):
+            event = parse_event(line)
+            if event is not None:
+                self.post_event(event)
             else:
-                self.app.after(0, self.log, f"{step} ❌ 失败，退出码: {process.returncode}\n")
-                self.update_status(step, False)
+                self.log(line)
+
+        if self.worker_var.get():
+            worker = self.worker_pool.acquire()
+            try:
+                returncode = worker.run_script(script_name, args_dict, on_line, job)
+            finally:
+                self.worker_pool.release(worker)
+        else:
+            env = dict(os.environ, **{PROGRESS_ENV: "1"})
+            returncode = run_subprocess(job, [sys.executable, script_name, json.dumps(args_dict)], on_line, env=env)
+        if job.cancel_requested:
+            self.log(f"{step} ⏹ 已取消\n")
+            return False
+        if returncode == 0:
+            self.log(f"{step} ✅ 成功完成\n")
+            return True
+        self.log(f"{step} ❌ 失败，退出码: {returncode}\n")
+        return False
 
-        threading.Thread(target=run).start()
 
 
+    def reset_progress(self):
+        self.progress_bar.set(0)
+        self.progress_label.configure(text="")
+        self.stage_label.configure(text="")
+        self.checkpoint_label.configure(text="")
+        self.checkpoint_counts = {}
+
+    def on_progress_event(self, event):
+        """把子进程的进度事件显示为进度条、速率 / 剩余时间和阶段用时。"""
+        kind = event.get("event")
+        name = f"{event.get('stage', '')} {event.get('label', '')}".strip()
+        if kind == "progress":
+            done, total = event.get("done", 0), event.get("total", 0)
+            self.progress_bar.set(done / total if total else 0)
+            text = f"{name}: {done}/{total}"
+            if event.get("rate"):
+                text += f"，{event['rate']:.2f} 项/秒"
+            if event.get("eta") is not None:
+                text += f"，预计剩余 {_format_seconds(event['eta'])}"
+            self.progress_label.configure(text=text)
+        elif kind == "stage_end":
+            self.progress_bar.set(1)
+            text = f"{name}: 完成 {event.get('done', 0)}/{event.get('total', 0)}，用时 {_format_seconds(event.get('seconds', 0))}"
+            self.progress_label.configure(text=text)
+            if event.get("slowest"):
+                slowest = "，".join(f"{item} {seconds:.1f}s" for item, seconds in event["slowest"])
+                self.log(f"[{name}] 最慢: {slowest}\n")
+        elif kind == "stages":
+            times = event.get("times", {})
+            total = sum(times.values()) or 1.0
+            breakdown = " | ".join(f"{stage} {seconds:.1f}s ({seconds / total:.0%})" for stage, seconds in times.items())
+            self.stage_label.configure(text=f"{name} 阶段用时: {breakdown}")
+        elif kind == "checkpoint":
+            self.checkpoint_counts[name] = (event.get("done", 0), event.get("remaining", 0))
+            text = "；".join(f"{key}: {done} 已完成 / {remaining} 待处理"
+                            for key, (done, remaining) in self.checkpoint_counts.items())
+            self.checkpoint_label.configure(text=f"断点续跑 {text}")
 
     def log(self, message):
-        self.log_box.configure(state="normal")
-        self.log_box.insert("end", message)
-        self.log_box.see("end")
-        self.log_box.configure(state="disabled")
+        """线程安全：消息进入队列，由 _drain_log_queue 在主线程批量显示。"""
+        self.log_queue.put(message)
+
+    def post_event(self, event):
+        """线程安全：进度事件进入队列，由 _drain_log_queue 在主线程处理。"""
+        self.event_queue.put(event)
+
+    def _apply_progress_events(self):
+        """按顺序处理队列中的进度事件；同一阶段的多个 progress 事件只显示最新的一个。"""
+        events = []
+        try:
+            while len(events) < LOG_BATCH_LIMIT:
+                events.append(self.event_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        latest = {}
+        for i, event in enumerate(events):
+            if event.get("event") == "progress":
+                latest[(event.get("stage"), event.get("label"))] = i
+        for i, event in enumerate(events):
+            kind = event.get("event")
+            if kind == "progress" and latest[(event.get("stage"), event.get("label"))] != i:
+                continue
+            if kind == RESET_EVENT["event"]:
+                self.reset_progress()
+            else:
+                self.on_progress_event(event)
+
+    def _drain_log_queue(self):
+        # 先处理进度事件：事件产生的日志（如最慢项）在同一次刷新中显示
+        self._apply_progress_events()
+        messages = []
+        try:
+            while len(messages) < LOG_BATCH_LIMIT:
+                messages.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if messages:
+            text = "".join(messages)
+            self.log_file.write(text)
+            self.log_file.flush()
+            # 超出保留行数的部分不必插入日志框
+            lines = text.splitlines(keepends=True)
+            if len(lines) > LOG_MAX_LINES:
+                text = "".join(lines[-LOG_MAX_LINES:])
+
+            self.log_box.configure(state="normal")
+            self.log_box.insert("end", text)
+            n_lines = int(self.log_box.index("end-1c").split(".")[0])
+            if n_lines > LOG_MAX_LINES:
+                self.log_box.delete("1.0", f"{n_lines - LOG_MAX_LINES + 1}.0")
+            self.log_box.see("end")
+            self.log_box.configure(state="disabled")
+
+        self.app.after(LOG_TICK_MS, self._drain_log_queue)
 
     def init_status(self):
-        if not os.path.exists(STATUS_PATH):
-            with open(STATUS_PATH, "w") as f:
-                json.dump({"step1": False, "step2": False, "step3": False, "step4": False}, f)
+        self.status.ensure()
 
     def reset_status(self):
-        with open(STATUS_PATH, "w") as f:
-            json.dump({"step1": False, "step2": False, "step3": False, "step4": False}, f)
+        self.status.reset()
         self.log("\n>>> 已刷新步骤状态为未完成\n")
 
     def read_status(self, step):
-        if os.path.exists(STATUS_PATH):
-            with open(STATUS_PATH, "r") as f:
-                return json.load(f).get(step, False)
-        return False
+        return self.status.read(step)
 
     def update_status(self, step, status):
-        with open(STATUS_PATH, "r") as f:
-            status_dict = json.load(f)
-        status_dict[step] = status
-        with open(STATUS_PATH, "w") as f:
-            json.dump(status_dict, f)
+        self.status.update(step, status)
     
     
 
+def _format_seconds(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
 if __name__ == "__main__":
     EEGGuiApp()
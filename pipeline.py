@@ -0,0 +1,264 @@
+"""
+pipeline.py
+
+功能：
+- Step 2 → Step 3 → Step 4 流水线执行，各步骤之间不再整体等待
+- 所有任务共享一个进程池：
+    每个 .vhdr 预处理（Python/MNE 后端）完成后立即做年龄匹配、放置到年龄段，
+    并把该被试的 PSD / topomap 数值计算提交到同一进程池
+- 年龄段的成员在开始时即可由 .vhdr 文件名中的被试 ID 与年龄表确定；
+  某个年龄段的被试全部完成后立即在后台线程中计算该年龄段的群体统计，拓扑图渲染提交到同一进程池
+  （见 age_parameters.RangeSummarizer），调度循环不等待汇总，其他年龄段继续处理
+- Step 2 断点账本（与单独运行 Step 2 共用，见 checkpoint.py）中复核通过的 _processed.set 直接复用；
+  没有记录但比 .vhdr 新的 _processed.set 先在进程池中完整读取一次，读取成功才接纳并记入账本，
+  否则重新预处理（中断的运行可能留下写了一半的文件）
+
+总耗时接近最慢的一个阶段，而不是各阶段耗时之和。
+"""
+
+import os
+import sys
+import json
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from age_parameters import process_subject, subject_id_of, RangeSummarizer
+from age_index import load_age_index, AgeRanges
+from staging import STAGE_MODES, MANIFEST_FILE, stage_file, write_manifest
+from step2_preprocess_mne import preprocess_file, processed_outputs, check_export, require_icalabel
+from checkpoint import CheckpointLedger, ledger_path, report
+from psd_cache import psd_cache_from_args
+from process_pool import init_worker, resolve_workers
+
+
+def _processed_path(vhdr_path, preprocessed_folder):
+    name = os.path.splitext(os.path.basename(vhdr_path))[0]
+    return os.path.join(preprocessed_folder, f"{name}_processed.set")
+
+
+def _is_fresh(processed, vhdr_path):
+    return os.path.exists(processed) and os.path.getmtime(processed) >= os.path.getmtime(vhdr_path)
+
+
+def run_pipeline(input_folders, preprocessed_folder, file_path, target_folder_month, base_output_dir,
+                 age_range_list, workers=0, blas_threads=1, stage_mode="manifest", psd_cache=None,
+                 render=True, render_workers=1, streaming=False, stream_chunk_seconds=30.0,
+                 excel=True, table_format="parquet", psd_dtype="float64", psd_mmap_dir=None, resume=True):
+    """
+    参数：
+    input_folders : list of str
+        Step 2 输入文件夹（.vhdr）。
+    preprocessed_folder : str
+        Step 2 输出文件夹（_processed.set 与 interp_chan/）。
+    file_path : str
+        Step 3 年龄表（Excel）。
+    target_folder_month : str
+        Step 3 年龄段目标文件夹（stage_mode='manifest' 时只写出 manifest.json）。
+    base_output_dir : str
+        Step 4 输出目录。
+    age_range_list : list of str
+        年龄段列表。
+    workers : int
+        进程数；<= 0 表示使用全部 CPU 核（默认）。
+    resume : bool
+        True（默认）时复用断点账本中已完成的预处理结果（没有记录的已有结果完整读取成功后才接纳）；
+        False 时全部重新预处理。
+    其余参数与 step4_all_age.run_step4_batch 相同。
+    """
+    require_icalabel()
+    os.makedirs(os.path.join(preprocessed_folder, "interp_chan"), exist_ok=True)
+    os.makedirs(target_folder_month, exist_ok=True)
+    manifest_path = os.path.join(target_folder_month, MANIFEST_FILE)
+    if stage_mode != "manifest" and os.path.exists(manifest_path):
+        os.remove(manifest_path)  # 旧的 manifest 会被 Step 4 优先使用
+
+    vhdr_list = []
+    for input_folder in input_folders:
+        vhdr_list += [os.path.join(input_folder, f) for f in sorted(os.listdir(input_folder))
+                      if f.lower().endswith(".vhdr")]
+
+    # === 年龄段成员（预处理之前即可确定）===
+    age_index, _ = load_age_index(file_path, cache_dir=target_folder_month)
+    age_ranges = AgeRanges(age_range_list)
+    ranges = {age_range: {"pending": 0, "results": [], "failed": False} for age_range in age_range_list}
+    vhdr_range = {}
+    unmatched = []
+    for vhdr_path in vhdr_list:
+        sid = subject_id_of(vhdr_path)
+        age_range = age_ranges.find(age_index.get(sid))
+        if age_range is None:
+            unmatched.append(sid)
+            continue
+        vhdr_range[vhdr_path] = age_range
+        ranges[age_range]["pending"] += 1
+    ledger = CheckpointLedger(ledger_path(preprocessed_folder, "step2"), resume=resume)
+    reusable = set()
+    if resume:
+        reusable = {vhdr_path for vhdr_path in vhdr_list
+                    if ledger.verify(os.path.basename(vhdr_path), os.path.getmtime(vhdr_path))}
+    report("step2", len(reusable), len(vhdr_list))
+
+    print(f"共 {len(vhdr_list)} 个文件，" +
+          "，".join(f"{r} {v['pending']} 个" for r, v in ranges.items()) +
+          f"，未匹配年龄段 {len(unmatched)} 个")
+
+    range_files = defaultdict(list)
+    completed, failed = [], []
+    start_time = time.time()
+    summarizer = None  # 进程池创建后赋值；汇总与渲染在后台线程 / 共享进程池中进行，不阻塞调度循环
+
+    def finish_range(age_range):
+        state = ranges[age_range]
+        if state["failed"]:
+            return
+        output_dir = os.path.join(base_output_dir, age_range)
+        os.makedirs(output_dir, exist_ok=True)
+        results = sorted(state["results"], key=lambda r: r[0])
+        state["results"] = None  # 只保留排序后的列表，汇总时逐个被试释放
+        print(f"\n正在处理年龄段: {age_range}（{len(results)} 个被试，用时 {time.time() - start_time:.1f}s）")
+        if not results:
+            print("No .set files found.")
+            completed.append(age_range)
+            return
+        summarizer.submit(age_range, output_dir, results)
+
+    def settle(age_range):
+        state = ranges[age_range]
+        state["pending"] -= 1
+        if state["pending"] == 0:
+            finish_range(age_range)
+
+    # 没有任何被试的年龄段
+    for age_range, state in ranges.items():
+        if state["pending"] == 0:
+            finish_range(age_range)
+
+    n_workers = max(1, resolve_workers(workers))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(blas_threads,)) as pool:
+        summarizer = RangeSummarizer(pool, render=render, render_workers=render_workers, psd_cache=psd_cache,
+                                     blas_threads=blas_threads, excel=excel, table_format=table_format,
+                                     psd_dtype=psd_dtype, psd_mmap_dir=psd_mmap_dir)
+        running = {}
+
+        def submit_psd(vhdr_path, set_path):
+            age_range = vhdr_range[vhdr_path]
+            if stage_mode == "manifest":
+                range_files[age_range].append(os.path.basename(set_path))
+            else:
+                range_dir = os.path.join(target_folder_month, age_range)
+                os.makedirs(range_dir, exist_ok=True)
+                for src in (set_path, os.path.splitext(set_path)[0] + ".fdt"):
+                    if os.path.exists(src):
+                        stage_file(src, os.path.join(range_dir, os.path.basename(src)), stage_mode)
+                set_path = os.path.join(range_dir, os.path.basename(set_path))
+            future = pool.submit(process_subject, "", set_path, psd_cache, streaming, stream_chunk_seconds)
+            running[future] = ("psd", vhdr_path)
+
+        def submit_preprocess(vhdr_path):
+            future = pool.submit(preprocess_file, vhdr_path, preprocessed_folder)
+            running[future] = ("preprocess", vhdr_path)
+
+        # 预处理任务（断点账本中已完成时直接进入后续阶段）；没有年龄段的被试同样预处理
+        for vhdr_path in vhdr_list:
+            processed = _processed_path(vhdr_path, preprocessed_folder)
+            if vhdr_path in reusable:
+                print(f"复用已预处理文件: {os.path.basename(processed)}")
+                if vhdr_path in vhdr_range:
+                    submit_psd(vhdr_path, processed)
+            elif resume and _is_fresh(processed, vhdr_path):
+                running[pool.submit(check_export, processed)] = ("adopt", vhdr_path)
+            else:
+                submit_preprocess(vhdr_path)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, vhdr_path = running.pop(future)
+                age_range = vhdr_range.get(vhdr_path)
+
+                if stage == "adopt":
+                    processed = _processed_path(vhdr_path, preprocessed_folder)
+                    if not future.result():
+                        print(f"已有预处理文件不完整，重新预处理: {os.path.basename(processed)}")
+                        submit_preprocess(vhdr_path)
+                        continue
+                    print(f"复用已预处理文件: {os.path.basename(processed)}")
+                    ledger.mark_done(os.path.basename(vhdr_path), processed_outputs(vhdr_path, preprocessed_folder),
+                                     subject=subject_id_of(vhdr_path))
+                    if age_range is not None:
+                        submit_psd(vhdr_path, processed)
+                    continue
+
+                if stage == "preprocess":
+                    filename, messages, ok = future.result()
+                    print(f" Processing: {filename}\n{messages}\n {'processed successfully' if ok else 'failed'}.")
+                    if ok:
+                        ledger.mark_done(filename, processed_outputs(vhdr_path, preprocessed_folder),
+                                         subject=subject_id_of(vhdr_path))
+                    if age_range is None:
+                        continue
+                    if ok:
+                        print(f"{os.path.basename(vhdr_path)} -> {age_range}")
+                        submit_psd(vhdr_path, _processed_path(vhdr_path, preprocessed_folder))
+                    else:
+                        settle(age_range)
+                    continue
+
+                state = ranges[age_range]
+                try:
+                    result = future.result()
+                    if not state["failed"]:
+                        state["results"].append(result)
+                except Exception as e:
+                    if not state["failed"]:
+                        state["failed"] = True
+                        state["results"] = None
+                        failed.append(age_range)
+                        print(f"出错跳过: {age_range}，错误信息: {e}")
+                settle(age_range)
+
+        # 调度循环结束后等待仍在汇总 / 渲染的年龄段（渲染任务在共享进程池中，关闭进程池之前等待）
+        summarized, summary_failed = summarizer.wait()
+        completed += summarized
+        failed += summary_failed
+
+    if stage_mode == "manifest":
+        write_manifest(target_folder_month, {r: range_files.get(r, []) for r in age_range_list}, preprocessed_folder)
+
+    print(f"\n=== 流水线完成（{time.time() - start_time:.1f}s）===\n"
+          f"成功年龄段: {', '.join(completed) if completed else '无'}\n"
+          f"失败年龄段: {', '.join(failed) if failed else '无'}")
+    return completed, failed
+
+
+if __name__ == "__main__":
+    # 支持从 GUI 传入 json 字符串参数
+    args = json.loads(sys.argv[1])
+    input_folders = args["input_folders"]
+    if isinstance(input_folders, str):
+        input_folders = [input_folders]
+    stage_mode = args.get("stage_mode", "manifest")
+    if stage_mode not in STAGE_MODES:
+        raise ValueError(f"stage_mode 必须为 {STAGE_MODES} 之一: {stage_mode}")
+
+    psd_cache = psd_cache_from_args(args)
+
+    _, failed = run_pipeline(
+        input_folders, args["output_folder"], args["file_path"], args["target_folder_month"],
+        args["base_output_dir"], args["age_range_list"],
+        workers=args.get("workers", 0),
+        blas_threads=args.get("blas_threads", 1),
+        stage_mode=stage_mode,
+        psd_cache=psd_cache,
+        render=args.get("render", True),
+        render_workers=args.get("render_workers", 1),
+        streaming=args.get("streaming_psd", False),
+        stream_chunk_seconds=args.get("stream_chunk_seconds", 30.0),
+        excel=args.get("excel", True),
+        table_format=args.get("table_format", "parquet"),
+        psd_dtype=args.get("psd_dtype", "float64"),
+        psd_mmap_dir=args.get("psd_mmap_dir"),
+        resume=args.get("resume", True)
+    )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,31 @@
+"""
+process_pool.py
+
+功能：
+- 各步骤进程池共用的辅助函数（Step 2 Python 后端、Step 4、流水线、监视进程）：
+    init_worker      进程池初始化，限制每个 worker 的 BLAS/OpenMP 线程数，避免核数超订
+    resolve_workers  进程数参数解析，<= 0 表示使用全部 CPU 核
+"""
+
+import os
+
+
+def init_worker(blas_threads=1):
+    """进程池初始化：限制每个 worker 的 BLAS/OpenMP 线程数，避免核数超订。"""
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(blas_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=blas_threads)
+    except ImportError:
+        pass
+
+
+def resolve_workers(workers):
+    """workers <= 0 表示使用全部 CPU 核。"""
+    if workers is None:
+        return 1
+    workers = int(workers)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
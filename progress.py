@@ -0,0 +1,112 @@
+"""
+progress.py
+
+功能：
+- 机器可读的进度事件：每个事件为 stdout 上的一行 PROGRESS_PREFIX + JSON，GUI 解析为进度条与阶段用时
+- 只有环境变量 EEG_PROGRESS=1 时（GUI 启动子进程时设置）才输出事件，命令行运行时日志保持不变
+- ProgressTracker：统计完成数、速率（项/秒）、剩余时间估计，以及最慢的若干项
+
+事件类型：
+    progress   {stage, label, done, total, rate, eta}
+    stage_end  {stage, label, done, total, seconds, rate, slowest: [[名称, 秒], ...]}
+    stages     {stage, label, times: {子阶段: 秒}}
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+
+PROGRESS_PREFIX = "@@progress "
+PROGRESS_ENV = "EEG_PROGRESS"
+
+
+def enabled():
+    return os.environ.get(PROGRESS_ENV) == "1"
+
+
+def emit(event, **fields):
+    """输出一个进度事件（未启用时不输出）。"""
+    if not enabled():
+        return
+    fields["event"] = event
+    sys.stdout.write(PROGRESS_PREFIX + json.dumps(fields, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def parse_event(line):
+    """GUI 端：若 line 是进度事件则返回事件 dict，否则返回 None。"""
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(PROGRESS_PREFIX):])
+    except ValueError:
+        return None
+
+
+def emit_stage_times(stage, times, label=""):
+    emit("stages", stage=stage, label=label, times={k: round(v, 3) for k, v in times.items()})
+
+
+class ProgressTracker:
+    """
+    统计一个阶段的进度并输出 progress / stage_end 事件。
+
+    参数：
+    stage : str
+        阶段名（如 "copy"、"step4"）。
+    total : int
+        总项数。
+    label : str
+        附加说明（如年龄段）。
+    n_slowest : int
+        记录最慢的项数。
+    min_interval : float
+        两次 progress 事件的最小间隔（秒）；最后一项总是输出。
+    """
+
+    def __init__(self, stage, total, label="", n_slowest=5, min_interval=0.5):
+        self.stage = stage
+        self.total = total
+        self.label = label
+        self.n_slowest = n_slowest
+        self.min_interval = min_interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self._last_emit = 0.0
+        self._slowest = []  # (秒, 名称) 小顶堆
+        emit("progress", stage=stage, label=label, done=0, total=total, rate=0.0, eta=None)
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, item=None, seconds=None):
+        """完成一项；item / seconds 给出时参与最慢项统计。"""
+        self.done += 1
+        if item is not None and seconds is not None and self.n_slowest > 0:
+            entry = (seconds, str(item))
+            if len(self._slowest) < self.n_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+
+        now = time.perf_counter()
+        if now - self._last_emit >= self.min_interval or self.done >= self.total:
+            self._last_emit = now
+            rate = self.rate()
+            eta = (self.total - self.done) / rate if rate > 0 else None
+            emit("progress", stage=self.stage, label=self.label, done=self.done, total=self.total,
+                 rate=round(rate, 3), eta=None if eta is None else round(eta, 1))
+
+    def slowest(self):
+        """最慢的项，按耗时从大到小：[(名称, 秒), ...]。"""
+        return [(name, seconds) for seconds, name in sorted(self._slowest, reverse=True)]
+
+    def finish(self):
+        seconds = time.perf_counter() - self.start
+        emit("stage_end", stage=self.stage, label=self.label, done=self.done, total=self.total,
+             seconds=round(seconds, 3), rate=round(self.rate(), 3),
+             slowest=[[name, round(s, 3)] for name, s in self.slowest()])
+        return seconds
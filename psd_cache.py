@@ -0,0 +1,178 @@
+"""
+psd_cache.py
+
+功能：
+- 被试 PSD 的磁盘缓存（Step 4 使用），避免每次运行都重新读取 raw 并计算 Welch
+- 缓存键 = .set/.fdt 文件指纹（大小+修改时间，或内容哈希）+ Welch 参数 + MNE 版本
+- 每个条目为一个 .npz 文件，保存 psds、freqs、ch_names 以及绘图所需的 info
+- 以条目文件的修改时间作为最近使用时间，超出容量上限时按 LRU 淘汰
+
+条目文件写入采用临时文件 + 原子重命名，多进程 worker 可以同时读写同一缓存目录。
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 1
+ENTRY_SUFFIX = ".npz"
+
+
+def _companion_files(set_path):
+    """返回 .set 以及同名 .fdt（若存在）的路径列表。"""
+    paths = [set_path]
+    fdt_path = os.path.splitext(set_path)[0] + ".fdt"
+    if os.path.exists(fdt_path):
+        paths.append(fdt_path)
+    return paths
+
+
+def _file_digest(path, chunk_size=4 * 1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PSDCache:
+    """
+    被试 PSD 磁盘缓存。
+
+    参数：
+    cache_dir : str
+        缓存目录。
+    max_bytes : int or None
+        缓存容量上限（字节），超出后按最近使用时间淘汰；None 表示不淘汰（用作 Step 4 断点时，
+        条目不能在处理中途被删除）。
+    hash_mode : str
+        'stat'：按绝对路径 + 文件大小 + 修改时间生成键（默认，开销极低）；
+        'content'：按文件内容 SHA1 生成键（文件被移动/复制后仍可命中）。
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, hash_mode="stat"):
+        if hash_mode not in ("stat", "content"):
+            raise ValueError(f"Invalid hash_mode: {hash_mode}")
+        self.cache_dir = cache_dir
+        self.max_bytes = None if max_bytes is None else int(max_bytes)
+        self.hash_mode = hash_mode
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, set_path, welch_params):
+        """根据数据文件指纹和 Welch 参数生成缓存键。"""
+        import mne
+
+        parts = {"version": CACHE_VERSION, "mne": mne.__version__, "welch": welch_params, "files": []}
+        for path in _companion_files(set_path):
+            if self.hash_mode == "content":
+                parts["files"].append([os.path.splitext(path)[1], _file_digest(path)])
+            else:
+                st = os.stat(path)
+                parts["files"].append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+        payload = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha1(payload).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def contains(self, key):
+        """是否已有 key 的缓存条目（只 stat，不读取内容）。"""
+        return os.path.exists(self._entry_path(key))
+
+    def load(self, key):
+        """命中时返回 dict(psds, freqs, ch_names, info)，否则返回 None。"""
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as data:
+                entry = {
+                    "psds": data["psds"],
+                    "freqs": data["freqs"],
+                    "ch_names": [str(ch) for ch in data["ch_names"]],
+                    "info": pickle.loads(data["info"].tobytes()),
+                }
+        except (OSError, KeyError, ValueError, pickle.UnpicklingError):
+            return None
+        # 刷新修改时间，作为 LRU 的最近使用时间
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def store(self, key, psds, freqs, ch_names, info):
+        """写入一个缓存条目（临时文件 + 原子重命名）。"""
+        info_bytes = np.frombuffer(pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, psds=psds, freqs=freqs, ch_names=np.array(ch_names), info=info_bytes)
+            os.replace(tmp_path, self._entry_path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        """按 LRU 淘汰条目直到总大小不超过 max_bytes，返回删除的条目数。"""
+        if self.max_bytes is None:
+            return 0
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(ENTRY_SUFFIX):
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def record(self, hit):
+        """
+        记录一次查询结果。
+
+        查询可能发生在子进程中，计数统一由主进程根据返回的命中标记累加。
+        """
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"PSD 缓存: 命中 {self.hits} / 未命中 {self.misses}（命中率 {rate:.1f}%）"
+
+
+def psd_cache_from_args(args):
+    """
+    由 Step 4 / 流水线的 JSON 参数创建 PSD 缓存。
+
+    psd_cache_dir 给出时为按 psd_cache_max_mb 淘汰的 LRU 缓存；未给出且 checkpoint 为 true 时
+    使用 base_output_dir 下的 Step 4 断点目录（不淘汰）；否则返回 None（不缓存）。
+    """
+    from checkpoint import psd_checkpoint_dir
+
+    hash_mode = args.get("psd_cache_hash", "stat")
+    if args.get("psd_cache_dir"):
+        return PSDCache(args["psd_cache_dir"],
+                        max_bytes=int(float(args.get("psd_cache_max_mb", 2048)) * 1024 ** 2),
+                        hash_mode=hash_mode)
+    if args.get("checkpoint", False):
+        return PSDCache(psd_checkpoint_dir(args["base_output_dir"]), max_bytes=None, hash_mode=hash_mode)
+    return None
@@ -0,0 +1,166 @@
+"""
+source_index.py
+
+功能：
+- Step 1 源数据共享盘的本地持久索引（SQLite），只记录静息态数据文件
+  （被试 ID、扩展名、站点、大小、修改时间）
+- 增量刷新：用 os.scandir 复用目录项自带的 stat 信息；目录修改时间未变化时
+  不再列出该目录下的文件，只继续检查已知子目录
+- 日期范围查询走 (site, mtime) 索引的范围扫描，不再遍历整个网络路径
+
+目录修改时间只在目录内文件增删 / 重命名时变化。原地覆盖写入的文件不会被增量刷新发现，
+此时可使用 rebuild 重新完整扫描。
+"""
+
+import os
+import sqlite3
+
+VALID_EXTENSIONS = (".vhdr", ".vmrk", ".eeg", ".set", ".fdt")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    subject_id TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_site_mtime ON files (site, mtime);
+CREATE INDEX IF NOT EXISTS idx_files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs (parent);
+"""
+
+
+def is_resting_file(file_name):
+    """与 Step 1 原有的筛选规则一致：含 resting、第 3-4 位为 01、扩展名有效。"""
+    file_lower = file_name.lower()
+    if "resting" not in file_lower:
+        return False
+    if len(file_name) < 4 or file_name[2:4] != "01":
+        return False
+    return file_lower.endswith(VALID_EXTENSIONS)
+
+
+class SourceIndex:
+    """
+    源数据文件索引。
+
+    参数：
+    db_path : str
+        SQLite 数据库文件路径。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def rebuild(self, site=None):
+        """清空索引（指定 site 时只清空该站点），下次刷新时完整扫描。"""
+        with self.conn:
+            if site is None:
+                self.conn.execute("DELETE FROM files")
+                self.conn.execute("DELETE FROM dirs")
+            else:
+                self.conn.execute("DELETE FROM files WHERE site = ?", (site,))
+                self.conn.execute("DELETE FROM dirs WHERE site = ?", (site,))
+
+    # ---------- 增量刷新 ----------
+    def refresh(self, site, root, recursive=True):
+        """
+        刷新一个站点的索引，返回 (扫描的目录数, 跳过的未变化目录数)。
+
+        recursive=False 时只索引 root 目录本身（对应 Step 1 的非子文件夹模式）。
+        """
+        known_dirs = {path: mtime_ns for path, mtime_ns in
+                      self.conn.execute("SELECT path, mtime_ns FROM dirs WHERE site = ?", (site,))}
+        seen_dirs = set()
+        scanned = skipped = 0
+
+        with self.conn:
+            stack = [(root, None)]
+            while stack:
+                dir_path, parent = stack.pop()
+                try:
+                    dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+                except OSError as e:
+                    print(f"[读取错误] {dir_path}: {e}")
+                    continue
+                seen_dirs.add(dir_path)
+
+                if known_dirs.get(dir_path) == dir_mtime_ns:
+                    # 目录内容未变化：沿用已索引的文件，只需继续检查子目录
+                    skipped += 1
+                    if recursive:
+                        for (child,) in self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (dir_path,)):
+                            stack.append((child, dir_path))
+                    continue
+
+                scanned += 1
+                rows, subdirs = self._scan_dir(site, dir_path, recursive)
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+                self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                                  (dir_path, site, parent, dir_mtime_ns))
+                for child in subdirs:
+                    stack.append((child, dir_path))
+
+            # 已不存在的目录：删除其目录记录与文件记录
+            stale = [path for path in known_dirs if path not in seen_dirs]
+            for path in stale:
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (path,))
+                self.conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+        return scanned, skipped
+
+    @staticmethod
+    def _scan_dir(site, dir_path, recursive):
+        rows, subdirs = [], []
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError as e:
+            print(f"[读取错误] {dir_path}: {e}")
+            return rows, subdirs
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if recursive:
+                        subdirs.append(entry.path)
+                    continue
+                if not is_resting_file(entry.name):
+                    continue
+                st = entry.stat()  # Windows 上直接复用目录项中的 stat，不额外访问网络
+                ext = os.path.splitext(entry.name)[-1].lower()
+                rows.append((entry.path, site, dir_path, entry.name.split("_")[0], ext,
+                             st.st_size, st.st_mtime))
+            except OSError as e:
+                print(f"[读取错误] {entry.name}: {e}")
+        return rows, subdirs
+
+    # ---------- 查询 ----------
+    def query(self, site, start_ts, end_ts):
+        """返回站点内修改时间位于 [start_ts, end_ts] 的 (mtime, path) 列表，按时间排序。"""
+        return self.conn.execute(
+            "SELECT mtime, path FROM files WHERE site = ? AND mtime BETWEEN ? AND ? ORDER BY mtime",
+            (site, start_ts, end_ts)).fetchall()
+
+    def count(self, site=None):
+        if site is None:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM files WHERE site = ?", (site,)).fetchone()[0]
@@ -0,0 +1,89 @@
+"""
+staging.py
+
+功能：
+- Step 3 按年龄段分组时的文件放置方式（stage_mode）：
+    copy      物理复制（原有行为）
+    hardlink  硬链接，不占额外磁盘空间；跨文件系统时自动回退为复制
+    symlink   符号链接；系统不允许创建时（如 Windows 无权限）自动回退为复制
+    manifest  不放置任何文件，只在目标目录写出 manifest.json（年龄段 -> .set 文件路径列表）
+- Step 4 读取 manifest.json，直接按其中的文件列表分析，无需年龄段文件夹
+"""
+
+import os
+import json
+import shutil
+import tempfile
+
+STAGE_MODES = ("copy", "hardlink", "symlink", "manifest")
+MANIFEST_FILE = "manifest.json"
+
+
+def stage_file(src, dst, mode="copy"):
+    """
+    把 src 放到 dst，返回实际使用的方式（'copy' / 'hardlink' / 'symlink'）。
+
+    dst 已存在时先删除，保证链接指向最新的源文件。
+    """
+    if mode not in ("copy", "hardlink", "symlink"):
+        raise ValueError(f"Invalid stage mode: {mode}")
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass  # 跨文件系统（EXDEV）或文件系统不支持硬链接
+    elif mode == "symlink":
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return "symlink"
+        except OSError:
+            pass
+    shutil.copy(src, dst)
+    return "copy"
+
+
+def write_manifest(target_folder, range_files, source_folder):
+    """
+    写出 target_folder/manifest.json（临时文件 + 原子重命名）。
+
+    range_files : dict
+        年龄段 -> .set 文件名列表（相对 source_folder）。
+    """
+    manifest = {
+        "source_folder": os.path.abspath(source_folder),
+        "ranges": {age_range: sorted(files) for age_range, files in range_files.items()},
+    }
+    path = os.path.join(target_folder, MANIFEST_FILE)
+    fd, tmp_path = tempfile.mkstemp(dir=target_folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_manifest(path):
+    """读取 manifest.json，返回 年龄段 -> .set 文件绝对路径列表。"""
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    source_folder = manifest["source_folder"]
+    return {age_range: [os.path.join(source_folder, name) for name in files]
+            for age_range, files in manifest["ranges"].items()}
+
+
+def find_manifest(base_data_dir, manifest=None):
+    """返回要使用的 manifest 路径：显式给出的路径，或 base_data_dir 下的 manifest.json（存在时），否则 None。"""
+    if manifest:
+        return manifest
+    if base_data_dir:
+        path = os.path.join(base_data_dir, MANIFEST_FILE)
+        if os.path.exists(path):
+            return path
+    return None
@@ -1,16 +1,31 @@
 import os
-import shutil
+import time
 from datetime import datetime
 import importlib.util
 from collections import defaultdict
 
 import sys, json
 
+from copy_engine import copy_files, format_throughput, COPY_FAILED
+from checkpoint import CheckpointLedger, ledger_path, report
+from source_index import SourceIndex
+from progress import ProgressTracker, emit_stage_times
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 args = json.loads(sys.argv[1])
 site = args["site"]
 start_date = args["start_date"]
 end_date = args["end_date"]
 output_path = args["output_path"]
+copy_workers = int(args.get("copy_workers", 8))
+copy_retries = int(args.get("copy_retries", 2))
+index_path = args.get("index_path") or os.path.join(BASE_DIR, "source_index.sqlite")
+rebuild_index = bool(args.get("rebuild_index", False))
+# 断点续跑：已完整复制（复核通过）的被试不再检查 / 复制；为 False 时清空断点记录
+resume = bool(args.get("resume", True))
+# 可选：覆盖下面 get_source_paths 中的站点路径，格式为 [[站点, 路径, 是否遍历子文件夹], ...]
+source_paths = args.get("source_paths")
 
 # 验证路径
 if not output_path or not os.path.isdir(os.path.dirname(output_path)):
@@ -23,7 +38,6 @@ if isinstance(start_date, str):
 if isinstance(end_date, str):
     end_date = datetime.strptime(end_date, "%Y-%m-%d")
 
-valid_extensions = (".vhdr", ".vmrk", ".eeg", ".set", ".fdt")
 required_exts = [".vhdr", ".vmrk", ".eeg"]
 resting_files = []
 copied_subject_ids = set()
@@ -31,6 +45,8 @@ subject_file_map = defaultdict(set)
 
 # === 获取路径集合（支持 ALL）===
 def get_source_paths():
+    if source_paths:
+        return [(s, p, bool(sub)) for s, p, sub in source_paths if site in (s, "ALL")]
     paths = []
     if site in ("A", "ALL"):
         paths.append(("A", r"path\to\data", False))
@@ -38,43 +54,77 @@ def get_source_paths():
         paths.append(("B", r"path\to\data", True))
     return paths
 
-# === 遍历所有路径 ===
-for curr_site, network_path, subfolder_mode in get_source_paths():
-    for root, dirs, files in os.walk(network_path) if subfolder_mode else [(network_path, [], os.listdir(network_path))]:
-        for file in files:
-            file_lower = file.lower()
-            if "resting" not in file_lower:
-                continue
-            if len(file) < 4 or file[2:4] != "01":
-                continue
-            if not file_lower.endswith(valid_extensions):
-                continue
-            full_path = os.path.join(root, file)
-            try:
-                timestamp = os.path.getmtime(full_path)
-                file_time = datetime.fromtimestamp(timestamp)
-                if start_date <= file_time <= end_date:
-                    resting_files.append((file_time, full_path))
-            except Exception as e:
-                print(f"[读取错误] {file}: {e}")
+# === 刷新源数据索引并按日期范围查询 ===
+# 索引只记录静息态文件；目录修改时间未变化的目录不再重新列出，日期筛选为索引范围查询
+crawl_seconds = query_seconds = 0.0
+site_paths = get_source_paths()
+crawl_tracker = ProgressTracker("crawl", len(site_paths))
+with SourceIndex(index_path) as index:
+    for curr_site, network_path, subfolder_mode in site_paths:
+        t0 = time.perf_counter()
+        if rebuild_index:
+            index.rebuild(curr_site)
+        scanned, skipped = index.refresh(curr_site, network_path, recursive=subfolder_mode)
+        t1 = time.perf_counter()
+        for timestamp, full_path in index.query(curr_site, start_date.timestamp(), end_date.timestamp()):
+            resting_files.append((datetime.fromtimestamp(timestamp), full_path))
+        t2 = time.perf_counter()
+        crawl_seconds += t1 - t0
+        query_seconds += t2 - t1
+        crawl_tracker.update(curr_site, t2 - t0)
+        print(f"[索引] 站点 {curr_site}: 扫描目录 {scanned} 个，未变化跳过 {skipped} 个，"
+              f"索引文件 {index.count(curr_site)} 个")
+crawl_tracker.finish()
+print(f"[索引] 刷新用时 {crawl_seconds:.2f}s，日期范围查询用时 {query_seconds:.3f}s")
 
 # === 排序并复制 ===
 resting_files.sort(key=lambda x: x[0])
 
+# === 被试级断点：按被试分组，跳过已完整复制的被试 ===
+subject_jobs = defaultdict(list)
+subject_mtime = defaultdict(float)
 for file_time, full_path in resting_files:
-    try:
-        filename = os.path.basename(full_path)
-        subject_id = filename.split("_")[0]
-        ext = os.path.splitext(filename)[-1].lower()
+    sid = os.path.basename(full_path).split("_")[0]
+    subject_jobs[sid].append((full_path, os.path.join(output_path, os.path.basename(full_path))))
+    subject_mtime[sid] = max(subject_mtime[sid], file_time.timestamp())
+ledger = CheckpointLedger(ledger_path(output_path, "step1"), resume=resume)
+done_subjects, pending_subjects = ledger.split(
+    (sid, subject_mtime[sid], [dst for _, dst in jobs]) for sid, jobs in subject_jobs.items())
+report("step1", len(done_subjects), len(subject_jobs))
+
+copy_jobs = [job for sid in pending_subjects for job in subject_jobs[sid]]
+subject_left = {sid: len(subject_jobs[sid]) for sid in pending_subjects}
+subject_failed = set()
 
-        copied_subject_ids.add(subject_id)
-        subject_file_map[subject_id].add(ext)
+def on_copy_result(src, dst, status):
+    # 被试的最后一个文件完成且没有失败时记录断点
+    sid = os.path.basename(src).split("_")[0]
+    if status == COPY_FAILED:
+        subject_failed.add(sid)
+    subject_left[sid] -= 1
+    if subject_left[sid] == 0 and sid not in subject_failed:
+        ledger.mark_done(sid, [d for _, d in subject_jobs[sid]], subject=sid)
+
+copy_tracker = ProgressTracker("copy", len(copy_jobs))
+copy_stats = copy_files(copy_jobs, workers=copy_workers, retries=copy_retries, progress=copy_tracker.update,
+                        on_result=on_copy_result)
+copy_stats["skipped"] += sum(len(subject_jobs[sid]) for sid in done_subjects)
+copy_tracker.finish()
+emit_stage_times("step1", {"crawl": crawl_seconds, "query": query_seconds, "copy": copy_stats["seconds"]})
+failed_paths = set()
+for src, error in copy_stats["failed"]:
+    failed_paths.add(src)
+    print(f"[复制失败] {os.path.basename(src)}: {error}")
+
+for file_time, full_path in resting_files:
+    if full_path in failed_paths:
+        continue
+    filename = os.path.basename(full_path)
+    subject_id = filename.split("_")[0]
+    ext = os.path.splitext(filename)[-1].lower()
 
-        target_path = os.path.join(output_path, filename)
-        shutil.copy2(full_path, target_path)
-        # print(f"[已复制] {filename} | 时间: {file_time}")
-    except Exception as e:
-        print(f"[复制失败] {filename}: {e}")
+    copied_subject_ids.add(subject_id)
+    subject_file_map[subject_id].add(ext)
 
 # === 完整性检查 ===
 missing_info = []
@@ -87,7 +137,8 @@ for sid in sorted(copied_subject_ids):
 # === 构造日志信息并打印（GUI 可捕获）===
 summary_log = (
     f"\n=== 复制完成 ===\n"
-    f"共复制文件数: {len(resting_files)}\n"
+    f"共复制文件数: {len(resting_files) - len(failed_paths)}\n"
+    f"{format_throughput(copy_stats)}\n"
     f"涉及被试数: {len(sorted(copied_subject_ids))}\n"
     # f"被试ID列表: {sorted(copied_subject_ids)}\n"
     f"【友情提示】请先确认【涉及被试数 * 3 = 复制文件数】，以免后续被试遗漏或预处理出错。")
@@ -0,0 +1,297 @@
+"""
+step2_preprocess_mne.py
+
+功能：
+- Step 2 的 Python / MNE 预处理后端（无需 MATLAB），与 step2_preprocess_multiple.m 的处理链对应：
+    1. 读取 .vhdr，按 standard_1005 设置电极位置
+    2. 45 Hz 低通、0.1 Hz 高通、49-51 Hz 陷波
+    3. 重采样至 500 Hz
+    4. 坏通道检测（平坦通道 + 两轮频谱 z 分数检测，对应 pop_rejchan 'spec' 'norm' [-3 3]）
+    5. 球面样条插值坏通道
+    6. ICA（扩展 infomax，对应 runica extended），按 ICLabel（mne-icalabel，必需依赖）
+       剔除肌电 / 眼动 / 心电 / 工频 / 通道噪声概率 >= 0.9 的成分
+    7. 平均参考
+    8. 保存 {文件名}_processed.set，插值通道记录保存为 interp_chan/{被试ID}_interp_chan.mat
+- 文件在进程池中并行处理，日志同时打印并追加到 output_folder/step2_log.txt
+- 断点续跑：每个文件成功后记入 output_folder/.checkpoints/step2.jsonl（与 MATLAB 后端共用），
+  重新运行时跳过输出文件复核通过的文件
+
+与 MATLAB 版本的差异：clean_rawdata 的 ASR 爆发伪迹修复 / 时间窗剔除和基于 RANSAC 的通道相关性准则没有对应实现；
+坏通道检测使用上面第 4 步的规则。
+"""
+
+import os
+import sys
+import json
+import time
+import io
+import contextlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import mne
+from scipy.io import savemat
+
+from age_parameters import subject_id_of
+from process_pool import init_worker, resolve_workers
+from checkpoint import CheckpointLedger, ledger_path, report
+
+mne.set_log_level("ERROR")
+
+# 与 step2_preprocess_multiple.m 相同的参数
+HIGHCUT = 45
+LOWCUT = 0.1
+NOTCH = (49, 51)
+RESAMPLE_SFREQ = 500
+FLATLINE_SECONDS = 5
+REJCHAN_THRESHOLD = 3
+REJCHAN_FREQRANGE = (0.5, 45)
+ICLABEL_REJECT = {"muscle artifact", "eye blink", "heart beat", "line noise", "channel noise"}
+ICLABEL_THRESHOLD = 0.9
+
+
+@contextlib.contextmanager
+def _ignore_mne_warnings():
+    """
+    只在 MNE 读取 / ICA / 导出期间忽略 RuntimeWarning（标记文件、ICA 迭代、导出格式等提示）。
+
+    不使用模块级 filterwarnings：流水线与常驻 worker 进程也会导入本模块。
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        yield
+
+
+def detect_flat_channels(raw, max_flat_seconds=FLATLINE_SECONDS):
+    """信号保持不变超过 max_flat_seconds 秒的通道（对应 clean_rawdata 的 FlatlineCriterion）。"""
+    data = raw.get_data(picks="eeg")
+    names = [raw.ch_names[i] for i in mne.pick_types(raw.info, eeg=True)]
+    max_samples = int(max_flat_seconds * raw.info["sfreq"])
+    tol = 20 * np.finfo(np.float32).eps * np.max(np.abs(data), initial=0)
+    flat = []
+    for name, x in zip(names, data):
+        still = np.abs(np.diff(x)) <= tol
+        # 最长连续不变段
+        edges = np.diff(np.concatenate([[0], still.astype(np.int8), [0]]))
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        if runs.size and runs.max() > max_samples:
+            flat.append(name)
+    return flat
+
+
+def detect_spectral_bad_channels(raw, exclude=(), threshold=REJCHAN_THRESHOLD, freqrange=REJCHAN_FREQRANGE):
+    """
+    频谱坏通道检测：各通道在 freqrange 内的平均对数功率，跨通道 z 分数化后 |z| > threshold 为坏通道。
+    """
+    picks = [ch for ch in raw.copy().pick("eeg").ch_names if ch not in exclude]
+    if len(picks) < 3:
+        return []
+    spectrum = raw.compute_psd(method="welch", fmin=freqrange[0], fmax=freqrange[1], picks=picks)
+    measure = np.mean(10 * np.log10(spectrum.get_data()), axis=1)
+    std = np.std(measure)
+    if std == 0:
+        return []
+    z = (measure - np.mean(measure)) / std
+    return [ch for ch, zi in zip(picks, z) if abs(zi) > threshold]
+
+
+def _has_position(raw, ch):
+    loc = raw.info["chs"][raw.ch_names.index(ch)]["loc"][:3]
+    return bool(np.all(np.isfinite(loc)) and np.any(loc))
+
+
+def require_icalabel():
+    """
+    确认已安装 mne-icalabel，未安装时抛出 ImportError。
+
+    ICA 伪迹成分剔除是预处理链的必需步骤（MATLAB 后端同样总是运行 ICLabel），
+    缺少依赖时在处理任何文件之前报错，而不是静默输出未剔除伪迹的数据。
+    """
+    try:
+        import mne_icalabel  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Step 2 Python/MNE 后端需要 mne-icalabel（ICLabel 成分分类），"
+                          "请先安装：pip install mne-icalabel") from e
+
+
+def _remove_ica_artifacts(raw, n_interp, log):
+    """
+    ICA + ICLabel 伪迹成分剔除。
+
+    插值通道是其他通道的线性组合，成分数取 EEG 通道数减去插值通道数（数据的秩）。
+    """
+    from mne_icalabel import label_components
+
+    n_components = len(mne.pick_types(raw.info, eeg=True)) - n_interp
+    ica = mne.preprocessing.ICA(n_components=n_components, method="infomax",
+                                fit_params=dict(extended=True), random_state=97, max_iter="auto")
+    ica.fit(raw, picks="eeg")
+    # ICLabel 要求平均参考数据（EEGLAB 的 iclabel 内部同样先做平均参考）
+    labels = label_components(raw.copy().set_eeg_reference("average"), ica, method="iclabel")
+    ica.exclude = [idx for idx, (label, prob) in enumerate(zip(labels["labels"], labels["y_pred_proba"]))
+                   if label in ICLABEL_REJECT and prob >= ICLABEL_THRESHOLD]
+    log(f"Removing {len(ica.exclude)} ICs...")
+    return ica.apply(raw)
+
+
+def preprocess_file(vhdr_path, output_folder):
+    """
+    预处理单个 .vhdr 文件，返回 (文件名, 日志文本, 是否成功)。
+
+    日志先收集在字符串中，由主进程统一写入 step2_log.txt，避免多个进程同时写同一文件。
+    """
+    filename = os.path.basename(vhdr_path)
+    file_name_noext = os.path.splitext(filename)[0]
+    subj_id = file_name_noext.split("_")[0]
+    messages = []
+    log = messages.append
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), _ignore_mne_warnings():
+            raw = mne.io.read_raw_brainvision(vhdr_path, preload=True)
+        raw.set_montage("standard_1005", on_missing="ignore", match_case=False)
+        orig_names = list(raw.ch_names)
+
+        log("Filtering...")
+        raw.filter(l_freq=None, h_freq=HIGHCUT)
+        raw.filter(l_freq=LOWCUT, h_freq=None)
+        raw.notch_filter(freqs=np.mean(NOTCH), notch_widths=NOTCH[1] - NOTCH[0])
+
+        raw.resample(RESAMPLE_SFREQ)
+
+        log("Rejecting bad channels...")
+        bads = detect_flat_channels(raw)
+        for _ in range(2):
+            bads += detect_spectral_bad_channels(raw, exclude=bads)
+        raw.info["bads"] = bads
+
+        # 插值通道记录（urchan 为原始通道序号，从 1 开始，与 EEGLAB 一致）
+        interp_chan_struct = {
+            "urchan": np.array([orig_names.index(ch) + 1 for ch in bads], dtype=float),
+            "label": np.array(bads, dtype=object),
+        }
+
+        # 没有电极位置的坏通道无法插值，直接删除
+        no_pos = [ch for ch in bads if not _has_position(raw, ch)]
+        if no_pos:
+            raw.drop_channels(no_pos)
+        n_interp = len(raw.info["bads"])
+        if n_interp:
+            raw.interpolate_bads(reset_bads=True, method=dict(eeg="spline"))
+
+        log("Doing ICA...")
+        with _ignore_mne_warnings():
+            raw = _remove_ica_artifacts(raw, n_interp, log)
+
+        raw.set_eeg_reference("average")
+
+        log("Saving data...")
+        out_path = os.path.join(output_folder, f"{file_name_noext}_processed.set")
+        with _ignore_mne_warnings():
+            mne.export.export_raw(out_path, raw, fmt="eeglab", overwrite=True)
+
+        interp_folder = os.path.join(output_folder, "interp_chan")
+        savemat(os.path.join(interp_folder, f"{subj_id}_interp_chan.mat"),
+                {"interp_chan_struct": interp_chan_struct})
+        log(f"\n Saved interp_chan: {subj_id}_interp_chan.mat")
+        return filename, "".join(messages), True
+    except Exception as e:
+        log(f"\n Failed to process: {filename}\nError message: {e}")
+        return filename, "".join(messages), False
+
+
+def processed_outputs(vhdr_path, output_folder):
+    """
+    .vhdr 对应的、已存在的预处理输出文件（_processed.set 及 .fdt），作为断点记录的输出。
+
+    interp_chan/{被试ID}_interp_chan.mat 按被试 ID 命名，同一被试的多个文件会互相覆盖，不计入。
+    """
+    name = os.path.splitext(os.path.basename(vhdr_path))[0]
+    stem = os.path.join(output_folder, f"{name}_processed")
+    return [path for path in (stem + ".set", stem + ".fdt") if os.path.exists(path)]
+
+
+def check_export(set_path):
+    """
+    完整读取一个已有的 _processed.set（及 .fdt），能读出全部数据时返回 True。
+
+    export_raw 不是原子写入，中断的运行可能留下不完整的文件；没有断点记录的已有结果只有通过此检查才被接纳。
+    """
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            raw = mne.io.read_raw_eeglab(set_path, preload=True, verbose=False)
+        return raw.n_times > 0
+    except Exception:
+        return False
+
+
+def run_step2_mne(input_folders, output_folder, workers=0, blas_threads=1, resume=True):
+    """
+    预处理 input_folders 中所有 .vhdr 文件。
+
+    参数：
+    input_folders : list of str
+        输入文件夹列表。
+    output_folder : str
+        输出文件夹（同时写出 interp_chan/ 与 step2_log.txt）。
+    workers : int
+        并行进程数；<= 0 表示使用全部 CPU 核（默认）。
+    blas_threads : int
+        每个 worker 允许的 BLAS/OpenMP 线程数。
+    resume : bool
+        True（默认）时跳过断点账本中已完成且输出文件复核通过的文件；False 时全部重新处理。
+    """
+    require_icalabel()
+    os.makedirs(os.path.join(output_folder, "interp_chan"), exist_ok=True)
+    log_path = os.path.join(output_folder, "step2_log.txt")
+
+    file_list = []
+    for input_folder in input_folders:
+        file_list += [os.path.join(input_folder, f) for f in sorted(os.listdir(input_folder))
+                      if f.lower().endswith(".vhdr")]
+
+    ledger = CheckpointLedger(ledger_path(output_folder, "step2"), resume=resume)
+    done_keys, _ = ledger.split((os.path.basename(path), os.path.getmtime(path), None) for path in file_list)
+    report("step2", len(done_keys), len(file_list))
+    done_keys = set(done_keys)
+    n_total = len(file_list)
+    file_list = [path for path in file_list if os.path.basename(path) not in done_keys]
+
+    n_workers = max(1, min(resolve_workers(workers), len(file_list)))
+    start_time = time.time()
+    failed = []
+    with open(log_path, "a", encoding="utf-8") as log_file:
+        def log(msg):
+            print(msg, flush=True)
+            log_file.write(msg + "\n")
+            log_file.flush()
+
+        log(f"共 {n_total} 个文件，待处理 {len(file_list)} 个，使用 {n_workers} 个进程（Python/MNE 后端）")
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(blas_threads,)) as pool:
+            futures = {pool.submit(preprocess_file, path, output_folder): path for path in file_list}
+            for done, future in enumerate(as_completed(futures), start=1):
+                filename, messages, ok = future.result()
+                if ok:
+                    vhdr_path = futures[future]
+                    ledger.mark_done(filename, processed_outputs(vhdr_path, output_folder),
+                                     subject=subject_id_of(os.path.splitext(filename)[0]))
+                else:
+                    failed.append(filename)
+                log(f" Processing: {filename}\n{messages}\n File {done}/{len(file_list)} "
+                    f"{'processed successfully' if ok else 'failed'}.")
+        log(f"\n All files processed（{time.time() - start_time:.1f}s，失败 {len(failed)} 个）.")
+    return failed
+
+
+if __name__ == "__main__":
+    # 支持从 GUI 传入 json 字符串参数
+    args = json.loads(sys.argv[1])
+    input_folders = args["input_folders"]
+    if isinstance(input_folders, str):
+        input_folders = [input_folders]
+    failed = run_step2_mne(input_folders, args["output_folder"],
+                           workers=args.get("workers", 0), blas_threads=args.get("blas_threads", 1),
+                           resume=args.get("resume", True))
+    sys.exit(1 if failed else 0)
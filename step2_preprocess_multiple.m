@@ -1,7 +1,11 @@
-function step2_preprocess_multiple(input_folders, output_folder)
+function step2_preprocess_multiple(input_folders, output_folder, resume)
+    % resume (optional, default true): skip files recorded as done in
+    % output_folder/.checkpoints/step2.jsonl whose outputs still verify
+    % (same ledger format as checkpoint.py); false reprocesses everything.
     if nargin < 2
         error('Please provide input_folders (cell array) and output_folder');
     end
+    if nargin < 3, resume = true; end
 
     if ~exist(output_folder, 'dir'), mkdir(output_folder); end
     output_interp_mat_folder = fullfile(output_folder, 'interp_chan');
@@ -15,6 +19,23 @@ function step2_preprocess_multiple(input_folders, output_folder)
     end
     cleanupObj = onCleanup(@() fclose(fid));
 
+    % === Checkpoint ledger ===
+    ledger_file = fullfile(absolute_path(output_folder), '.checkpoints', 'step2.jsonl');
+    if ~resume && exist(ledger_file, 'file'), delete(ledger_file); end
+    ledger = load_ledger(ledger_file);
+    n_total = 0; n_done = 0;
+    for folder_idx = 1:length(input_folders)
+        file_list = dir(fullfile(input_folders{folder_idx}, '*.vhdr'));
+        for i = 1:length(file_list)
+            n_total = n_total + 1;
+            n_done = n_done + is_done(ledger, file_list(i).name, file_list(i).datenum);
+        end
+    end
+    if n_done > 0
+        msg = sprintf('[断点续跑] step2: 已完成 %d 个被试，待处理 %d 个\n', n_done, n_total - n_done);
+        fprintf('%s', msg); fprintf(fid, '%s', msg);
+    end
+
     % Iterate through each folder
     for folder_idx = 1:length(input_folders)
         input_folder = input_folders{folder_idx};
@@ -26,6 +47,10 @@ function step2_preprocess_multiple(input_folders, output_folder)
                 [~, file_name_noext, ~] = fileparts(filename);
                 subj_id = strtok(file_name_noext, '_');
 
+                if is_done(ledger, filename, file_list(i).datenum)
+                    continue;
+                end
+
                 % Log processing start
                 msg = sprintf(' Processing: %s\n', filename);
                 fprintf('%s', msg); fprintf(fid, '%s', msg);
@@ -93,6 +118,10 @@ function step2_preprocess_multiple(input_folders, output_folder)
                 msg2 = sprintf('\n Saved interp_chan: %s_interp_chan.mat', subj_id);
                 fprintf(fid, '%s', msg2);
 
+                % Record the file as done (outputs and sizes, read back from disk)
+                out_stem = fullfile(absolute_path(output_folder), [file_name_noext '_processed']);
+                append_ledger(ledger_file, filename, subj_id, {[out_stem '.set'], [out_stem '.fdt']});
+
                 msg3 = sprintf('\n Folder %d/%d | File %d/%d processed successfully.', ...
                     folder_idx, length(input_folders), i, length(file_list));
                 fprintf(fid, '%s', msg3);
@@ -108,3 +137,65 @@ function step2_preprocess_multiple(input_folders, output_folder)
     fprintf(fid, '\n All files processed.\n');
   
 end
+
+
+function p = absolute_path(p)
+    if isempty(regexp(p, '^([A-Za-z]:|[\\/])', 'once'))
+        p = fullfile(pwd, p);
+    end
+end
+
+
+function ledger = load_ledger(ledger_file)
+    % key -> outputs ({path, bytes} pairs); the last line for a key wins,
+    % lines left half-written by an interrupted run are ignored
+    ledger = containers.Map('KeyType', 'char', 'ValueType', 'any');
+    if ~exist(ledger_file, 'file'), return; end
+    lines = splitlines(fileread(ledger_file));
+    for k = 1:numel(lines)
+        if isempty(strtrim(lines{k})), continue; end
+        try
+            entry = jsondecode(lines{k});
+            ledger(entry.key) = entry.outputs;
+        catch
+        end
+    end
+end
+
+
+function done = is_done(ledger, key, source_datenum)
+    % Outputs still exist, have the recorded size and are not older than the source
+    done = false;
+    if ~isKey(ledger, key), return; end
+    outputs = ledger(key);
+    if isempty(outputs) || ~iscell(outputs), return; end
+    for k = 1:numel(outputs)
+        item = outputs{k};
+        if ~iscell(item) || numel(item) < 2, return; end
+        d = dir(item{1});
+        if numel(d) ~= 1 || d.bytes ~= item{2} || d.datenum + 2 / 86400 < source_datenum
+            return;
+        end
+    end
+    done = true;
+end
+
+
+function append_ledger(ledger_file, key, subj_id, paths)
+    outputs = {};
+    for k = 1:numel(paths)
+        d = dir(paths{k});
+        if numel(d) == 1
+            outputs{end + 1} = {paths{k}, d.bytes}; %#ok<AGROW>
+        end
+    end
+    if isempty(outputs), return; end
+    ckpt_folder = fileparts(ledger_file);
+    if ~exist(ckpt_folder, 'dir'), mkdir(ckpt_folder); end
+    entry = struct('key', key, 'subject', subj_id, 'outputs', {outputs}, ...
+        'time', posixtime(datetime('now', 'TimeZone', 'local')));
+    lf = fopen(ledger_file, 'a', 'n', 'UTF-8');
+    if lf == -1, return; end
+    fprintf(lf, '%s\n', jsonencode(entry));
+    fclose(lf);
+end
@@ -1,8 +1,12 @@
 import os
-import shutil
-import pandas as pd
 import sys
 import json
+import time
+from collections import defaultdict
+
+from staging import STAGE_MODES, MANIFEST_FILE, stage_file, write_manifest
+from age_index import load_age_index, AgeRanges
+from checkpoint import CheckpointLedger, ledger_path, report
 
 def main():
     # === 从命令行参数读取路径 ===
@@ -17,6 +21,10 @@ def main():
         source_folder = config["source_folder"]
         target_folder_month = config["target_folder_month"]
         age_range_list = config["age_range_list"]
+        stage_mode = config.get("stage_mode", "copy")
+        resume = bool(config.get("resume", True))
+        if stage_mode not in STAGE_MODES:
+            raise ValueError(f"stage_mode 必须为 {STAGE_MODES} 之一: {stage_mode}")
     except Exception as e:
         print(f"[错误] 参数解析失败: {e}")
         sys.exit(1)
@@ -31,36 +39,87 @@ def main():
         sys.exit(1)
 
     os.makedirs(target_folder_month, exist_ok=True)
-    for age_range in age_range_list:
-        folder_name = os.path.join(target_folder_month, age_range)
-        os.makedirs(folder_name, exist_ok=True)
+    manifest_path = os.path.join(target_folder_month, MANIFEST_FILE)
+    if stage_mode != "manifest":
+        for age_range in age_range_list:
+            folder_name = os.path.join(target_folder_month, age_range)
+            os.makedirs(folder_name, exist_ok=True)
+        # 旧的 manifest 会被 Step 4 优先使用，改为放置文件时需删除
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
 
-    # === 读取 Excel 表格 ===
-    df = pd.read_excel(file_path, dtype={"ID": str})
+    range_files = defaultdict(list)
+    stage_counts = defaultdict(int)
+    subject_jobs = defaultdict(list)  # "年龄段/被试ID" -> [(src, dst)]，非 manifest 模式按被试断点续跑
 
-    for file_name in os.listdir(source_folder):
+    # === 读取 Excel 表格（ID -> 月龄索引，工作簿未变化时使用缓存）===
+    t0 = time.perf_counter()
+    age_index, cache_hit = load_age_index(file_path, cache_dir=target_folder_month)
+    print(f"月龄索引: {len(age_index)} 个被试（{'使用缓存' if cache_hit else '读取 Excel'}，"
+          f"用时 {time.perf_counter() - t0:.2f}s）")
+    age_ranges = AgeRanges(age_range_list)
+
+    unmatched_ids = set()
+    out_of_range_ids = set()
+    matched_files = 0
+    for entry in os.scandir(source_folder):
+        file_name = entry.name
         if not file_name.endswith(('.set', '.fdt')):
             continue
 
         file_id = file_name.split('_')[0]
-        matched = df[df["ID"] == file_id]
+        if file_id not in age_index:
+            unmatched_ids.add(file_id)
+            continue
 
-        if matched.empty:
+        age_range = age_ranges.find(age_index[file_id])
+        if age_range is None:
+            out_of_range_ids.add(file_id)
             continue
 
-        month_val = matched["month age when scan"].values[0]
+        if stage_mode == "manifest":
+            if file_name.endswith('.set'):
+                range_files[age_range].append(file_name)
+        else:
+            src = os.path.join(source_folder, file_name)
+            dst = os.path.join(target_folder_month, age_range, file_name)
+            subject_jobs[f"{age_range}/{file_id}"].append((src, dst))
+            continue
+        matched_files += 1
+        print(f"{file_name} -> {age_range}")
 
-        for age_range in age_range_list:
-            try:
-                start, end = map(int, age_range.strip().split("-"))
-                if start <= month_val < end:
-                    src = os.path.join(source_folder, file_name)
-                    dst = os.path.join(target_folder_month, age_range, file_name)
-                    shutil.copy(src, dst)
-                    print(f"{file_name} -> {age_range}")
-                    break
-            except Exception as e:
-                print(f"[错误] 解析年龄段失败 {age_range}: {e}")
+    if subject_jobs:
+        # 已完成的被试：放置的文件仍在、大小一致、不早于源文件，且文件集合未变化
+        ledger = CheckpointLedger(ledger_path(target_folder_month, "step3"), resume=resume)
+        done_keys, pending_keys = ledger.split(
+            (key, max(os.path.getmtime(src) for src, _ in jobs), [dst for _, dst in jobs])
+            for key, jobs in subject_jobs.items())
+        report("step3", len(done_keys), len(subject_jobs))
+        for key in done_keys:
+            matched_files += len(subject_jobs[key])
+            stage_counts["skipped"] += len(subject_jobs[key])
+        for key in pending_keys:
+            age_range, file_id = key.split("/", 1)
+            for src, dst in subject_jobs[key]:
+                stage_counts[stage_file(src, dst, stage_mode)] += 1
+                matched_files += 1
+                print(f"{os.path.basename(src)} -> {age_range}")
+            ledger.mark_done(key, [dst for _, dst in subject_jobs[key]], subject=file_id)
+
+    print(f"\n=== 年龄匹配完成 ===\n"
+          f"匹配文件数: {matched_files}\n"
+          f"Excel 中无此 ID 的被试数: {len(unmatched_ids)}\n"
+          f"月龄不在任何年龄段内的被试数: {len(out_of_range_ids)}")
+    if unmatched_ids:
+        print(f"未匹配 ID: {', '.join(sorted(unmatched_ids))}")
+    if out_of_range_ids:
+        print(f"超出年龄段 ID: {', '.join(sorted(out_of_range_ids))}")
+
+    if stage_mode == "manifest":
+        write_manifest(target_folder_month, {r: range_files.get(r, []) for r in age_range_list}, source_folder)
+        print(f"已写出文件清单（未复制文件）: {manifest_path}")
+    else:
+        print("放置方式统计: " + ", ".join(f"{k} {v}" for k, v in stage_counts.items()))
 
 if __name__ == "__main__":
     main()
@@ -2,26 +2,198 @@
 import os
 import sys
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from age_parameters import run_age_analysis  # 你需要在 age_parameters.py 中定义这个函数
+from age_parameters import (list_subject_files, stage_times, add_stage_time, format_stage_times,
+                            _process_subject_timed, report_psd_checkpoints, RangeSummarizer)
+from progress import ProgressTracker, emit_stage_times
+from process_pool import init_worker, resolve_workers
+from psd_cache import psd_cache_from_args
+from staging import find_manifest, load_manifest
+
+def run_step4_batch(base_data_dir, base_output_dir, age_range_list, workers=1, blas_threads=1, psd_cache=None,
+                    render=True, render_workers=1, streaming=False, stream_chunk_seconds=30.0,
+                    scheduler="global", incremental=False, excel=True, table_format="parquet", manifest=None,
+                    psd_dtype="float64", psd_mmap_dir=None):
+    """
+    批量处理多个年龄段。
+
+    scheduler="global" 且 workers > 1 时，所有年龄段的被试进入同一个任务队列、共享同一个进程池
+    （见 run_step4_scheduled）；否则按年龄段依次调用 run_age_analysis。
+    incremental=True 时按年龄段依次做增量更新（每个年龄段内部仍按 workers 并行）。
+    manifest 为 Step 3 写出的 manifest.json 路径；未给出但 base_data_dir 下存在 manifest.json 时自动使用，
+    此时各年龄段直接分析清单中的文件，不读取年龄段文件夹。
+    psd_dtype / psd_mmap_dir 为年龄段 PSD 张量的存储精度与内存映射目录（见 run_age_analysis）。
+    """
+    range_files = None
+    manifest = find_manifest(base_data_dir, manifest)
+    if manifest:
+        range_files = load_manifest(manifest)
+        print(f"使用文件清单: {manifest}")
+
+    if scheduler == "global" and resolve_workers(workers) > 1 and not incremental:
+        run_step4_scheduled(base_data_dir, base_output_dir, age_range_list, workers=workers,
+                            blas_threads=blas_threads, psd_cache=psd_cache, render=render,
+                            render_workers=render_workers, streaming=streaming,
+                            stream_chunk_seconds=stream_chunk_seconds, excel=excel, table_format=table_format,
+                            range_files=range_files, psd_dtype=psd_dtype, psd_mmap_dir=psd_mmap_dir)
+        return
 
-def run_step4_batch(base_data_dir, base_output_dir, age_range_list):
     for age_range in age_range_list:
         print(f"\n正在处理年龄段: {age_range}")
-        data_dir = os.path.join(base_data_dir, age_range)
+        data_dir = os.path.join(base_data_dir or "", age_range)
         output_dir = os.path.join(base_output_dir, age_range)
         os.makedirs(output_dir, exist_ok=True)
 
         try:
-            run_age_analysis(data_dir, output_dir)
+            file_list = None if range_files is None else _manifest_files(range_files, age_range)
+            run_age_analysis(data_dir, output_dir, workers=workers, blas_threads=blas_threads, psd_cache=psd_cache,
+                             render=render, render_workers=render_workers,
+                             streaming=streaming, stream_chunk_seconds=stream_chunk_seconds,
+                             incremental=incremental, excel=excel, table_format=table_format,
+                             file_list=file_list, psd_dtype=psd_dtype, psd_mmap_dir=psd_mmap_dir)
             print(f"成功完成: {age_range}")
         except Exception as e:
             print(f"出错跳过: {age_range}，错误信息: {e}")
 
+def run_step4_scheduled(base_data_dir, base_output_dir, age_range_list, workers=1, blas_threads=1, psd_cache=None,
+                        render=True, render_workers=1, streaming=False, stream_chunk_seconds=30.0,
+                        excel=True, table_format="parquet", range_files=None, psd_dtype="float64", psd_mmap_dir=None):
+    """
+    跨年龄段调度：把所有 (年龄段, 被试) 任务放入同一个进程池。
+
+    - 被试多的年龄段先提交，避免大年龄段最后才开始、拖长总时间
+    - 某个年龄段的被试全部完成后立即在后台线程中计算该年龄段的群体统计并输出结果，拓扑图渲染提交到
+      同一进程池（见 age_parameters.RangeSummarizer）；调度循环不等待汇总
+    - 某个年龄段出错只跳过该年龄段（取消其未开始的任务），不影响其他年龄段
+
+    range_files 为 load_manifest 的返回值（年龄段 -> 文件路径列表）；为 None 时列出各年龄段文件夹。
+    """
+    ranges = {}
+    completed = []
+    failed = []
+    for age_range in age_range_list:
+        data_dir = os.path.join(base_data_dir or "", age_range)
+        output_dir = os.path.join(base_output_dir, age_range)
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            if range_files is None:
+                file_list = list_subject_files(data_dir)
+            else:
+                file_list = _manifest_files(range_files, age_range)
+        except Exception as e:
+            failed.append(age_range)
+            print(f"出错跳过: {age_range}，错误信息: {e}")
+            continue
+        if not file_list:
+            completed.append(age_range)
+            print(f"\n年龄段 {age_range}: No .set files found.")
+            print(f"成功完成: {age_range}")
+            continue
+        ranges[age_range] = {
+            "data_dir": data_dir,
+            "output_dir": output_dir,
+            "file_list": file_list,
+            "cache_keys": report_psd_checkpoints(data_dir, file_list, psd_cache, streaming, age_range),
+            "results": [None] * len(file_list),
+            "done": 0,
+            "failed": False,
+            "futures": [],
+        }
+
+    if not ranges:
+        print(f"\n=== Step 4 调度完成 ===\n失败年龄段: {', '.join(failed) if failed else '无'}")
+        return
+
+    total = sum(len(r["file_list"]) for r in ranges.values())
+    n_workers = min(resolve_workers(workers), total)
+    print(f"\n共 {len(ranges)} 个年龄段、{total} 个被试，使用 {n_workers} 个进程统一调度")
+
+    start_time = time.time()
+    stage_times.clear()
+    tracker = ProgressTracker("step4", total, label="all")
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(blas_threads,)) as pool:
+        summarizer = RangeSummarizer(pool, render=render, render_workers=render_workers, psd_cache=psd_cache,
+                                     blas_threads=blas_threads, excel=excel, table_format=table_format,
+                                     psd_dtype=psd_dtype, psd_mmap_dir=psd_mmap_dir)
+        future_map = {}
+        for age_range in sorted(ranges, key=lambda k: len(ranges[k]["file_list"]), reverse=True):
+            state = ranges[age_range]
+            for idx, (file_name, cache_key) in enumerate(zip(state["file_list"], state["cache_keys"])):
+                future = pool.submit(_process_subject_timed, state["data_dir"], file_name, psd_cache,
+                                     streaming, stream_chunk_seconds, cache_key)
+                future_map[future] = (age_range, idx)
+                state["futures"].append(future)
+
+        for future in as_completed(future_map):
+            age_range, idx = future_map[future]
+            state = ranges[age_range]
+            if state["failed"] or future.cancelled():
+                continue
+            try:
+                result, seconds, stage_delta = future.result()
+            except Exception as e:
+                state["failed"] = True
+                for f in state["futures"]:
+                    f.cancel()
+                failed.append(age_range)
+                print(f"出错跳过: {age_range}，错误信息: {e}")
+                continue
+            state["results"][idx] = result
+            for stage, delta in stage_delta.items():
+                add_stage_time(stage, delta)
+            tracker.update(f"{age_range}/{result[0]}", seconds)
+
+            state["done"] += 1
+            if state["done"] < len(state["file_list"]):
+                continue
+
+            # 该年龄段所有被试已完成：在后台计算群体统计（其他年龄段的任务仍在进程池中运行）
+            print(f"\n正在处理年龄段: {age_range}（{state['done']} 个被试已完成，"
+                  f"用时 {time.time() - start_time:.1f}s）")
+            summarizer.submit(age_range, state["output_dir"], state["results"])
+            state["results"] = None  # 汇总线程持有结果列表，汇总时逐个被试释放
+
+        # 等待仍在汇总 / 渲染的年龄段（渲染任务在共享进程池中，关闭进程池之前等待）
+        summarized, summary_failed = summarizer.wait()
+        completed += summarized
+        failed += summary_failed
+
+    tracker.finish()
+    emit_stage_times("step4", stage_times, label="all")
+    print(f"\n=== Step 4 调度完成（{time.time() - start_time:.1f}s，{format_stage_times()}）===\n"
+          f"成功年龄段: {', '.join(completed) if completed else '无'}\n"
+          f"失败年龄段: {', '.join(failed) if failed else '无'}")
+
+def _manifest_files(range_files, age_range):
+    if age_range not in range_files:
+        raise KeyError(f"文件清单中没有年龄段 {age_range}")
+    return range_files[age_range]
+
 if __name__ == "__main__":
     # 支持从 GUI 传入 json 字符串参数
     args = json.loads(sys.argv[1])
+
+    # 可选：被试 PSD 磁盘缓存（psd_cache_dir），或作为被试级断点的 PSD 缓存（checkpoint=true）
+    psd_cache = psd_cache_from_args(args)
+
     run_step4_batch(
-        base_data_dir=args["base_data_dir"],
+        base_data_dir=args.get("base_data_dir"),
         base_output_dir=args["base_output_dir"],
-        age_range_list=args["age_range_list"]
+        age_range_list=args["age_range_list"],
+        workers=args.get("workers", 1),
+        blas_threads=args.get("blas_threads", 1),
+        psd_cache=psd_cache,
+        render=args.get("render", True),
+        render_workers=args.get("render_workers", 1),
+        streaming=args.get("streaming_psd", False),
+        stream_chunk_seconds=args.get("stream_chunk_seconds", 30.0),
+        scheduler=args.get("scheduler", "global"),
+        incremental=args.get("incremental", False),
+        excel=args.get("excel", True),
+        table_format=args.get("table_format", "parquet"),
+        manifest=args.get("manifest"),
+        psd_dtype=args.get("psd_dtype", "float64"),
+        psd_mmap_dir=args.get("psd_mmap_dir")
     )
@@ -0,0 +1,381 @@
+"""
+step_worker.py
+
+功能：
+- 常驻的步骤脚本 worker：解释器只启动一次，预先导入 Step 4 所需的 mne / matplotlib 等模块，
+  之后每次运行 Step 1/3/4（或流水线）脚本只需毫秒级的调度开销
+- 可选保持 MATLAB 引擎常驻（第一次 MATLAB 预处理时启动，之后复用），不再每次 Step 2 都启动 / 退出引擎
+- 运行 N 个任务后自动退出（回收），由客户端在下一次请求时重新启动，限制内存增长
+
+通信协议（stdin / stdout 管道，每行一个 JSON）：
+    客户端 -> worker:
+        {"type": "run", "id": 1, "script": "/path/step4_all_age.py", "args": {...}}   参数与命令行 JSON 相同
+        {"type": "matlab_step2", "id": 2, "input_folders": [...], "output_folder": "..."}
+        {"type": "cancel"}      中止正在运行的 MATLAB 调用（脚本任务由客户端终止整个进程组）
+        {"type": "shutdown"}
+    worker -> 客户端:
+        {"type": "ready", "pid": ..., "preload_seconds": ...}
+        {"type": "log", "id": 1, "line": "..."}       脚本（及其子进程）的 stdout / stderr，逐行
+        {"type": "done", "id": 1, "returncode": 0, "seconds": ..., "recycle": false}
+
+worker 把文件描述符 1 / 2 重定向到内部管道并逐行转发，进程池子进程与 C 扩展的输出同样会被转发，
+协议消息使用单独复制出的原 stdout，不会被脚本输出打乱。
+请求同样从单独复制出的原 stdin 读取，fd 0 指向空设备：读取线程一直持有请求流的锁，
+若仍用 sys.stdin 读取，脚本中 fork 出的进程池子进程在启动时关闭 sys.stdin 会永远等待该锁。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import queue
+import runpy
+import argparse
+import threading
+import traceback
+import subprocess
+
+from job_scheduler import kill_process_tree, _process_group_kwargs
+
+WORKER_SCRIPT = os.path.abspath(__file__)
+DEFAULT_MAX_JOBS = 20
+JOB_END = "\x00@@job_end "
+
+
+# ========== worker 端 ==========
+def _preload():
+    """导入 Step 3 / Step 4 / 流水线用到的模块（含 mne.io 与 matplotlib 的实际加载）。"""
+    import age_parameters
+    age_parameters._mne().io.read_raw_eeglab
+    age_parameters._pyplot()
+    import step4_all_age  # noqa: F401
+    import age_index  # noqa: F401
+    import staging  # noqa: F401
+    import copy_engine  # noqa: F401
+    import source_index  # noqa: F401
+
+
+def _run_script(script, args):
+    """在当前解释器中以 __main__ 运行步骤脚本，返回退出码。"""
+    old_argv = sys.argv
+    sys.argv = [script, json.dumps(args)]
+    try:
+        runpy.run_path(script, run_name="__main__")
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = old_argv
+
+
+class _MatlabSession:
+    """常驻 MATLAB 引擎：第一次使用时启动，取消或出错后退出，下次使用时重新启动。"""
+
+    def __init__(self):
+        self.engine = None
+        self.future = None
+
+    def run_step2(self, input_folders, output_folder):
+        try:
+            if self.engine is None:
+                import matlab.engine
+                print(">>> 正在启动 MATLAB 引擎...")
+                self.engine = matlab.engine.start_matlab()
+            self.future = self.engine.step2_preprocess_multiple(input_folders, output_folder,
+                                                                nargout=0, background=True)
+            self.future.result()
+            return 0
+        except BaseException as e:
+            print(f"❌ step2 执行出错: {e}")
+            self.quit()
+            return 1
+        finally:
+            self.future = None
+
+    def cancel(self):
+        future = self.future
+        if future is not None:
+            try:
+                future.cancel()
+            finally:
+                self.quit()
+
+    def quit(self):
+        if self.engine is not None:
+            try:
+                self.engine.quit()
+            except Exception:
+                pass
+            self.engine = None
+
+
+def _redirect_fd(fd, target_fd):
+    """把 fd 指向 target_fd，并返回基于新 fd 重新创建的文本流（原流缓存的 seekable 等状态不再适用）。"""
+    os.dup2(target_fd, fd)
+    mode = "rb" if fd == 0 else "wb"
+    return io.TextIOWrapper(os.fdopen(fd, mode, buffering=0, closefd=False),
+                            encoding="utf-8", errors="replace", line_buffering=(fd != 0))
+
+
+def serve(max_jobs=DEFAULT_MAX_JOBS, preload=True):
+    proto = os.fdopen(os.dup(1), "w", encoding="utf-8", errors="replace")
+    request_stream = os.fdopen(os.dup(0), "r", encoding="utf-8", errors="replace")
+    proto_lock = threading.Lock()
+
+    def send(**msg):
+        with proto_lock:
+            proto.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            proto.flush()
+
+    # fd 1 / 2 -> 内部管道，由转发线程逐行发送给客户端
+    sys.stdout.flush()
+    sys.stderr.flush()
+    read_fd, write_fd = os.pipe()
+    sys.stdout = _redirect_fd(1, write_fd)
+    sys.stderr = _redirect_fd(2, write_fd)
+    os.close(write_fd)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    sys.stdin = _redirect_fd(0, null_fd)
+    os.close(null_fd)
+
+    current = {"id": None}
+
+    def forward():
+        with open(read_fd, "r", encoding="utf-8", errors="replace") as pipe:
+            for line in pipe:
+                idx = line.find(JOB_END)
+                if idx < 0:
+                    send(type="log", id=current["id"], line=line)
+                    continue
+                if idx > 0:
+                    send(type="log", id=current["id"], line=line[:idx] + "\n")
+                job_id, returncode, seconds, recycle = json.loads(line[idx + len(JOB_END):])
+                send(type="done", id=job_id, returncode=returncode, seconds=seconds, recycle=recycle)
+
+    forwarder = threading.Thread(target=forward, daemon=True)
+    forwarder.start()
+
+    matlab_session = _MatlabSession()
+    requests = queue.Queue()
+
+    def read_requests():
+        for raw in request_stream:
+            try:
+                msg = json.loads(raw)
+            except ValueError:
+                continue
+            if msg.get("type") == "cancel":
+                matlab_session.cancel()
+            else:
+                requests.put(msg)
+        requests.put(None)  # 客户端关闭了管道
+
+    threading.Thread(target=read_requests, daemon=True).start()
+
+    t0 = time.perf_counter()
+    if preload:
+        try:
+            _preload()
+        except Exception:
+            traceback.print_exc()
+    send(type="ready", pid=os.getpid(), preload_seconds=round(time.perf_counter() - t0, 3))
+
+    n_jobs = 0
+    while True:
+        msg = requests.get()
+        if msg is None or msg.get("type") == "shutdown":
+            break
+        current["id"] = msg.get("id")
+        t0 = time.perf_counter()
+        if msg.get("type") == "matlab_step2":
+            returncode = matlab_session.run_step2(msg["input_folders"], msg["output_folder"])
+        else:
+            returncode = _run_script(msg["script"], msg.get("args", {}))
+        n_jobs += 1
+        recycle = n_jobs >= max_jobs
+        sys.stdout.flush()
+        sys.stderr.flush()
+        end = JOB_END + json.dumps([msg.get("id"), returncode, round(time.perf_counter() - t0, 3), recycle])
+        os.write(1, (end + "\n").encode("utf-8"))
+        if recycle:
+            break
+
+    matlab_session.quit()
+    # 关闭管道写端，等待转发线程发出最后的消息
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.close(1)
+    os.close(2)
+    forwarder.join(timeout=5)
+    proto.close()
+
+
+# ========== 客户端 ==========
+class StepWorker:
+    """
+    一个常驻 worker 进程的客户端。同一时间只运行一个任务。
+
+    参数：
+    max_jobs : int
+        worker 运行多少个任务后自动回收。
+    preload : bool
+        worker 启动时预先导入 Step 4 所需模块。
+    env : dict or None
+        worker 进程的环境变量（如 EEG_PROGRESS=1）。
+    """
+
+    def __init__(self, max_jobs=DEFAULT_MAX_JOBS, preload=True, env=None):
+        self.max_jobs = max_jobs
+        self.preload = preload
+        self.env = env
+        self.process = None
+        self.ready_info = None
+        self._next_id = 1
+        self._recycled = False
+        self._cancel_by_message = False
+        self._write_lock = threading.Lock()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None and not self._recycled
+
+    def start(self):
+        cmd = [sys.executable, WORKER_SCRIPT, "--serve", "--max_jobs", str(self.max_jobs)]
+        if not self.preload:
+            cmd.append("--no_preload")
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            encoding="utf-8",
+            errors="replace",
+            env=self.env,
+            **_process_group_kwargs()
+        )
+        self._recycled = False
+        self.ready_info = None
+
+    def _send(self, **msg):
+        with self._write_lock:
+            self.process.stdin.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            self.process.stdin.flush()
+
+    def _cancel(self):
+        if self._cancel_by_message:
+            try:
+                self._send(type="cancel")
+                return
+            except OSError:
+                pass
+        kill_process_tree(self.process)
+
+    def _request(self, on_line, job, cancel_by_message, **msg):
+        if not self.alive():
+            self.start()
+        job_id = self._next_id
+        self._next_id += 1
+        self._cancel_by_message = cancel_by_message
+        try:
+            self._send(id=job_id, **msg)
+        except OSError:
+            # worker 已意外退出：重启后重发一次
+            self.start()
+            self._send(id=job_id, **msg)
+        if job is not None:
+            job.set_cancel_hook(self._cancel)
+
+        for raw in self.process.stdout:
+            try:
+                reply = json.loads(raw)
+            except ValueError:
+                on_line(raw)
+                continue
+            kind = reply.get("type")
+            if kind == "ready":
+                self.ready_info = reply
+            elif kind == "log":
+                on_line(reply["line"])
+            elif kind == "done" and reply.get("id") == job_id:
+                if reply.get("recycle"):
+                    self._recycled = True  # worker 正在自行退出，下一次请求时重新启动
+                return reply["returncode"]
+        # 管道关闭：worker 被终止（取消）或崩溃
+        return self.process.wait()
+
+    def run_script(self, script, args, on_line, job=None):
+        """在 worker 中运行步骤脚本，逐行回调输出，返回退出码；取消时终止 worker 进程组。"""
+        return self._request(on_line, job, False, type="run", script=script, args=args)
+
+    def run_matlab_step2(self, input_folders, output_folder, on_line, job=None):
+        """在 worker 的常驻 MATLAB 引擎中运行 step2_preprocess_multiple，返回退出码。"""
+        return self._request(on_line, job, True, type="matlab_step2",
+                             input_folders=input_folders, output_folder=output_folder)
+
+    def close(self, timeout=5):
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self._send(type="shutdown")
+            self.process.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            kill_process_tree(self.process)
+
+
+class StepWorkerPool:
+    """空闲 worker 池：并发任务各自取一个 worker，没有空闲 worker 时新建。"""
+
+    def __init__(self, max_jobs=DEFAULT_MAX_JOBS, env=None):
+        self.max_jobs = max_jobs
+        self.env = env
+        self._idle = []
+        self._busy = set()
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """预先启动一个空闲 worker（在后台预热导入）。"""
+        with self._lock:
+            if not self._idle:
+                worker = StepWorker(max_jobs=self.max_jobs, env=self.env)
+                worker.start()
+                self._idle.append(worker)
+
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    break
+            else:
+                worker = StepWorker(max_jobs=self.max_jobs, env=self.env)
+            self._busy.add(worker)
+            return worker
+
+    def release(self, worker):
+        with self._lock:
+            self._busy.discard(worker)
+            if worker.alive():
+                self._idle.append(worker)
+
+    def close(self):
+        with self._lock:
+            workers = self._idle + list(self._busy)
+            self._idle, self._busy = [], set()
+        for worker in workers:
+            worker.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent worker that runs step scripts in a warm interpreter")
+    parser.add_argument("--serve", action="store_true", help="Run the worker loop on stdin/stdout")
+    parser.add_argument("--max_jobs", type=int, default=DEFAULT_MAX_JOBS, help="Exit after this many jobs (recycling)")
+    parser.add_argument("--no_preload", action="store_true", help="Do not import the Step 4 modules at start-up")
+    args = parser.parse_args()
+    if not args.serve:
+        parser.error("--serve is required (the worker is started by the GUI / StepWorker)")
+    serve(max_jobs=args.max_jobs, preload=not args.no_preload)
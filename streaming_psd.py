@@ -0,0 +1,109 @@
+"""
+streaming_psd.py
+
+功能：
+- 不使用 preload=True 的低内存 Welch PSD（Step 4 可选路径）
+- 只读取 .set 头信息，.fdt 数据以内存映射方式按固定长度分块读取
+- 每块调用与 MNE 相同的 scipy.signal.spectrogram 参数，累加各 Welch 段的功率后求平均
+
+峰值内存只与分块长度有关，与记录时长无关。结果与
+raw.compute_psd(method='welch', fmin=..., fmax=...) 在浮点舍入误差范围内一致。
+
+以下情况 MNE 会排除部分数据（bads 通道、BAD_* 注释）或数据嵌在 .set 中无法内存映射，
+此时自动回退为 preload=True + compute_psd，以保证结果一致。
+"""
+
+import os
+import io
+import contextlib
+import numpy as np
+import mne
+from scipy.signal import spectrogram
+
+# 与 Raw.compute_psd(method='welch') 的默认参数保持一致：n_fft = min(n_times, 2048)
+DEFAULT_N_FFT = 2048
+DEFAULT_WINDOW = "hamming"
+EEGLAB_CAL = 1e-6  # EEGLAB 数据单位为 µV，MNE 读入后换算为 V
+
+
+def _read_header(set_path):
+    """只读取 .set 头信息（通道、采样率、注释、montage），不加载数据。"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return mne.io.read_raw_eeglab(set_path, preload=False, verbose=False)
+
+
+def _can_stream(raw):
+    """仅当 compute_psd 会使用全部通道、全部采样点，且数据位于独立 .fdt 文件时才走流式路径。"""
+    if raw.info["bads"]:
+        return False
+    if set(raw.get_channel_types()) != {"eeg"}:
+        return False
+    if any(desc.lower().startswith("bad") for desc in raw.annotations.description):
+        return False
+    data_fname = str(raw.filenames[0])
+    return data_fname.lower().endswith(".fdt") and os.path.exists(data_fname)
+
+
+def _fallback_psd(set_path, fmin, fmax, n_fft):
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        raw = mne.io.read_raw_eeglab(set_path, preload=True, verbose=False)
+    method_kw = {} if n_fft is None else {"n_fft": n_fft}
+    spectrum = raw.compute_psd(method="welch", fmin=fmin, fmax=fmax, verbose=False, **method_kw)
+    psds, freqs = spectrum.get_data(return_freqs=True)
+    return psds, freqs, raw.info
+
+
+def stream_welch_psd(set_path, fmin=0, fmax=40, n_fft=None, chunk_seconds=30.0):
+    """
+    分块计算 EEGLAB 原始数据的 Welch PSD。
+
+    参数：
+    set_path : str
+        .set 文件路径（数据位于同名 / 头信息指定的 .fdt 中）。
+    fmin, fmax : float
+        输出频率范围（闭区间），与 compute_psd 相同。
+    n_fft : int or None
+        Welch 段长度（无重叠，Hamming 窗，去均值）；None 时与 MNE 默认值相同，即 min(n_times, 2048)。
+    chunk_seconds : float
+        每块读取的时长，向下取整为 n_fft 的整数倍（至少一个段）。
+
+    返回：
+    (psds, freqs, info)，psds 形状为 (n_channels, n_freqs)。
+    """
+    raw = _read_header(set_path)
+    if not _can_stream(raw):
+        return _fallback_psd(set_path, fmin, fmax, n_fft)
+
+    sfreq = raw.info["sfreq"]
+    n_chan = raw.info["nchan"]
+    n_times = raw.n_times
+    if n_fft is None:
+        n_fft = min(n_times, DEFAULT_N_FFT)
+    if n_fft > n_times:
+        raise ValueError(f"n_fft={n_fft} 大于采样点数 {n_times}: {set_path}")
+
+    freqs = np.arange(n_fft // 2 + 1, dtype=float) * (sfreq / n_fft)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    if not freq_mask.any():
+        raise ValueError(f"No frequencies found between fmin={fmin} and fmax={fmax}")
+
+    # 无重叠 Welch：只分析完整的段，末尾不足 n_fft 的采样点被丢弃（与 MNE 相同）
+    n_segments = n_times // n_fft
+    analyzed_end = n_segments * n_fft
+    chunk_samples = max(1, int(chunk_seconds * sfreq) // n_fft) * n_fft
+
+    # EEGLAB .fdt：float32 小端，按采样点存储（每个采样点连续存放所有通道）
+    data = np.memmap(str(raw.filenames[0]), dtype="<f4", mode="r", shape=(n_times, n_chan))
+    power_sum = np.zeros((n_chan, int(freq_mask.sum())))
+    try:
+        for start in range(0, analyzed_end, chunk_samples):
+            stop = min(start + chunk_samples, analyzed_end)
+            chunk = data[start:stop].T.astype(np.float64) * EEGLAB_CAL
+            _, _, spect = spectrogram(chunk, fs=sfreq, window=DEFAULT_WINDOW, nperseg=n_fft,
+                                      noverlap=0, nfft=n_fft, detrend="constant", mode="psd")
+            power_sum += spect[:, freq_mask].sum(axis=-1)
+    finally:
+        del data
+
+    psds = power_sum / n_segments
+    return psds, freqs[freq_mask], raw.info
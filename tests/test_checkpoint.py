@@ -0,0 +1,77 @@
+import json
+import os
+
+from checkpoint import CheckpointLedger, ledger_path, MTIME_TOLERANCE
+
+
+def _write(path, data=b"x" * 10):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_mark_done_and_verify(tmp_path):
+    out = _write(tmp_path / "a.set")
+    ledger = CheckpointLedger(ledger_path(str(tmp_path), "step2"))
+    ledger.mark_done("a.vhdr", [out], subject="a")
+
+    reloaded = CheckpointLedger(ledger_path(str(tmp_path), "step2"))
+    assert reloaded.verify("a.vhdr")
+    assert reloaded.verify("a.vhdr", source_mtime=os.path.getmtime(out))
+    assert not reloaded.verify("b.vhdr")
+
+
+def test_verify_detects_changed_outputs(tmp_path):
+    out = _write(tmp_path / "a.set")
+    ledger = CheckpointLedger(ledger_path(str(tmp_path), "step1"))
+    ledger.mark_done("a", [out])
+
+    # 源文件比输出新（超过容差）
+    assert not ledger.verify("a", source_mtime=os.path.getmtime(out) + MTIME_TOLERANCE + 10)
+    # 输出文件集合变化
+    assert not ledger.verify("a", expected=[out, str(tmp_path / "b.set")])
+    assert ledger.verify("a", expected=[out])
+    # 大小变化
+    _write(out, b"y" * 5)
+    assert not ledger.verify("a")
+    # 输出被删除
+    os.remove(out)
+    assert not ledger.verify("a")
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    out = _write(tmp_path / "a.set")
+    path = ledger_path(str(tmp_path), "step3")
+    ledger = CheckpointLedger(path)
+    ledger.mark_done("a", [out])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "b", "outputs": [["')  # 写到一半时中断
+
+    reloaded = CheckpointLedger(path)
+    assert reloaded.verify("a")
+    assert "b" not in reloaded.entries
+    done, pending = reloaded.split([("a", None, None), ("b", None, None)])
+    assert done == ["a"] and pending == ["b"]
+
+
+def test_last_entry_wins_and_compact(tmp_path):
+    first = _write(tmp_path / "a1.set")
+    second = _write(tmp_path / "a2.set", b"z" * 3)
+    path = ledger_path(str(tmp_path), "step2")
+    ledger = CheckpointLedger(path)
+    ledger.mark_done("a", [first])
+    ledger.mark_done("a", [second])
+    ledger.compact()
+
+    with open(path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 1
+    assert lines[0]["outputs"] == [[os.path.abspath(second), 3]]
+
+
+def test_resume_false_clears(tmp_path):
+    out = _write(tmp_path / "a.set")
+    path = ledger_path(str(tmp_path), "step2")
+    CheckpointLedger(path).mark_done("a", [out])
+    assert not CheckpointLedger(path, resume=False).verify("a")
+    assert not os.path.exists(path)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from cohort_state import CohortState
+
+N_CHAN, N_FREQS, N_REGIONS, N_BANDS = 4, 6, 3, 5
+
+
+def _subjects(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [f"S{seed}{i:03d}" for i in range(n)]
+    return (ids, [f"sig{i}" for i in range(n)],
+            rng.random((n, N_REGIONS, N_FREQS)), rng.random((n, N_REGIONS, N_BANDS)) * 100,
+            rng.random((n, N_CHAN, N_BANDS)), rng.random((n, N_CHAN, N_BANDS)))
+
+
+def _new_state():
+    return CohortState([f"C{i}" for i in range(N_CHAN)], np.arange(N_FREQS, dtype=float), {"sfreq": 500.0},
+                       N_REGIONS, N_BANDS)
+
+
+def _assert_matches_full(state, region_psd, region_band_values, psd_band_avg):
+    np.testing.assert_allclose(state.group_region_psd, region_psd.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(state.group_psd_band_avg, psd_band_avg.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(state.region_band_mean, region_band_values.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(state.region_band_std, region_band_values.std(axis=0), rtol=1e-8)
+
+
+def test_batched_add_matches_full_recompute():
+    ids, sigs, rpsd, rbv, band_avg, topo = _subjects(12)
+    state = _new_state()
+    for lo, hi in ((0, 5), (5, 6), (6, 12)):
+        state.add(ids[lo:hi], sigs[lo:hi], rpsd[lo:hi], rbv[lo:hi], band_avg[lo:hi], topo[lo:hi])
+    assert state.n == 12
+    _assert_matches_full(state, rpsd, rbv, band_avg)
+
+
+def test_remove_matches_full_recompute():
+    ids, sigs, rpsd, rbv, band_avg, topo = _subjects(10)
+    state = _new_state()
+    state.add(ids, sigs, rpsd, rbv, band_avg, topo)
+    removed = [ids[1], ids[4], ids[9], "unknown"]
+    state.remove(removed)
+
+    keep = [i for i, sid in enumerate(ids) if sid not in removed]
+    assert state.subject_ids == [ids[i] for i in keep]
+    _assert_matches_full(state, rpsd[keep], rbv[keep], band_avg[keep])
+    np.testing.assert_array_equal(state.topo_values, topo[keep])
+
+
+def test_remove_then_add_and_duplicates():
+    ids, sigs, rpsd, rbv, band_avg, topo = _subjects(6)
+    state = _new_state()
+    state.add(ids, sigs, rpsd, rbv, band_avg, topo)
+    state.remove(ids[:2])
+    state.add(ids[:2], sigs[:2], rpsd[:2], rbv[:2], band_avg[:2], topo[:2])  # 被试重新预处理后重新加入
+    order = [2, 3, 4, 5, 0, 1]
+    _assert_matches_full(state, rpsd[order], rbv[order], band_avg[order])
+
+    with pytest.raises(ValueError):
+        state.add(ids[:1], sigs[:1], rpsd[:1], rbv[:1], band_avg[:1], topo[:1])
+
+
+def test_remove_all_resets_and_save_load_roundtrip(tmp_path):
+    ids, sigs, rpsd, rbv, band_avg, topo = _subjects(4)
+    state = _new_state()
+    state.add(ids, sigs, rpsd, rbv, band_avg, topo)
+    path = str(tmp_path / "cohort_state.npz")
+    state.save(path)
+    loaded = CohortState.load(path)
+    assert loaded.subject_ids == ids and loaded.file_sigs == sigs
+    _assert_matches_full(loaded, rpsd, rbv, band_avg)
+
+    loaded.remove(ids)
+    assert loaded.n == 0
+    assert not loaded.region_psd_sum.any() and not loaded.rb_m2.any()
@@ -0,0 +1,69 @@
+import os
+
+from copy_engine import COPY_COPIED, COPY_SKIPPED, copy_files, is_up_to_date
+
+
+def _pair(tmp_path, content=b"eeg"):
+    src = tmp_path / "src.vhdr"
+    dst = tmp_path / "dst.vhdr"
+    src.write_bytes(content)
+    dst.write_bytes(content)
+    st = os.stat(src)
+    return src, dst, st.st_mtime
+
+
+def test_missing_target_is_not_up_to_date(tmp_path):
+    src = tmp_path / "src.vhdr"
+    src.write_bytes(b"eeg")
+    assert not is_up_to_date(str(src), str(tmp_path / "missing.vhdr"))
+
+
+def test_same_size_and_mtime_is_up_to_date(tmp_path):
+    src, dst, mtime = _pair(tmp_path)
+    os.utime(dst, (mtime, mtime))
+    assert is_up_to_date(str(src), str(dst))
+
+
+def test_size_change_is_not_up_to_date(tmp_path):
+    src, dst, mtime = _pair(tmp_path)
+    dst.write_bytes(b"eeg-longer")
+    os.utime(dst, (mtime, mtime))
+    assert not is_up_to_date(str(src), str(dst))
+
+
+def test_mtime_within_two_seconds_is_up_to_date(tmp_path):
+    # 跨越整秒边界的误差（如 10.9 与 12.1）也应视为一致
+    src, dst, _ = _pair(tmp_path)
+    os.utime(src, (1000010.9, 1000010.9))
+    os.utime(dst, (1000012.1, 1000012.1))
+    assert is_up_to_date(str(src), str(dst))
+    os.utime(dst, (1000009.0, 1000009.0))
+    assert is_up_to_date(str(src), str(dst))
+
+
+def test_mtime_beyond_two_seconds_is_not_up_to_date(tmp_path):
+    src, dst, _ = _pair(tmp_path)
+    os.utime(src, (1000010.0, 1000010.0))
+    os.utime(dst, (1000012.5, 1000012.5))
+    assert not is_up_to_date(str(src), str(dst))
+
+
+def test_copy_files_skips_up_to_date_targets(tmp_path):
+    src_dir = tmp_path / "src"
+    dst_dir = tmp_path / "dst"
+    src_dir.mkdir()
+    dst_dir.mkdir()
+    jobs = []
+    for name in ("a.eeg", "b.eeg"):
+        (src_dir / name).write_bytes(name.encode() * 100)
+        jobs.append((str(src_dir / name), str(dst_dir / name)))
+
+    results = []
+    first = copy_files(jobs, workers=2, on_result=lambda s, d, status: results.append(status))
+    assert results == [COPY_COPIED, COPY_COPIED]
+    assert (dst_dir / "a.eeg").read_bytes() == (src_dir / "a.eeg").read_bytes()
+    assert not first["failed"]
+
+    results.clear()
+    copy_files(jobs, workers=2, on_result=lambda s, d, status: results.append(status))
+    assert results == [COPY_SKIPPED, COPY_SKIPPED]
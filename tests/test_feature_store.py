@@ -0,0 +1,34 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from feature_store import load_feature_store, write_feature_store, write_table
+
+
+def _table():
+    return pd.DataFrame({"ID": ["S01", "S02"], "相似度": [0.9, 0.8]})
+
+
+def test_table_falls_back_to_csv_without_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)  # import pyarrow 抛出 ImportError
+    path = write_table(_table(), str(tmp_path), "parquet")
+    assert path.endswith("sub_sim.csv")
+    pd.testing.assert_frame_equal(pd.read_csv(path, encoding="utf-8-sig"), _table())
+
+
+def test_table_format_none_writes_nothing(tmp_path):
+    assert write_table(_table(), str(tmp_path), "none") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_feature_store_round_trip(tmp_path):
+    band_avg = np.random.default_rng(0).random((2, 3, 5))
+    write_feature_store(str(tmp_path), _table(), ["S01", "S02"], ["Fz", "Cz", "Pz"], np.arange(4),
+                        ["delta", "theta", "alpha", "beta", "gamma"], ["frontal"],
+                        band_avg=band_avg, table_format="none")
+    store = load_feature_store(str(tmp_path))
+    assert store["subject_id"] == ["S01", "S02"]
+    assert store["arrays"] == {"band_avg": [2, 3, 5]}
+    np.testing.assert_array_equal(store["band_avg"], band_avg)
+    assert "psd" not in store
@@ -0,0 +1,26 @@
+import json
+
+from job_scheduler import StatusFile
+
+
+def test_pipeline_status_updates_the_steps_it_covers(tmp_path):
+    path = tmp_path / "step_status.json"
+    status = StatusFile(str(path))
+    status.ensure()
+    status.update("step1", True)
+    status.update("pipeline", True)
+
+    saved = json.loads(path.read_text(encoding="utf-8"))
+    assert saved == {"step1": True, "step2": True, "step3": True, "step4": True}
+
+    status.update("pipeline", False)
+    assert [status.read(step) for step in ("step1", "step2", "step3", "step4")] == [True, False, False, False]
+
+
+def test_corrupt_status_file_reads_as_not_done(tmp_path):
+    path = tmp_path / "step_status.json"
+    path.write_text("{", encoding="utf-8")
+    status = StatusFile(str(path))
+    assert not status.read("step2")
+    status.update("step2", True)
+    assert status.read("step2")
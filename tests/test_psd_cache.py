@@ -0,0 +1,92 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mne")  # make_key 的键包含 mne 版本
+
+from psd_cache import PSDCache, psd_cache_from_args
+from checkpoint import psd_checkpoint_dir
+
+WELCH = {"method": "welch", "fmin": 0, "fmax": 40}
+
+
+def _make_set(folder, name="S1_rest_processed", payload=b"data"):
+    set_path = os.path.join(folder, name + ".set")
+    with open(set_path, "wb") as f:
+        f.write(payload)
+    with open(os.path.join(folder, name + ".fdt"), "wb") as f:
+        f.write(payload * 2)
+    return set_path
+
+
+def _store(cache, key, n_chan=4, n_freq=8):
+    psds = np.random.default_rng(0).random((n_chan, n_freq))
+    cache.store(key, psds, np.arange(n_freq, dtype=float), [f"C{i}" for i in range(n_chan)], {"sfreq": 500.0})
+    return psds
+
+
+def test_key_depends_on_files_and_params(tmp_path):
+    cache = PSDCache(str(tmp_path / "cache"))
+    set_path = _make_set(str(tmp_path))
+    key = cache.make_key(set_path, WELCH)
+    assert key == cache.make_key(set_path, WELCH)
+    assert key != cache.make_key(set_path, dict(WELCH, fmax=30))
+
+    # .fdt 变化（大小 / 修改时间）后键改变
+    with open(os.path.join(str(tmp_path), "S1_rest_processed.fdt"), "ab") as f:
+        f.write(b"more")
+    assert cache.make_key(set_path, WELCH) != key
+
+
+def test_content_keys_survive_copies(tmp_path):
+    cache = PSDCache(str(tmp_path / "cache"), hash_mode="content")
+    a = _make_set(str(tmp_path))
+    os.makedirs(tmp_path / "copy")
+    b = _make_set(str(tmp_path / "copy"))
+    assert cache.make_key(a, WELCH) == cache.make_key(b, WELCH)
+
+
+def test_store_load_roundtrip(tmp_path):
+    cache = PSDCache(str(tmp_path / "cache"))
+    psds = _store(cache, "k1")
+    assert cache.contains("k1")
+    entry = cache.load("k1")
+    np.testing.assert_array_equal(entry["psds"], psds)
+    assert entry["ch_names"] == ["C0", "C1", "C2", "C3"]
+    assert entry["info"] == {"sfreq": 500.0}
+    assert cache.load("missing") is None
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = PSDCache(str(tmp_path / "cache"))
+    for i, key in enumerate(["old", "mid", "new"]):
+        _store(cache, key)
+        t = time.time() - 100 + i * 10
+        os.utime(cache._entry_path(key), (t, t))
+    entry_size = os.path.getsize(cache._entry_path("old"))
+    cache.load("old")  # 读取即刷新最近使用时间
+    cache.max_bytes = 2 * entry_size
+    assert cache.evict() == 1
+    assert not cache.contains("mid")
+    assert cache.contains("old") and cache.contains("new")
+
+
+def test_unbounded_cache_never_evicts(tmp_path):
+    cache = PSDCache(str(tmp_path / "cache"), max_bytes=None)
+    for key in ("a", "b"):
+        _store(cache, key)
+    assert cache.evict() == 0
+    assert cache.contains("a") and cache.contains("b")
+
+
+def test_cache_from_args(tmp_path):
+    base = str(tmp_path / "out")
+    assert psd_cache_from_args({"base_output_dir": base}) is None
+    checkpoint_cache = psd_cache_from_args({"base_output_dir": base, "checkpoint": True})
+    assert checkpoint_cache.cache_dir == psd_checkpoint_dir(base)
+    assert checkpoint_cache.max_bytes is None
+    explicit = psd_cache_from_args({"base_output_dir": base, "checkpoint": True,
+                                    "psd_cache_dir": str(tmp_path / "c"), "psd_cache_max_mb": 1})
+    assert explicit.cache_dir == str(tmp_path / "c") and explicit.max_bytes == 1024 ** 2
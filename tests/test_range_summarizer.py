@@ -0,0 +1,60 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import age_parameters
+from age_parameters import RangeSummarizer
+
+
+def test_submit_does_not_wait_for_the_summary(monkeypatch):
+    release = threading.Event()
+    summarized = []
+
+    def slow_summary(output_dir, results, render=True, **kwargs):
+        assert not render  # 渲染由 RangeSummarizer 提交到共享进程池
+        release.wait(10)
+        if output_dir == "bad":
+            raise ValueError("boom")
+        summarized.append(output_dir)
+
+    monkeypatch.setattr(age_parameters, "summarize_age_group", slow_summary)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        summarizer = RangeSummarizer(pool, render=False)
+        summarizer.submit("0-4", "good", [])
+        summarizer.submit("4-8", "bad", [])
+        # 汇总仍在进行时调度循环可以继续
+        assert summarized == [] and summarizer.completed == []
+        release.set()
+        completed, failed = summarizer.wait()
+    assert completed == ["0-4"]
+    assert failed == ["4-8"]
+
+
+@pytest.mark.parametrize("fail_chunk", [None, 1])
+def test_render_chunks_go_to_the_shared_pool(monkeypatch, fail_chunk):
+    calls = []
+
+    def render(output_dir, subject_ids, template):
+        calls.append((threading.current_thread().name, list(subject_ids), template))
+        if fail_chunk is not None and len(calls) == fail_chunk + 1:
+            raise RuntimeError("render failed")
+        return 0.5
+
+    monkeypatch.setattr(age_parameters, "summarize_age_group", lambda *args, **kwargs: None)
+    monkeypatch.setattr(age_parameters, "load_topomap_data", lambda output_dir: (["S1", "S2", "S3"], None, None, None))
+    monkeypatch.setattr(age_parameters, "_render_topomaps_timed", render)
+    age_parameters.stage_times.clear()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared") as pool:
+        summarizer = RangeSummarizer(pool, render=True, render_workers=2)
+        summarizer.submit("0-4", "out", [])
+        completed, failed = summarizer.wait()
+
+    assert sorted(ids for _, ids, _ in calls) == [["S1", "S3"], ["S2"]]
+    assert [template for _, _, template in calls].count(True) == 1
+    assert all(name.startswith("shared") for name, _, _ in calls)
+    if fail_chunk is None:
+        assert (completed, failed) == (["0-4"], [])
+        assert age_parameters.stage_times["render"] == pytest.approx(1.0)
+    else:
+        assert (completed, failed) == ([], ["0-4"])
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import step_worker
+from step_worker import StepWorker
+
+POOL_SCRIPT = textwrap.dedent("""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if __name__ == "__main__":
+        with ProcessPoolExecutor(2) as pool:
+            print("pool", sum(pool.map(abs, [-1, -2, -3])), flush=True)
+""")
+
+
+def _run_with_timeout(worker, script, args, timeout=60):
+    lines = []
+    result = {}
+
+    def run():
+        result["returncode"] = worker.run_script(str(script), args, lines.append)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        step_worker.kill_process_tree(worker.process)
+        raise AssertionError(f"worker job did not finish within {timeout}s; output: {lines!r}")
+    return result["returncode"], "".join(lines)
+
+
+def test_pooled_script_does_not_hang(tmp_path):
+    script = tmp_path / "pooled.py"
+    script.write_text(POOL_SCRIPT, encoding="utf-8")
+    worker = StepWorker(preload=False)
+    try:
+        for _ in range(2):  # 第二次复用同一个 worker
+            returncode, output = _run_with_timeout(worker, script, {})
+            assert returncode == 0, output
+            assert "pool 6" in output
+    finally:
+        worker.close()
+
+
+def test_output_forwarded_when_parent_stderr_is_a_file(tmp_path):
+    # 父进程的 stdout / stderr 为普通文件时，重定向后的流不能沿用原流的 seekable 状态
+    script = tmp_path / "hello.py"
+    script.write_text("import sys\nprint('out')\nprint('err', file=sys.stderr)\n", encoding="utf-8")
+    client = tmp_path / "client.py"
+    client.write_text(textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {repr(os.path.dirname(step_worker.WORKER_SCRIPT))})
+        from step_worker import StepWorker
+        worker = StepWorker(preload=False)
+        lines = []
+        rc = worker.run_script({repr(str(script))}, {{}}, lines.append)
+        worker.close()
+        print(rc, "".join(lines).split())
+    """), encoding="utf-8")
+    with open(tmp_path / "stderr.log", "w") as err_file:
+        result = subprocess.run([sys.executable, str(client)], stdout=subprocess.PIPE, stderr=err_file,
+                                universal_newlines=True, timeout=60)
+    assert result.stdout.strip() == "0 ['out', 'err']", result.stdout
+
+
+def test_script_exit_code(tmp_path):
+    script = tmp_path / "exit3.py"
+    script.write_text("import sys\nsys.exit(3)\n", encoding="utf-8")
+    worker = StepWorker(preload=False)
+    try:
+        returncode, _ = _run_with_timeout(worker, script, {})
+        assert returncode == 3
+    finally:
+        worker.close()
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+mne = pytest.importorskip("mne")
+
+import topomap_cache
+from age_parameters import _pyplot, bands, render_subject_topomap
+from topomap_cache import TopomapRenderer, _BandFigure, get_renderer, plot_topomap
+
+CH_NAMES = ["Fp1", "Fp2", "F3", "F4", "C3", "C4", "P3", "P4", "O1", "O2", "Fz", "Cz", "Pz"]
+
+
+@pytest.fixture
+def info():
+    topomap_cache._renderers.clear()
+    info = mne.create_info(CH_NAMES, sfreq=500.0, ch_types="eeg")
+    info.set_montage("standard_1005")
+    yield info
+    topomap_cache._renderers.clear()
+
+
+def _broken(*args, **kwargs):
+    raise AttributeError("module 'mne.viz.topomap' has no attribute '_draw_outlines'")
+
+
+def test_plot_falls_back_when_cached_draw_fails(info, monkeypatch):
+    assert get_renderer(info) is not None
+    monkeypatch.setattr(TopomapRenderer, "plot", _broken)
+
+    plt = _pyplot()
+    fig, ax = plt.subplots()
+    im = plot_topomap(np.arange(len(CH_NAMES), dtype=float), info, ax)
+    plt.close(fig)
+    assert im is not None
+    assert get_renderer(info) is None
+
+
+def test_subject_topomap_falls_back_when_update_fails(info, monkeypatch, tmp_path):
+    assert get_renderer(info) is not None
+    monkeypatch.setattr(_BandFigure, "update", _broken)
+
+    output_path = tmp_path / "S01.jpg"
+    values = np.random.default_rng(0).random((len(CH_NAMES), len(bands)))
+    render_subject_topomap(values, info, str(output_path))
+    assert output_path.stat().st_size > 0
+    assert get_renderer(info) is None
+
+
+# Step 4 数据的 28 通道布局（与 benchmarks/bench_aggregation.py 相同）
+CH_NAMES_28 = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'FC5', 'FC1', 'FC2', 'FC6', 'T7', 'C3', 'Cz', 'C4', 'T8',
+               'CP5', 'CP1', 'CP2', 'CP6', 'P7', 'P3', 'Pz', 'P4', 'P8', 'O1', 'Oz', 'O2']
+
+
+@pytest.mark.parametrize("ch_names", [CH_NAMES, CH_NAMES_28], ids=["13ch", "28ch"])
+@pytest.mark.parametrize("signed", [False, True], ids=["positive", "signed"])
+def test_grid_values_match_plot_topomap(ch_names, signed):
+    # 依赖 mne 内部函数的快速路径在当前 mne 版本下必须可用且与 plot_topomap 的插值一致
+    topomap_cache._renderers.clear()
+    info = mne.create_info(ch_names, sfreq=500.0, ch_types="eeg")
+    info.set_montage("standard_1005")
+    renderer = get_renderer(info)
+    assert renderer is not None
+
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal(len(ch_names)) if signed else rng.random(len(ch_names))
+    plt = _pyplot()
+    fig, ax = plt.subplots()
+    reference = np.ma.filled(mne.viz.plot_topomap(data, info, axes=ax, show=False)[0].get_array(), np.nan)
+    plt.close(fig)
+    topomap_cache._renderers.clear()
+
+    # 绘制同样只能用到当前 mne 版本中存在的内部函数
+    fig, ax = plt.subplots()
+    im, _ = renderer.plot(data, ax)
+    plt.close(fig)
+    np.testing.assert_array_equal(np.ma.filled(im.get_array(), np.nan), renderer.grid_values(data))
+
+    grid = renderer.grid_values(data)
+    assert grid.shape == reference.shape
+    np.testing.assert_array_equal(np.isnan(grid), np.isnan(reference))
+    scale = np.max(np.abs(data))
+    np.testing.assert_allclose(grid[~np.isnan(grid)], reference[~np.isnan(reference)], rtol=0, atol=1e-6 * scale)
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+pytest.importorskip("mne")
+
+import watch_daemon
+from watch_daemon import STATE_FILE, WatchDaemon
+
+AGES = {"S01": 2.0, "S02": 3.0, "S03": 6.0}
+RANGES = ["0-4", "4-8"]
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    processed = tmp_path / "processed"
+    processed.mkdir()
+    for sid in AGES:
+        (processed / f"{sid}_processed.set").write_bytes(sid.encode())
+        (processed / f"{sid}_processed.fdt").write_bytes(b"data")
+
+    calls = []
+    monkeypatch.setattr(watch_daemon, "load_age_index", lambda file_path, cache_dir=None: (AGES, True))
+    monkeypatch.setattr(watch_daemon, "run_age_analysis",
+                        lambda data_dir, output_dir, file_list=None, **kwargs:
+                        calls.append((os.path.basename(output_dir), sorted(map(os.path.basename, file_list)))))
+    return tmp_path, calls
+
+
+def _daemon(tmp_path, stage_mode="hardlink"):
+    return WatchDaemon(None, str(tmp_path / "processed"), "ages.xlsx", str(tmp_path / "step3"),
+                       str(tmp_path / "step4"), RANGES, stage_mode=stage_mode, settle_seconds=0)
+
+
+@pytest.mark.parametrize("stage_mode", ["hardlink", "manifest"])
+def test_restart_only_reanalyzes_changed_ranges(folders, stage_mode):
+    tmp_path, calls = folders
+    assert _daemon(tmp_path, stage_mode).run_once() == {"0-4", "4-8"}
+    assert [r for r, _ in calls] == ["0-4", "4-8"]
+    assert os.path.exists(tmp_path / "step3" / STATE_FILE)
+
+    # 重启（如 --once 再次运行）且没有变化：不重新放置，也不重新分析
+    calls.clear()
+    assert _daemon(tmp_path, stage_mode).run_once() == set()
+    assert calls == []
+
+    # 只有 S03 所在的年龄段需要重新分析
+    (tmp_path / "processed" / "S03_processed.set").write_bytes(b"reprocessed")
+    calls.clear()
+    assert _daemon(tmp_path, stage_mode).run_once() == {"4-8"}
+    assert calls == [("4-8", ["S03_processed.set"])]
+
+
+def test_interrupted_analysis_resumes_after_restart(folders, monkeypatch):
+    tmp_path, calls = folders
+
+    def interrupted(data_dir, output_dir, file_list=None, **kwargs):
+        if output_dir.endswith("4-8"):
+            raise KeyboardInterrupt
+        calls.append(os.path.basename(output_dir))
+
+    monkeypatch.setattr(watch_daemon, "run_age_analysis", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _daemon(tmp_path).run_once()
+    assert calls == ["0-4"]
+
+    monkeypatch.setattr(watch_daemon, "run_age_analysis",
+                        lambda data_dir, output_dir, file_list=None, **kwargs:
+                        calls.append(os.path.basename(output_dir)))
+    calls.clear()
+    assert _daemon(tmp_path).run_once() == {"4-8"}
+    assert calls == ["4-8"]
+
+
+def test_state_ignored_when_stage_mode_changes(folders):
+    tmp_path, calls = folders
+    _daemon(tmp_path, "manifest").run_once()
+    calls.clear()
+    _daemon(tmp_path, "hardlink").run_once()
+    assert sorted(r for r, _ in calls) == ["0-4", "4-8"]
+    assert os.path.exists(tmp_path / "step3" / "4-8" / "S03_processed.set")
@@ -0,0 +1,214 @@
+"""
+topomap_cache.py
+
+功能：
+- 同一电极布局的拓扑图重复绘制时复用插值：mne.viz.plot_topomap 每次调用都会重新计算
+  电极二维投影、头部轮廓、外推点三角剖分和 Clough-Tocher 插值；而同一年龄段的所有被试
+  （以及 template.jpg）共用同一套电极布局
+- 每种布局只计算一次 (网格像素, 通道) 插值矩阵：插值对通道数值是线性的（边界外推点取相邻
+  通道均值，也是线性的），因此用单位矩阵作为数值一次性插值即可得到该矩阵，之后每个频段的
+  图像只需一次矩阵乘法
+- 绘制（色图、等高线、头部轮廓、电极点、裁剪）与 mne.viz.plot_topomap 的默认参数一致，
+  图像与原来视觉上相同（插值的梯度估计为迭代求解，像素值差异在 1e-6 量级）
+- 个体拓扑图（一行五个频段）的图形按布局复用：坐标轴、标题、头部轮廓、电极点与 tight_layout
+  只绘制 / 计算一次，之后每个被试只更新图像数据与等高线再保存
+- 按 (通道名, 电极坐标) 缓存，LRU 上限 MAX_RENDERERS；当前 mne 版本缺少所需的内部函数
+  或布局中含非 EEG 通道时 get_renderer 返回 None，调用方回退到 mne.viz.plot_topomap
+- 依赖 mne.viz.topomap 的内部函数（environment.yml 限定的 mne 1.6-1.13 中均可用；头部裁剪轮廓在
+  1.13 中由 _get_patch 更名为 _make_head_patch，图层顺序 _TOPOMAP_ZORDER 为 1.13 新增，两者都兼容），
+  mne 版本变化时构造之后的绘制（plot / update）也可能出错：调用方捕获 RENDER_ERRORS 后调用
+  disable_renderer，该布局之后一律使用 mne.viz.plot_topomap
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_RENDERERS = 8
+GRID_RES = 64          # 与 mne.viz.plot_topomap 的默认 res 相同
+N_CONTOURS = 6
+
+# 内部函数签名 / 返回值变化时可能出现的异常；构造与绘制失败时都回退到 mne.viz.plot_topomap
+RENDER_ERRORS = (ImportError, AttributeError, TypeError, ValueError, RuntimeError, KeyError, IndexError)
+
+_renderers = OrderedDict()
+
+
+class TopomapRenderer:
+    """
+    一种电极布局的缓存拓扑图绘制器。
+
+    参数：
+    info : mne.Info
+        只含 EEG 通道、带电极位置的 Info（如 raw.info）。
+    """
+
+    def __init__(self, info):
+        from scipy.interpolate import CloughTocher2DInterpolator
+        from mne.channels.layout import _find_topomap_coords
+        from mne.viz import topomap as _topomap
+
+        self._topomap = _topomap
+        # mne < 1.13：_get_patch，且不设置图层顺序（按绘制顺序叠放）
+        self._head_patch = getattr(_topomap, "_make_head_patch", None) or _topomap._get_patch
+        self._zorder = getattr(_topomap, "_TOPOMAP_ZORDER", {})
+        picks = list(range(len(info.ch_names)))
+        sphere = _topomap._check_sphere(None, info)
+        self.pos = _find_topomap_coords(info, picks=picks, sphere=sphere)[:, :2]
+        self.outlines = _topomap._make_head_outlines(sphere, self.pos, "head", (0.0, 0.0))
+        self.extrapolate = _topomap._check_extrapolate("auto", "eeg")
+        self.extent, self.Xi, self.Yi, self.interp = _topomap._setup_interp(
+            self.pos, GRID_RES, "cubic", self.extrapolate, self.outlines, "mean")
+
+        # 数值 = 单位矩阵时的插值结果即 (像素, 通道) 插值矩阵
+        n_chan = self.pos.shape[0]
+        values = np.vstack([np.eye(n_chan), self._border_matrix(n_chan)])
+        grid = CloughTocher2DInterpolator(self.interp.tri, values)(self.Xi, self.Yi)
+        weights = grid.reshape(-1, n_chan)
+        self.valid = ~np.isnan(weights).any(axis=1)   # 外推区域之外的像素为 NaN
+        self.weights = np.ascontiguousarray(weights[self.valid])
+        self._figures = {}
+
+    def _border_matrix(self, n_chan):
+        """外推点数值（border='mean'：相邻通道均值）对通道数值的线性映射 (n_extra, n_chan)。"""
+        n_extra = self.interp.n_extra
+        border = np.zeros((n_extra, n_chan))
+        indices, indptr = self.interp.tri.vertex_neighbor_vertices
+        used = np.zeros(n_extra, bool)
+        for idx in range(n_extra):
+            extra_idx = n_chan + idx
+            ngb = indptr[indices[extra_idx]:indices[extra_idx + 1]]
+            ngb = ngb[ngb < n_chan]
+            if len(ngb) > 0:
+                used[idx] = True
+                border[idx, ngb] = 1.0 / len(ngb)
+        if not used.all() and used.any():
+            border[~used] = border[used].mean(axis=0)
+        return border
+
+    def grid_values(self, data):
+        """通道数值 (n_chan,) -> 插值网格 (GRID_RES, GRID_RES)，头部以外为 NaN。"""
+        Zi = np.full(self.Xi.size, np.nan)
+        Zi[self.valid] = self.weights @ np.asarray(data, dtype=np.float64)
+        return Zi.reshape(self.Xi.shape)
+
+    def _limits(self, data):
+        # 与 plot_topomap 相同：非负数据的色标为 [0, max]，否则为 [-max|x|, max|x|]
+        norm = min(data) >= 0
+        return norm, self._topomap._setup_vmin_vmax(data, None, None, norm)
+
+    def _contour(self, ax, Zi, clip_path):
+        if ((Zi == Zi[0, 0]) | np.isnan(Zi)).all():  # 常数值无法绘制等高线
+            return None
+        cont = ax.contour(self.Xi, self.Yi, Zi, N_CONTOURS, colors="k", linewidths=0.5,
+                          zorder=self._zorder.get("contours"))
+        if clip_path is not None:
+            cont.set_clip_path(clip_path)
+        return cont
+
+    def plot(self, data, ax, cmap=None):
+        """在 ax 上绘制拓扑图，返回 (image, contours)，与 mne.viz.plot_topomap(data, info, axes=ax) 相同。"""
+        from matplotlib.colors import Normalize
+        tm = self._topomap
+
+        data = np.asarray(data)
+        norm, (vmin, vmax) = self._limits(data)
+        cmap = tm._get_cmap(cmap if cmap is not None else ("Reds" if norm else "RdBu_r"))
+        Zi = self.grid_values(data)
+
+        tm._prepare_topomap(self.pos, ax)
+        head_patch = self._head_patch(self.outlines, self.extrapolate, self.interp, ax)
+        im = ax.imshow(Zi, cmap=cmap, origin="lower", aspect="equal", extent=self.extent,
+                       interpolation="bilinear", norm=Normalize(vmin=vmin, vmax=vmax),
+                       zorder=self._zorder.get("imshow"))
+        if head_patch is not None:
+            im.set_clip_path(head_patch)
+        cont = self._contour(ax, Zi, im.get_clip_path())
+        tm._topomap_plot_sensors(self.pos[:, 0], self.pos[:, 1], sensors=True, ax=ax)
+        tm._draw_outlines(ax, self.outlines)
+        return im, cont
+
+    def band_figure(self, titles, figsize, cmap=None):
+        """一行 len(titles) 个拓扑图的可复用图形（按标题 / 尺寸 / 色图缓存）。"""
+        key = (tuple(titles), tuple(figsize), cmap)
+        if key not in self._figures:
+            self._figures[key] = _BandFigure(self, titles, figsize, cmap)
+        return self._figures[key]
+
+
+class _BandFigure:
+    """静态元素只绘制一次的一行拓扑图；update() 只替换各子图的图像数据、色标范围与等高线。"""
+
+    def __init__(self, renderer, titles, figsize, cmap):
+        from matplotlib.figure import Figure  # 不经过 pyplot，缓存的图形不会留在 pyplot 的图形列表中
+
+        self.renderer = renderer
+        self.fig = Figure(figsize=figsize)
+        self.axes = self.fig.subplots(1, len(titles))
+        self.images, self.contours = [], []
+        zeros = np.zeros(renderer.pos.shape[0])
+        for ax, title in zip(self.axes, titles):
+            im, cont = renderer.plot(zeros, ax, cmap=cmap)
+            ax.set_title(title)
+            self.images.append(im)
+            self.contours.append(cont)
+        self.fig.tight_layout()
+
+    def update(self, values):
+        """values : (n_chan, n_axes)，每列为一个子图的通道数值。"""
+        for i, (ax, im) in enumerate(zip(self.axes, self.images)):
+            data = np.asarray(values[:, i])
+            _, (vmin, vmax) = self.renderer._limits(data)
+            Zi = self.renderer.grid_values(data)
+            im.set_data(Zi)
+            im.set_clim(vmin, vmax)
+            if self.contours[i] is not None:
+                self.contours[i].remove()
+            self.contours[i] = self.renderer._contour(ax, Zi, im.get_clip_path())
+        return self.fig
+
+
+def _layout_key(info):
+    positions = np.array([ch["loc"][:3] for ch in info["chs"]])
+    return tuple(info.ch_names), positions.tobytes()
+
+
+def get_renderer(info):
+    """
+    返回 info 电极布局的 TopomapRenderer（LRU 缓存）；无法使用缓存绘制时返回 None。
+    """
+    key = _layout_key(info)
+    if key in _renderers:
+        _renderers.move_to_end(key)
+        return _renderers[key]
+    try:
+        if set(info.get_channel_types()) != {"eeg"}:
+            raise ValueError("non-EEG channels")
+        renderer = TopomapRenderer(info)
+    except RENDER_ERRORS as e:
+        print(f"[提示] 拓扑图插值缓存不可用（{e}），使用 mne.viz.plot_topomap")
+        renderer = None
+    _renderers[key] = renderer
+    while len(_renderers) > MAX_RENDERERS:
+        _renderers.popitem(last=False)
+    return renderer
+
+
+def disable_renderer(info, error):
+    """缓存绘制失败后调用：该布局之后 get_renderer 返回 None，回退到 mne.viz.plot_topomap。"""
+    print(f"[提示] 拓扑图插值缓存绘制失败（{error!r}），使用 mne.viz.plot_topomap")
+    _renderers[_layout_key(info)] = None
+
+
+def plot_topomap(data, info, ax, cmap=None):
+    """用缓存的插值绘制拓扑图；不可用或绘制失败时回退到 mne.viz.plot_topomap。返回 image。"""
+    renderer = get_renderer(info)
+    if renderer is not None:
+        try:
+            return renderer.plot(data, ax, cmap=cmap)[0]
+        except RENDER_ERRORS as e:
+            disable_renderer(info, e)
+            ax.clear()  # 清除绘制到一半的元素
+    import mne
+    kwargs = {} if cmap is None else {"cmap": cmap}
+    return mne.viz.plot_topomap(data, info, axes=ax, show=False, **kwargs)[0]
@@ -0,0 +1,373 @@
+"""
+watch_daemon.py
+
+功能：
+- 无界面的常驻进程：监视 Step 1 输出文件夹（.vhdr/.vmrk/.eeg）与 Step 2 输出文件夹（.set/.fdt），
+  新数据到达后自动完成 预处理 → 年龄匹配 → Step 4 增量分析，无需在 GUI 中逐步点击
+- 安装了 watchdog 时用文件系统事件（Linux 上为 inotify）唤醒扫描，否则按固定间隔轮询
+- 去抖：一组文件（.vhdr/.vmrk/.eeg 或 .set/.fdt）全部存在且大小、修改时间在 settle_seconds 内
+  没有变化才视为写入完成，避免处理复制 / 保存到一半的文件
+- Step 4 使用增量模式（cohort_state.npz），只计算新被试的 PSD，不重算整个年龄段
+- 已放置的被试记录在 Step 3 目标文件夹的 .watch_state.json（与 manifest.json 同目录），
+  重启或 --once 运行时只处理文件有变化的被试，只重新分析有变化的年龄段
+
+用法：
+    python watch_daemon.py --raw_folder ... --processed_folder ... --file_path ages.xlsx \\
+        --target_folder_month ... --base_output_dir ... --age_range_list 0-4 4-8 [--once]
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from age_parameters import run_age_analysis, subject_id_of
+from age_index import load_age_index, AgeRanges
+from staging import STAGE_MODES, stage_file, write_manifest
+from process_pool import init_worker, resolve_workers
+from step2_preprocess_mne import preprocess_file, require_icalabel
+
+RAW_EXTS = (".vhdr", ".vmrk", ".eeg")
+STATE_FILE = ".watch_state.json"
+
+
+class WatchDaemon:
+    """
+    监视文件夹并增量处理新被试。
+
+    参数：
+    raw_folder : str or None
+        Step 1 输出文件夹；为 None 时不做预处理（例如仍使用 MATLAB 预处理）。
+    processed_folder : str
+        Step 2 输出文件夹（_processed.set）。
+    file_path, target_folder_month, age_range_list, stage_mode :
+        与 Step 3 相同。
+    base_output_dir : str
+        Step 4 输出目录。
+    settle_seconds : float
+        文件大小 / 修改时间保持不变多久后视为写入完成。
+    poll_interval : float
+        轮询间隔（秒）；使用文件系统事件时为最长等待时间。
+    workers : int
+        预处理与 Step 4 的进程数（<= 0 表示全部 CPU 核）。
+    step4_kwargs : dict
+        传给 run_age_analysis 的其他参数（如 render、psd_cache、streaming）。
+    """
+
+    def __init__(self, raw_folder, processed_folder, file_path, target_folder_month, base_output_dir,
+                 age_range_list, stage_mode="manifest", settle_seconds=30.0, poll_interval=10.0,
+                 workers=1, blas_threads=1, step4_kwargs=None):
+        if stage_mode not in STAGE_MODES:
+            raise ValueError(f"stage_mode 必须为 {STAGE_MODES} 之一: {stage_mode}")
+        if raw_folder:
+            require_icalabel()
+        self.raw_folder = raw_folder
+        self.processed_folder = processed_folder
+        self.file_path = file_path
+        self.target_folder_month = target_folder_month
+        self.base_output_dir = base_output_dir
+        self.age_range_list = list(age_range_list)
+        self.age_ranges = AgeRanges(self.age_range_list)
+        self.stage_mode = stage_mode
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.workers = workers
+        self.blas_threads = blas_threads
+        self.step4_kwargs = dict(step4_kwargs or {})
+
+        self.wake = threading.Event()
+        self._last_stat = {}          # path -> ((size, mtime_ns), 首次观察到该状态的时间)
+        self.range_files = {age_range: {} for age_range in self.age_range_list}  # 年龄段 -> {被试ID: (.set 路径, 文件状态)}
+        self.pending = set()          # 已放置新被试、尚未分析的年龄段
+        self.reported_unmatched = set()
+        self.failed_raw = {}          # .vhdr 路径 -> 失败时的文件状态，文件未变化时不再重试
+
+        os.makedirs(os.path.join(processed_folder, "interp_chan"), exist_ok=True)
+        os.makedirs(target_folder_month, exist_ok=True)
+        os.makedirs(base_output_dir, exist_ok=True)
+        self.state_path = os.path.join(target_folder_month, STATE_FILE)
+        self._load_state()
+
+    # ---------- 状态 ----------
+    def _load_state(self):
+        """
+        读取上次运行保存的放置记录；放置方式或预处理文件夹不同时忽略（重新放置全部被试）。
+        """
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if (state["stage_mode"] != self.stage_mode
+                    or state["processed_folder"] != os.path.abspath(self.processed_folder)):
+                return
+            for age_range, files in state["ranges"].items():
+                if age_range in self.range_files:
+                    self.range_files[age_range] = {sid: (staged, tuple(sig)) for sid, (staged, sig) in files.items()}
+            self.pending = set(state.get("pending", [])) & set(self.range_files)
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        n_subjects = sum(len(files) for files in self.range_files.values())
+        print(f"[监视] 读取放置记录: {n_subjects} 个被试已放置" +
+              (f"，待分析年龄段: {', '.join(sorted(self.pending))}" if self.pending else ""))
+
+    def _save_state(self):
+        """写出放置记录（临时文件 + 原子重命名）。"""
+        state = {
+            "stage_mode": self.stage_mode,
+            "processed_folder": os.path.abspath(self.processed_folder),
+            "ranges": {age_range: {sid: [staged, list(sig)] for sid, (staged, sig) in files.items()}
+                       for age_range, files in self.range_files.items()},
+            "pending": sorted(self.pending),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.target_folder_month, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # ---------- 去抖 ----------
+    def _stable(self, paths, now):
+        """
+        paths 全部存在，且大小与修改时间已保持 settle_seconds 不变
+        （首次观察到时，修改时间早于 settle_seconds 之前的文件直接视为稳定）。
+        """
+        ready = True
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            sig = (st.st_size, st.st_mtime_ns)
+            prev = self._last_stat.get(path)
+            if prev is None or prev[0] != sig:
+                self._last_stat[path] = (sig, now)
+                prev = self._last_stat[path]
+            if now - prev[1] < self.settle_seconds and now - st.st_mtime < self.settle_seconds:
+                ready = False
+        return ready
+
+    @staticmethod
+    def _stems(folder, ext):
+        try:
+            names = [entry.name for entry in os.scandir(folder) if entry.is_file()]
+        except OSError:
+            return []
+        return sorted(os.path.splitext(name)[0] for name in names if name.lower().endswith(ext))
+
+    # ---------- 扫描 ----------
+    def _ready_raw(self, now):
+        """写入完成、尚未预处理（或 .vhdr 比 _processed.set 新）的原始数据。"""
+        ready = []
+        for stem in self._stems(self.raw_folder, ".vhdr"):
+            paths = [os.path.join(self.raw_folder, stem + ext) for ext in RAW_EXTS]
+            processed = os.path.join(self.processed_folder, f"{stem}_processed.set")
+            if os.path.exists(processed) and os.path.getmtime(processed) >= os.path.getmtime(paths[0]):
+                continue
+            if not self._stable(paths, now):
+                continue
+            sig = tuple(self._last_stat[p][0] for p in paths)
+            if self.failed_raw.get(paths[0]) == sig:
+                continue
+            ready.append((paths[0], sig))
+        return ready
+
+    def _ready_processed(self, now, trusted=()):
+        """写入完成的 .set（及同名 .fdt）；trusted 中的文件由本进程刚写出，无需等待。"""
+        ready = []
+        for stem in self._stems(self.processed_folder, ".set"):
+            set_path = os.path.join(self.processed_folder, stem + ".set")
+            paths = [set_path]
+            fdt_path = os.path.join(self.processed_folder, stem + ".fdt")
+            if os.path.exists(fdt_path):
+                paths.append(fdt_path)
+            if set_path in trusted or self._stable(paths, now):
+                ready.append(set_path)
+        return ready
+
+    # ---------- 处理 ----------
+    def _preprocess(self, ready_raw):
+        if not ready_raw:
+            return set()
+        print(f"\n[监视] 预处理 {len(ready_raw)} 个新文件")
+        produced = set()
+        n_workers = max(1, min(resolve_workers(self.workers), len(ready_raw)))
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                                 initargs=(self.blas_threads,)) as pool:
+            results = pool.map(preprocess_file, [p for p, _ in ready_raw],
+                               [self.processed_folder] * len(ready_raw))
+            for (vhdr_path, sig), (filename, messages, ok) in zip(ready_raw, results):
+                print(f" Processing: {filename}\n{messages}\n {'processed successfully' if ok else 'failed'}.")
+                stem = os.path.splitext(filename)[0]
+                if ok:
+                    produced.add(os.path.join(self.processed_folder, f"{stem}_processed.set"))
+                else:
+                    self.failed_raw[vhdr_path] = sig
+        return produced
+
+    def _bin(self, set_paths):
+        """年龄匹配并放置新 .set，返回有新被试（或文件已变化）的年龄段集合。"""
+        age_index, _ = load_age_index(self.file_path, cache_dir=self.target_folder_month)
+        changed = set()
+
+        # 源文件已被删除的被试：从年龄段中移除（增量分析时同时从群体统计中移除）
+        for age_range, files in self.range_files.items():
+            for sid in [sid for sid, (staged, _) in files.items() if not os.path.exists(staged)]:
+                del files[sid]
+                changed.add(age_range)
+
+        for set_path in set_paths:
+            sid = subject_id_of(set_path)
+            age_range = self.age_ranges.find(age_index.get(sid))
+            if age_range is None:
+                if sid not in self.reported_unmatched:
+                    self.reported_unmatched.add(sid)
+                    print(f"[监视] {sid} 不在年龄表中或月龄不在任何年龄段内，跳过")
+                continue
+            known = self.range_files[age_range].get(sid)
+            st = os.stat(set_path)
+            sig = (st.st_size, st.st_mtime_ns)
+            if known is not None and known[1] == sig:
+                continue
+
+            if self.stage_mode == "manifest":
+                staged = set_path
+            else:
+                range_dir = os.path.join(self.target_folder_month, age_range)
+                os.makedirs(range_dir, exist_ok=True)
+                for src in (set_path, os.path.splitext(set_path)[0] + ".fdt"):
+                    if os.path.exists(src):
+                        stage_file(src, os.path.join(range_dir, os.path.basename(src)), self.stage_mode)
+                staged = os.path.join(range_dir, os.path.basename(set_path))
+            self.range_files[age_range][sid] = (staged, sig)
+            print(f"{os.path.basename(set_path)} -> {age_range}")
+            changed.add(age_range)
+
+        if changed and self.stage_mode == "manifest":
+            write_manifest(self.target_folder_month,
+                           {r: [os.path.basename(p) for p, _ in files.values()] for r, files in self.range_files.items()},
+                           self.processed_folder)
+        return changed
+
+    def _analyze(self, age_ranges):
+        for age_range in self.age_range_list:
+            if age_range not in age_ranges:
+                continue
+            if not self.range_files[age_range]:
+                self.pending.discard(age_range)
+                continue
+            output_dir = os.path.join(self.base_output_dir, age_range)
+            print(f"\n正在处理年龄段: {age_range}")
+            try:
+                run_age_analysis(None, output_dir, workers=self.workers, blas_threads=self.blas_threads,
+                                 incremental=True, file_list=[p for p, _ in self.range_files[age_range].values()],
+                                 **self.step4_kwargs)
+                print(f"成功完成: {age_range}")
+            except Exception as e:
+                print(f"出错跳过: {age_range}，错误信息: {e}")
+            # 失败的年龄段同样移出待分析集合（与预处理失败的文件未变化时不再重试一致），有新变化时再分析
+            self.pending.discard(age_range)
+            self._save_state()
+
+    def run_once(self):
+        """执行一轮扫描与处理，返回本轮处理的年龄段。"""
+        now = time.time()
+        produced = set()
+        if self.raw_folder:
+            produced = self._preprocess(self._ready_raw(now))
+        changed = self._bin(self._ready_processed(time.time(), trusted=produced))
+        # 上次运行中放置后未完成分析的年龄段一并分析；放置记录在分析前保存，
+        # 每个年龄段分析后更新，中断时下次运行只补做未完成的年龄段
+        self.pending |= changed
+        changed = set(self.pending)
+        if changed:
+            self._save_state()
+            self._analyze(changed)
+        return changed
+
+    # ---------- 常驻 ----------
+    def _start_observer(self):
+        """安装了 watchdog 时启动文件系统事件监听，返回 observer；否则返回 None（轮询）。"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            print(f"[监视] 未安装 watchdog，使用轮询（间隔 {self.poll_interval:.0f}s）")
+            return None
+
+        daemon = self
+
+        class _Wake(FileSystemEventHandler):
+            def on_any_event(self, event):
+                daemon.wake.set()
+
+        observer = Observer()
+        for folder in (self.raw_folder, self.processed_folder):
+            if folder:
+                observer.schedule(_Wake(), folder, recursive=False)
+        observer.start()
+        print("[监视] 使用文件系统事件监听")
+        return observer
+
+    def run_forever(self):
+        observer = self._start_observer()
+        print(f"[监视] 开始监视: {', '.join(f for f in (self.raw_folder, self.processed_folder) if f)}")
+        try:
+            while True:
+                self.wake.clear()
+                self.run_once()
+                # 有文件仍在去抖等待时，最多等待 settle_seconds 后重新检查
+                timeout = self.poll_interval
+                if any(time.time() - t < self.settle_seconds for _, t in self._last_stat.values()):
+                    timeout = min(timeout, self.settle_seconds)
+                self.wake.wait(timeout)
+                if self.wake.is_set():
+                    time.sleep(1.0)  # 合并同一批写入产生的多个事件
+        except KeyboardInterrupt:
+            print("\n[监视] 已停止")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Watch Step 1/Step 2 output folders and process new subjects")
+    parser.add_argument("--raw_folder", default=None, help="Step 1 output folder (.vhdr/.vmrk/.eeg); omit to skip preprocessing")
+    parser.add_argument("--processed_folder", required=True, help="Step 2 output folder (_processed.set)")
+    parser.add_argument("--file_path", required=True, help="Excel file with ID and month age")
+    parser.add_argument("--target_folder_month", required=True, help="Step 3 target folder")
+    parser.add_argument("--base_output_dir", required=True, help="Step 4 output directory")
+    parser.add_argument("--age_range_list", nargs="+", required=True, help="List of age ranges, e.g. 0-4 4-8 8-12")
+    parser.add_argument("--stage_mode", choices=STAGE_MODES, default="manifest", help="How files are placed into age-range folders")
+    parser.add_argument("--settle_seconds", type=float, default=30.0, help="Seconds a file group must stay unchanged before it is processed")
+    parser.add_argument("--poll_interval", type=float, default=10.0, help="Polling interval in seconds (upper bound when using file system events)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for preprocessing and Step 4 (<= 0: all CPU cores)")
+    parser.add_argument("--blas_threads", type=int, default=1, help="BLAS/OpenMP threads per worker process")
+    parser.add_argument("--psd_cache_dir", default=None, help="Directory of the on-disk per-subject PSD cache (disabled if omitted)")
+    parser.add_argument("--no_render", action="store_true", help="Numbers only: skip topomap rendering")
+    parser.add_argument("--once", action="store_true", help="Run a single scan and exit (e.g. from cron)")
+
+    args = parser.parse_args()
+
+    step4_kwargs = {"render": not args.no_render}
+    if args.psd_cache_dir:
+        from psd_cache import PSDCache
+        step4_kwargs["psd_cache"] = PSDCache(args.psd_cache_dir)
+
+    daemon = WatchDaemon(args.raw_folder, args.processed_folder, args.file_path, args.target_folder_month,
+                         args.base_output_dir, args.age_range_list, stage_mode=args.stage_mode,
+                         settle_seconds=args.settle_seconds, poll_interval=args.poll_interval,
+                         workers=args.workers, blas_threads=args.blas_threads, step4_kwargs=step4_kwargs)
+    if args.once:
+        # 单次运行：不等待去抖，文件视为已写入完成
+        daemon.settle_seconds = 0
+        daemon.run_once()
+    else:
+        daemon.run_forever()